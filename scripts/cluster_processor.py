@@ -7,20 +7,44 @@ and generates cluster polygons with metrics based on rule configurations.
 """
 
 import os
+import hashlib
 import numpy as np
 import rasterio
-from rasterio.features import shapes
 from shapely.geometry import shape, Point, Polygon
 from shapely.ops import unary_union
-from sklearn.cluster import KMeans, DBSCAN
-from sklearn.preprocessing import StandardScaler
 from scipy import ndimage
 from scipy.ndimage import label
 import json
 import logging
-from typing import Dict, List, Tuple, Any, Optional
-from dataclasses import dataclass, asdict
+from typing import Callable, Dict, List, Tuple, Any, Optional
+from dataclasses import dataclass, asdict, field
 from rule_parser import RuleConfig, AnalysisType
+from label_stats import LabelStatistics, compute_label_statistics, filter_small_labels
+from tiled_labeling import TiledLabeler
+from raster_cache import RasterFileCache, DEFAULT_MAX_BYTES, process_raster_cache, meta_from_json, meta_to_json
+from raster_catalog import RasterCatalog
+from raster_cube import RasterCube, DEFAULT_TIMESTEP, describe_selector
+from raster_envelope import EnvelopeCache
+from kmeans_1d import KMeans1D
+from spatial_kmeans import SpatialKMeans
+from grid_dbscan import grid_dbscan, eps_to_cells
+from polygonize import polygonize_labels
+from raster_expression import RasterExpression, DeriveSet
+from polygon_lod import count_vertices, summarize_vertex_counts, DEFAULT_TOLERANCE_CELLS
+from stage_cache import StageCache, StageMemo, DEFAULT_STAGE_CACHE_BYTES, file_fingerprint, stage_key
+from pixel_sample import PixelSample
+from sample_metrics import stratified_sample
+
+# Built-in formulas, used when a rule has no matching "derive" entry
+DELTA_EXPRESSION = RasterExpression("candidate - baseline")
+HAZARD_EXPRESSION = RasterExpression("depth * speed")
+
+# The derive entry each analysis type analyses, when the rule defines it
+DERIVE_TARGETS = {
+    AnalysisType.COMPARISON: 'delta',
+    AnalysisType.RANKING: 'delta',
+    AnalysisType.HAZARD: 'hazard',
+}
 
 
 @dataclass
@@ -35,6 +59,8 @@ class ClusterMetrics:
     std_value: float
     pixel_count: int
     polygon: Dict[str, Any]  # GeoJSON-like polygon
+    simplify_tolerance: float = 0.0  # map units; the other detail tiers are built from polygon on demand (see polygon_lod.py)
+    vertex_counts: Dict[str, int] = field(default_factory=dict)  # tier -> vertices, for the tiers built so far
 
 
 @dataclass
@@ -46,33 +72,59 @@ class AnalysisResult:
     raster_info: Dict[str, Any]
     processing_params: Dict[str, Any]
     statistics: Dict[str, Any]
+    # (values, labels) of a stratified pixel sample, when metrics_sample_size is set (see sample_metrics.py)
+    metric_sample: Optional[Tuple[np.ndarray, np.ndarray]] = None
 
 
 class RasterProcessor:
     """Handles raster I/O and basic processing."""
     
-    def __init__(self, data_dir: str = "data/output"):
+    def __init__(self, data_dir: str = "data/output", use_cache: bool = True,
+                 cache_max_bytes: int = DEFAULT_MAX_BYTES):
         self.data_dir = data_dir
         self.logger = logging.getLogger(__name__)
+        self.file_cache = None
+        self.configure_cache(use_cache, cache_max_bytes)
+        self.catalog = RasterCatalog(data_dir)
+        self.envelope_cache = EnvelopeCache(os.path.join(data_dir, ".cache", "envelopes"))
+    
+    def configure_cache(self, enabled: bool, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        """Enable or disable the memory-mapped raster cache under data_dir/.cache/rasters."""
+        if enabled:
+            self.file_cache = RasterFileCache(os.path.join(self.data_dir, ".cache", "rasters"), max_bytes)
+        else:
+            self.file_cache = None
     
-    def load_raster(self, filepath: str) -> Tuple[np.ndarray, Dict[str, Any]]:
-        """Load a GeoTIFF raster and return data and metadata."""
+    def load_raster(self, filepath: str, band: int = 1) -> Tuple[np.ndarray, Dict[str, Any]]:
+        """Load a GeoTIFF raster and return data and metadata.
+        
+        Loads go through the process-wide LRU (see `raster_cache.process_raster_cache`),
+        so repeated loads of the same file in one process share one read-only array.
+        With the file cache enabled a miss is served as a memmap of a decoded copy,
+        refreshed whenever the GeoTIFF's mtime or size changes.
+        """
         try:
-            with rasterio.open(filepath) as src:
-                data = src.read(1)  # Read first band
-                meta = {
-                    'transform': src.transform,
-                    'crs': src.crs,
-                    'width': src.width,
-                    'height': src.height,
-                    'bounds': src.bounds,
-                    'nodata': src.nodata
-                }
-                return data, meta
+            return process_raster_cache().get_or_load(filepath, band, self.read_raster)
         except Exception as e:
             self.logger.error(f"Error loading raster {filepath}: {e}")
             raise
     
+    def read_raster(self, filepath: str, band: int = 1) -> Tuple[np.ndarray, Dict[str, Any]]:
+        """Read a raster band from the file cache or directly from the GeoTIFF (bypasses the in-memory LRU)."""
+        if self.file_cache is not None:
+            return self.file_cache.load(filepath, band)
+        with rasterio.open(filepath) as src:
+            data = src.read(band)
+            meta = {
+                'transform': src.transform,
+                'crs': src.crs,
+                'width': src.width,
+                'height': src.height,
+                'bounds': src.bounds,
+                'nodata': src.nodata
+            }
+            return data, meta
+    
     def save_raster(self, data: np.ndarray, filepath: str, meta: Dict[str, Any]) -> None:
         """Save data as a GeoTIFF raster."""
         try:
@@ -94,91 +146,90 @@ class RasterProcessor:
             self.logger.error(f"Error saving raster {filepath}: {e}")
             raise
     
-    def get_raster_files(self, sim_id: int, attributes: List[str]) -> Dict[str, str]:
+    def get_raster_files(self, sim_id: int, attributes: List[str],
+                         timestep: Any = DEFAULT_TIMESTEP) -> Dict[str, str]:
         """Get paths to raster files for a simulation and attributes.
-        Searches structured layout first, then legacy paths.
+        Resolved through the raster catalog (see raster_catalog.py); layouts are
+        preferred in this order. The sim's directory is re-indexed only when a
+        requested attribute or timestep is missing from the catalog, and all layouts
+        are rescanned if the sim is unknown.
+        `timestep` picks the file when an attribute was exported for several timesteps;
+        envelope selectors ("max", "min", "mean", ranges) return a cached envelope raster.
         
         New structure: data/output/raster/<db>/<group>/<run>/sim_<id>
         Model structure: data/output/raster/<model>/<run>/sim_<id>
         Old structure: data/output/<db>/<group>/<run>/rasters/sim_<id>
         Legacy: data/output/rasters/sim_<id>
         """
-        candidate_dirs = []
-        
-        # New structure: data/output/raster/<db>/<group>/<run>/sim_<id>
-        raster_root = os.path.join(self.data_dir, "raster")
-        if os.path.isdir(raster_root):
-            for db in os.listdir(raster_root):
-                dbp = os.path.join(raster_root, db)
-                if not os.path.isdir(dbp):
-                    continue
-                # Check if this is model/run structure (2 levels: model/run/sim_X)
-                # or db/group/run structure (3 levels: db/group/run/sim_X)
-                sim_dir_2level = os.path.join(dbp, f"sim_{sim_id}")
-                if os.path.isdir(sim_dir_2level):
-                    # Model structure: <model>/sim_<id>
-                    candidate_dirs.append(sim_dir_2level)
-                
-                # Check for run subdirectory (model/run/sim_X or db/group/run/sim_X)
-                for grp_or_run in os.listdir(dbp):
-                    grpp = os.path.join(dbp, grp_or_run)
-                    if not os.path.isdir(grpp):
-                        continue
-                    # Check for sim_X directly under run (model/run/sim_X structure)
-                    sim_dir_3level = os.path.join(grpp, f"sim_{sim_id}")
-                    if os.path.isdir(sim_dir_3level):
-                        candidate_dirs.append(sim_dir_3level)
-                    
-                    # Check for nested run structure (db/group/run/sim_X)
-                    for run in os.listdir(grpp):
-                        runp = os.path.join(grpp, run)
-                        if not os.path.isdir(runp):
-                            continue
-                        sim_dir_4level = os.path.join(runp, f"sim_{sim_id}")
-                        if os.path.isdir(sim_dir_4level):
-                            candidate_dirs.append(sim_dir_4level)
-        
-        # Old structured: data/output/<db>/<group>/<run>/rasters/sim_<id>
-        structured_root = os.path.join(self.data_dir)
-        if os.path.isdir(structured_root):
-            for db in os.listdir(structured_root):
-                dbp = os.path.join(structured_root, db)
-                if not os.path.isdir(dbp) or db == "raster":
-                    continue
-                for grp in os.listdir(dbp):
-                    grpp = os.path.join(dbp, grp)
-                    if not os.path.isdir(grpp):
-                        continue
-                    for run in os.listdir(grpp):
-                        sim_dir = os.path.join(grpp, run, "rasters", f"sim_{sim_id}")
-                        if os.path.isdir(sim_dir):
-                            candidate_dirs.append(sim_dir)
-        
-        # Legacy: data/output/rasters/sim_<id>
-        legacy_dir = os.path.join(self.data_dir, "rasters", f"sim_{sim_id}")
-        if os.path.isdir(legacy_dir):
-            candidate_dirs.append(legacy_dir)
-
-        # Pick first existing
-        raster_dir = None
-        for d in candidate_dirs:
-            raster_dir = d
-            break
+        files = {}
+        
+        for attr, cube in self.get_raster_cubes(sim_id, attributes, timestep).items():
+            files[attr] = self.timestep_path(cube, timestep)
+        
+        return files
+    
+    def get_raster_cubes(self, sim_id: int, attributes: List[str],
+                         timestep: Any = None) -> Dict[str, RasterCube]:
+        """Get a lazily loaded time cube per attribute for a simulation.
+        
+        Exports keep the catalog current (export hook and monitor watcher), so the
+        sim's directory is only re-indexed when an attribute is not catalogued or
+        the `timestep` selector does not resolve against the catalogued timesteps.
+        """
+        raster_dir = self.catalog.sim_directory(sim_id)
+        if raster_dir is None or not os.path.isdir(raster_dir):
+            self.catalog.refresh()
+            raster_dir = self.catalog.sim_directory(sim_id)
         if raster_dir is None:
             raise FileNotFoundError(f"Raster directory not found for sim {sim_id} under structured or legacy locations")
-        files = {}
+        
+        cubes = self._catalog_cubes(sim_id, attributes, raster_dir)
+        if len(cubes) < len(attributes) or not all(self._resolves(cube, timestep) for cube in cubes.values()):
+            # Pick up rasters written since the directory was indexed (unchanged files are skipped)
+            if self.catalog.index_directory(raster_dir):
+                cubes = self._catalog_cubes(sim_id, attributes, raster_dir)
         
         for attr in attributes:
-            # Look for files matching the attribute pattern
-            pattern = f"{attr}_*.tif"
-            import glob
-            matches = glob.glob(os.path.join(raster_dir, pattern))
-            if matches:
-                files[attr] = matches[0]  # Take the first match
-            else:
+            if attr not in cubes:
                 self.logger.warning(f"No raster file found for attribute {attr}")
         
-        return files
+        return cubes
+    
+    def _catalog_cubes(self, sim_id: int, attributes: List[str], raster_dir: str) -> Dict[str, RasterCube]:
+        """Cubes for the attributes the catalog knows in a sim directory (files that still exist)."""
+        cubes = {}
+        
+        for attr in attributes:
+            rows = [row for row in self.catalog.find(sim_id, attr, raster_dir) if os.path.exists(row['path'])]
+            if rows:
+                cubes[attr] = RasterCube(attr, [row['path'] for row in rows],
+                                         [row['timestep'] for row in rows], self.load_raster)
+        
+        return cubes
+    
+    @staticmethod
+    def _resolves(cube: RasterCube, timestep: Any) -> bool:
+        """Whether a timestep selector resolves against the cube's timesteps."""
+        if timestep is None:
+            return True
+        try:
+            cube.resolve(timestep)
+        except (IndexError, ValueError):
+            return False
+        return True
+    
+    def timestep_path(self, cube: RasterCube, timestep: Any = DEFAULT_TIMESTEP) -> str:
+        """Raster path for a timestep selector: the timestep file, or its cached envelope layer."""
+        indices, reduce = cube.resolve(timestep)
+        if reduce is None:
+            return cube.paths[indices[0]]
+        layers = self.envelope_cache.get(cube.attribute, [cube.paths[i] for i in indices],
+                                         [cube.times[i] for i in indices])
+        return layers[reduce]
+    
+    def load_timestep(self, cube: RasterCube, timestep: Any = DEFAULT_TIMESTEP) -> Tuple[np.ndarray, Dict[str, Any]]:
+        """Load the data a timestep selector refers to (a single timestep or an envelope over several)."""
+        return self.load_raster(self.timestep_path(cube, timestep))
 
 
 class ClusterAnalyzer:
@@ -186,23 +237,22 @@ class ClusterAnalyzer:
     
     def __init__(self):
         self.logger = logging.getLogger(__name__)
+        # k values solved together by kmeans_clustering (set by the optimizer for k sweeps)
+        self.kmeans_k_values: List[int] = []
+        # Polygonization: "auto", "whole" or "crops", and the thread pool size for crops
+        self.polygonize_strategy = "auto"
+        self.polygonize_workers: Optional[int] = None
+        # Tolerance of the "simplified" polygon tier, in raster cells
+        self.simplify_tolerance_cells = DEFAULT_TOLERANCE_CELLS
+        self._kmeans_solver: Optional[Tuple[str, KMeans1D]] = None
     
     def compute_delta(self, baseline_data: np.ndarray, candidate_data: np.ndarray) -> np.ndarray:
-        """Compute the difference between baseline and candidate rasters."""
-        # Handle nodata values
-        mask = (baseline_data != -9999) & (candidate_data != -9999)
-        delta = np.zeros_like(baseline_data)
-        delta[mask] = candidate_data[mask] - baseline_data[mask]
-        delta[~mask] = -9999  # Set nodata
-        return delta
+        """Compute the difference between baseline and candidate rasters (nodata where either is)."""
+        return DELTA_EXPRESSION.evaluate({'baseline': baseline_data, 'candidate': candidate_data})
     
     def compute_hazard_index(self, depth_data: np.ndarray, speed_data: np.ndarray) -> np.ndarray:
-        """Compute hazard index as depth × speed."""
-        mask = (depth_data != -9999) & (speed_data != -9999)
-        hazard = np.zeros_like(depth_data)
-        hazard[mask] = depth_data[mask] * speed_data[mask]
-        hazard[~mask] = -9999
-        return hazard
+        """Compute hazard index as depth × speed (nodata where either is)."""
+        return HAZARD_EXPRESSION.evaluate({'depth': depth_data, 'speed': speed_data})
     
     def apply_threshold(self, data: np.ndarray, threshold: float, nodata: float = -9999) -> np.ndarray:
         """Apply threshold to create binary mask."""
@@ -213,44 +263,57 @@ class ClusterAnalyzer:
         return result
     
     def connected_components_clustering(self, binary_data: np.ndarray, min_size: int = 50) -> np.ndarray:
-        """Perform connected components clustering on binary data."""
+        """Perform connected components clustering on binary data.
+        
+        Clusters smaller than `min_size` pixels are removed and the survivors are
+        renumbered 1..n in the smallest integer dtype that fits (see
+        `label_stats.filter_small_labels`).
+        """
+        return self.filter_components(self.label_components(binary_data), min_size)
+    
+    def label_components(self, binary_data: np.ndarray) -> np.ndarray:
+        """Connected components of a binary mask, unfiltered (background 0, nodata -9999)."""
         # Remove nodata values for clustering
         mask = binary_data != -9999
-        working_data = binary_data.copy()
-        working_data[~mask] = 0
+        working_data = (binary_data != 0) & mask
         
         # Perform connected components analysis
-        labeled_array, num_features = label(working_data)
-        
-        # Remove small clusters
-        for cluster_id in range(1, num_features + 1):
-            cluster_mask = labeled_array == cluster_id
-            cluster_size = np.sum(cluster_mask)
-            if cluster_size < min_size:
-                labeled_array[cluster_mask] = 0
+        labeled_array, _ = label(working_data)
         
         # Restore nodata values
         labeled_array[~mask] = -9999
+        return labeled_array
+    
+    def filter_components(self, components: np.ndarray, min_size: int) -> np.ndarray:
+        """Drop components smaller than `min_size` pixels and renumber the rest (see label_components)."""
+        nodata = components == -9999
+        labeled_array = np.where(nodata, 0, components)
         
+        # Remove small clusters with one size histogram and a lookup-table remap
+        labeled_array, _ = filter_small_labels(labeled_array, int(labeled_array.max(initial=0)), min_size)
+        
+        # Restore nodata values
+        labeled_array[nodata] = -9999
         return labeled_array
     
     def kmeans_clustering(self, data: np.ndarray, k: int, max_iter: int = 300, 
                          random_seed: int = 42) -> np.ndarray:
-        """Perform k-means clustering on raster data."""
+        """Perform k-means clustering on raster data.
+        
+        The feature is a single value column, so the optimal partition is computed
+        directly by the 1-D engine in kmeans_1d.py (max_iter and random_seed are
+        accepted for compatibility; the result is deterministic). Cluster ids are
+        ordered by center value, 0 being the lowest.
+        """
         # Prepare data for clustering
         valid_mask = data != -9999
-        valid_data = data[valid_mask].reshape(-1, 1)
+        valid_data = data[valid_mask]
         
         if len(valid_data) == 0:
             return np.full_like(data, -9999)
         
-        # Standardize data
-        scaler = StandardScaler()
-        scaled_data = scaler.fit_transform(valid_data)
-        
-        # Perform k-means clustering
-        kmeans = KMeans(n_clusters=k, max_iter=max_iter, random_state=random_seed, n_init=10)
-        cluster_labels = kmeans.fit_predict(scaled_data)
+        model = self._kmeans_1d_solver(valid_data, k).model(k)
+        cluster_labels = model.predict(valid_data)
         
         # Create result array
         result = np.full_like(data, -9999)
@@ -258,84 +321,90 @@ class ClusterAnalyzer:
         
         return result
     
+    def _kmeans_1d_solver(self, values: np.ndarray, k: int) -> KMeans1D:
+        """Fitted 1-D solver for `values`, reused while the same values are clustered again.
+        
+        The solver is fitted up to max(k, kmeans_k_values), so a sweep over k
+        (e.g. by the optimizer) costs a single fit.
+        """
+        k_max = max([k] + list(self.kmeans_k_values))
+        fingerprint = hashlib.blake2b(np.ascontiguousarray(values).view(np.uint8), digest_size=16).hexdigest()
+        cached = self._kmeans_solver
+        if cached is not None and cached[0] == fingerprint and cached[1].can_solve(k):
+            return cached[1]
+        solver = KMeans1D().fit(values, k_max)
+        self._kmeans_solver = (fingerprint, solver)
+        return solver
+    
+    def dbscan_clustering(self, binary_data: np.ndarray, eps: float = 1.5, min_samples: int = 5,
+                          eps_unit: str = "cells", meta: Optional[Dict[str, Any]] = None) -> np.ndarray:
+        """Grid-native DBSCAN of the foreground of a binary raster (see grid_dbscan.py).
+        
+        `eps` is in cells, or in metres with eps_unit "m" (converted with the raster transform).
+        Noise pixels become background (0), nodata stays -9999.
+        """
+        eps_cells = eps_to_cells(eps, eps_unit, meta.get('transform') if meta else None)
+        valid = binary_data != -9999
+        labels, n = grid_dbscan(binary_data == 1, eps_cells, min_samples, valid)
+        self.logger.info(f"DBSCAN (eps={eps_cells:.2f} cells, min_samples={min_samples}): {n} clusters")
+        return labels
+    
+    def spatial_kmeans_clustering(self, features: List[np.ndarray], mask: np.ndarray, meta: Dict[str, Any],
+                                  params: Dict[str, Any], valid: Optional[np.ndarray] = None) -> np.ndarray:
+        """Cluster the `mask` pixels by (x, y, feature...) vectors (see spatial_kmeans.py).
+        
+        Returns labels 1..k for clustered pixels, 0 elsewhere and -9999 outside `valid`.
+        """
+        return SpatialKMeans.from_params(params).fit_predict(features, mask, meta['transform'], valid)
+    
     def extract_cluster_polygons(self, cluster_data: np.ndarray, original_data: np.ndarray, 
                                 meta: Dict[str, Any]) -> List[ClusterMetrics]:
         """Extract cluster polygons and compute metrics."""
+        # Per-label statistics for all clusters in one pass (background 0 and nodata skipped)
+        stats = compute_label_statistics(cluster_data, original_data)
+        return self.clusters_from_statistics(stats, cluster_data, meta)
+    
+    def clusters_from_statistics(self, stats: LabelStatistics, cluster_data: np.ndarray,
+                                 meta: Dict[str, Any]) -> List[ClusterMetrics]:
+        """Build cluster metrics and polygons from precomputed label statistics.
+        
+        Geometries keep holes and disjoint parts (see polygonize.py); memmapped
+        label rasters are read one row band at a time.
+        """
         clusters = []
         
-        # Get unique cluster IDs (excluding nodata)
-        unique_clusters = np.unique(cluster_data[cluster_data != -9999])
+        transform = meta['transform']
+        pixel_area = abs(transform[0]) * abs(transform[4])
+        mean_values = stats.mean
+        std_values = stats.std
+        geometries = polygonize_labels(cluster_data, stats.labels, stats.slices, transform,
+                                       self.polygonize_strategy, self.polygonize_workers)
+        tolerance = self.simplify_tolerance_cells * (abs(transform.a) + abs(transform.e)) / 2.0
         
-        for cluster_id in unique_clusters:
-            if cluster_id == 0:  # Skip background
-                continue
-                
-            # Create binary mask for this cluster
-            cluster_mask = cluster_data == cluster_id
-            
-            # Get values within this cluster
-            cluster_values = original_data[cluster_mask]
-            
-            if len(cluster_values) == 0:
-                continue
+        for i, cluster_id in enumerate(stats.labels):
+            pixel_count = int(stats.count[i])
+            area = pixel_count * pixel_area
             
-            # Compute basic metrics
-            area = np.sum(cluster_mask) * abs(meta['transform'][0]) * abs(meta['transform'][4])
-            pixel_count = np.sum(cluster_mask)
-            
-            # Compute centroid
-            y_indices, x_indices = np.where(cluster_mask)
-            centroid_y = np.mean(y_indices)
-            centroid_x = np.mean(x_indices)
-            
-            # Transform to real coordinates
-            transform = meta['transform']
+            # Transform centroid to real coordinates
+            centroid_y = stats.centroid_row[i]
+            centroid_x = stats.centroid_col[i]
             centroid_lon = transform.c + centroid_x * transform.a + centroid_y * transform.b
             centroid_lat = transform.f + centroid_x * transform.d + centroid_y * transform.e
             
-            # Compute value statistics
-            mean_value = np.mean(cluster_values)
-            max_value = np.max(cluster_values)
-            min_value = np.min(cluster_values)
-            std_value = np.std(cluster_values)
-            
-            # Extract polygon
-            try:
-                # Use rasterio to extract shapes
-                cluster_data_single = (cluster_data == cluster_id).astype(np.uint8)
-                shapes_result = list(shapes(cluster_data_single, mask=cluster_mask, transform=transform))
-                
-                if shapes_result:
-                    # Take the largest polygon
-                    polygons = [shape(geom) for geom, value in shapes_result if value == 1]
-                    if polygons:
-                        # Simplify and get the largest polygon
-                        largest_polygon = max(polygons, key=lambda p: p.area)
-                        
-                        # Convert to GeoJSON format
-                        polygon_geojson = {
-                            "type": "Polygon",
-                            "coordinates": [list(largest_polygon.exterior.coords)]
-                        }
-                    else:
-                        polygon_geojson = None
-                else:
-                    polygon_geojson = None
-                    
-            except Exception as e:
-                self.logger.warning(f"Error extracting polygon for cluster {cluster_id}: {e}")
-                polygon_geojson = None
+            polygon_geojson = geometries.get(int(cluster_id))
             
             cluster_metrics = ClusterMetrics(
                 cluster_id=int(cluster_id),
                 area=float(area),
                 centroid=(float(centroid_lon), float(centroid_lat)),
-                mean_value=float(mean_value),
-                max_value=float(max_value),
-                min_value=float(min_value),
-                std_value=float(std_value),
-                pixel_count=int(pixel_count),
-                polygon=polygon_geojson
+                mean_value=float(mean_values[i]),
+                max_value=float(stats.max[i]),
+                min_value=float(stats.min[i]),
+                std_value=float(std_values[i]),
+                pixel_count=pixel_count,
+                polygon=polygon_geojson,
+                simplify_tolerance=tolerance,
+                vertex_counts={'full': count_vertices(polygon_geojson)} if polygon_geojson else {}
             )
             
             clusters.append(cluster_metrics)
@@ -346,33 +415,72 @@ class ClusterAnalyzer:
 class ClusterProcessor:
     """Main processor that orchestrates the clustering analysis."""
     
-    def __init__(self, data_dir: str = "data/output"):
+    def __init__(self, data_dir: str = "data/output", labeling_mode: str = "in_memory",
+                 tile_size: int = 1024):
         self.data_dir = data_dir
         self.raster_processor = RasterProcessor(data_dir)
         self.cluster_analyzer = ClusterAnalyzer()
         self.logger = logging.getLogger(__name__)
+        
+        # Default labeling mode ("in_memory" or "tiled"); a rule's clustering block may override it
+        self.labeling_mode = labeling_mode
+        self.tile_size = tile_size
+        
+        # Memoized stage outputs (data_dir/.cache/stages); keyed per rule by _stage_inputs
+        self.stage_cache: Optional[StageCache] = None
+        # In-process stage tree of the current optimizer run (see stage_cache.StageMemo)
+        self.stage_memo: Optional[StageMemo] = None
+        self._stage_inputs: Optional[str] = None
+        # Decimated inputs of a low-fidelity optimizer experiment (see pixel_sample.py); not for tiled rules
+        self.pixel_sample: Optional[PixelSample] = None
+        # Pixels of the stratified sample drawn for quality metrics (optimizer experiments); None: no sample
+        self.metrics_sample_size: Optional[int] = None
+        self._metric_sample: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self.configure_stage_cache(True)
+    
+    def configure_stage_cache(self, enabled: bool, max_bytes: int = DEFAULT_STAGE_CACHE_BYTES) -> None:
+        """Enable or disable the stage output cache under data_dir/.cache/stages."""
+        if enabled:
+            self.stage_cache = StageCache(os.path.join(self.data_dir, ".cache", "stages"), max_bytes)
+        else:
+            self.stage_cache = None
     
     def process_rule(self, rule_config: RuleConfig) -> AnalysisResult:
         """Process a single rule configuration."""
         self.logger.info(f"Processing rule: {rule_config.name} ({rule_config.analysis_type.value})")
         
         try:
+            if self._use_tiled_labeling(rule_config):
+                # Out-of-core path: rasters are streamed tile by tile, never fully loaded
+                result = self._process_tiled(rule_config)
+                result.statistics = self._compute_statistics(result.clusters)
+                self.logger.info(f"Processed {len(result.clusters)} clusters for rule {rule_config.name}")
+                return result
+            
             # Load raster data
-            raster_files = self._load_rasters_for_rule(rule_config)
+            paths = self.input_paths(rule_config)
+            raster_files = self._load_rasters_for_rule(rule_config, paths)
             
-            # Perform analysis based on type
-            if rule_config.analysis_type == AnalysisType.COMPARISON:
-                result = self._process_comparison(rule_config, raster_files)
-            elif rule_config.analysis_type == AnalysisType.THRESHOLD:
-                result = self._process_threshold(rule_config, raster_files)
-            elif rule_config.analysis_type == AnalysisType.HAZARD:
-                result = self._process_hazard(rule_config, raster_files)
-            elif rule_config.analysis_type == AnalysisType.VOLUME:
-                result = self._process_volume(rule_config, raster_files)
-            elif rule_config.analysis_type == AnalysisType.RANKING:
-                result = self._process_ranking(rule_config, raster_files)
-            else:
-                raise ValueError(f"Unknown analysis type: {rule_config.analysis_type}")
+            # Stage outputs are memoized on the content of the inputs (see stage_cache.py)
+            self._stage_inputs = self._stage_fingerprint(rule_config, paths)
+            self._metric_sample = None
+            try:
+                # Perform analysis based on type
+                if rule_config.analysis_type == AnalysisType.COMPARISON:
+                    result = self._process_comparison(rule_config, raster_files)
+                elif rule_config.analysis_type == AnalysisType.THRESHOLD:
+                    result = self._process_threshold(rule_config, raster_files)
+                elif rule_config.analysis_type == AnalysisType.HAZARD:
+                    result = self._process_hazard(rule_config, raster_files)
+                elif rule_config.analysis_type == AnalysisType.VOLUME:
+                    result = self._process_volume(rule_config, raster_files)
+                elif rule_config.analysis_type == AnalysisType.RANKING:
+                    result = self._process_ranking(rule_config, raster_files)
+                else:
+                    raise ValueError(f"Unknown analysis type: {rule_config.analysis_type}")
+            finally:
+                self._stage_inputs = None
+            result.metric_sample, self._metric_sample = self._metric_sample, None
             
             # Compute overall statistics
             result.statistics = self._compute_statistics(result.clusters)
@@ -384,72 +492,135 @@ class ClusterProcessor:
             self.logger.error(f"Error processing rule {rule_config.name}: {e}")
             raise
     
-    def _load_rasters_for_rule(self, rule_config: RuleConfig) -> Dict[str, Tuple[np.ndarray, Dict[str, Any]]]:
-        """Load raster data for a rule configuration."""
-        raster_files = {}
-        
-        # Determine which simulations to load
-        if rule_config.analysis_type == AnalysisType.COMPARISON:
-            if rule_config.baseline_id and rule_config.candidate_id:
-                sim_ids = [rule_config.baseline_id, rule_config.candidate_id]
-            else:
-                # Default to sim 1 and 2
-                sim_ids = [1, 2]
-        else:
-            # Use baseline_id or default to sim 1
-            sim_id = rule_config.baseline_id or 1
-            sim_ids = [sim_id]
+    def _load_rasters_for_rule(self, rule_config: RuleConfig, paths: Optional[Dict[str, str]] = None
+                               ) -> Dict[str, Tuple[np.ndarray, Dict[str, Any]]]:
+        """Load the rasters a rule reads (see required_inputs), keyed sim_<id>_<ATTR>."""
+        self.logger.info(f"Timestep selection: {describe_selector(rule_config.timestep)}")
+        if paths is None:
+            paths = self.input_paths(rule_config)
+        rasters = {key: self.raster_processor.load_raster(path) for key, path in paths.items()}
+        if self.pixel_sample is not None:
+            rasters = {key: self.pixel_sample.apply(data, meta) for key, (data, meta) in rasters.items()}
+        return rasters
+    
+    def input_paths(self, rule_config: RuleConfig) -> Dict[str, str]:
+        """Raster file of each input a rule reads at its timestep selection, keyed sim_<id>_<ATTR>.
         
-        # Load rasters for each simulation
-        for sim_id in sim_ids:
+        Envelope selectors resolve to the cached envelope raster.
+        """
+        paths = {}
+        for sim_id, attributes in self.required_inputs(rule_config).items():
+            self.logger.info(f"Loading sim {sim_id}: {', '.join(attributes)}")
             try:
-                files = self.raster_processor.get_raster_files(sim_id, rule_config.attributes)
-                for attr, filepath in files.items():
-                    data, meta = self.raster_processor.load_raster(filepath)
-                    key = f"sim_{sim_id}_{attr}"
-                    raster_files[key] = (data, meta)
+                cubes = self.raster_processor.get_raster_cubes(sim_id, attributes)
+                for attr, cube in cubes.items():
+                    paths[f"sim_{sim_id}_{attr}"] = self.raster_processor.timestep_path(cube, rule_config.timestep)
             except FileNotFoundError as e:
                 self.logger.warning(f"Could not load rasters for sim {sim_id}: {e}")
+        return paths
+    
+    def primary_attribute(self, rule_config: RuleConfig) -> str:
+        """Attribute analysed when no derive formula applies: the rule's analysis_attribute, else its first attribute.
         
-        return raster_files
+        Features only select spatial k-means inputs; they never change the analysed attribute.
+        """
+        return rule_config.analysis_attribute or rule_config.attributes[0]
     
-    def _process_comparison(self, rule_config: RuleConfig, raster_files: Dict[str, Tuple[np.ndarray, Dict[str, Any]]]) -> AnalysisResult:
-        """Process comparison analysis (baseline vs candidate)."""
-        # Find baseline and candidate data
-        baseline_data = None
-        candidate_data = None
-        meta = None
+    def _feature_names(self, rule_config: RuleConfig) -> List[str]:
+        """Spatial k-means features: the clustering block's, else the rule's, else the primary attribute."""
+        return rule_config.clustering.get('features') or rule_config.features or [self.primary_attribute(rule_config)]
+    
+    def _hazard_attributes(self, rule_config: RuleConfig) -> Tuple[Optional[str], Optional[str]]:
+        """Depth and speed attributes of a hazard rule without a derive formula."""
+        depth_attr = next((a for a in rule_config.attributes if 'depth' in a.lower()), None)
+        speed_attr = next((a for a in rule_config.attributes if 'speed' in a.lower()), None)
+        return depth_attr, speed_attr
+    
+    def required_inputs(self, rule_config: RuleConfig) -> Dict[int, List[str]]:
+        """Attributes the rule actually reads, per simulation id.
+        
+        The analysed quantity needs its derive formula's inputs (or the built-in
+        formula's: primary attribute of both sims for comparisons, depth and
+        speed for hazard, primary attribute otherwise); spatial k-means adds
+        its features, derived ones through their formulas.
+        """
+        analysis_type = rule_config.analysis_type
+        baseline_id = rule_config.baseline_id or 1
+        candidate_id = rule_config.candidate_id or 2
+        comparison = analysis_type in (AnalysisType.COMPARISON, AnalysisType.RANKING)
+        derive = DeriveSet(rule_config.derive)
+        required = set()
         
-        for key, (data, raster_meta) in raster_files.items():
-            if "sim_1_" in key or f"sim_{rule_config.baseline_id}_" in key:
-                baseline_data = data
-                meta = raster_meta
-            elif "sim_2_" in key or f"sim_{rule_config.candidate_id}_" in key:
-                candidate_data = data
+        target = self._derive_target(rule_config)
+        if target is not None:
+            required |= derive.required_inputs(target, baseline_id)
+        elif comparison:
+            primary = self.primary_attribute(rule_config)
+            required |= {(primary, baseline_id), (primary, candidate_id)}
+        elif analysis_type == AnalysisType.HAZARD:
+            required |= {(attr, baseline_id) for attr in self._hazard_attributes(rule_config) if attr}
+        else:
+            required.add((self.primary_attribute(rule_config), baseline_id))
         
-        if baseline_data is None or candidate_data is None:
-            raise ValueError("Could not find both baseline and candidate data")
+        if rule_config.clustering.get('method') == 'spatial_kmeans':
+            for name in self._feature_names(rule_config):
+                if name in derive:
+                    required |= derive.required_inputs(name, baseline_id)
+                else:
+                    required.add((name, baseline_id))
+                    if comparison:
+                        required.add((name, candidate_id))
+        
+        # Baseline first, then the other simulations
+        by_sim: Dict[int, List[str]] = {}
+        for attr, sim_id in sorted(required, key=lambda r: (r[1] != baseline_id, r[1], r[0])):
+            by_sim.setdefault(sim_id, []).append(attr)
+        return by_sim
+    
+    def _process_comparison(self, rule_config: RuleConfig, raster_files: Dict[str, Tuple[np.ndarray, Dict[str, Any]]]) -> AnalysisResult:
+        """Process comparison analysis (baseline vs candidate)."""
+        def compute_delta():
+            derived = self._evaluate_derive(rule_config, raster_files)
+            if derived is not None:
+                return derived
+            # Primary attribute of the baseline and candidate simulations
+            attr = self.primary_attribute(rule_config)
+            baseline_key = f"sim_{rule_config.baseline_id or 1}_{attr}"
+            candidate_key = f"sim_{rule_config.candidate_id or 2}_{attr}"
+            if baseline_key not in raster_files or candidate_key not in raster_files:
+                raise ValueError("Could not find both baseline and candidate data")
+            baseline_data, meta = raster_files[baseline_key]
+            candidate_data = raster_files[candidate_key][0]
+            
+            # Compute delta
+            return self.cluster_analyzer.compute_delta(baseline_data, candidate_data), meta
         
-        # Compute delta
-        delta = self.cluster_analyzer.compute_delta(baseline_data, candidate_data)
+        delta, meta = self._memo_value(compute_delta)
         
         # Apply threshold if specified
         threshold = rule_config.thresholds.get('change_threshold', 0.01)
-        binary_delta = self.cluster_analyzer.apply_threshold(delta, threshold)
-        
-        # Perform clustering
         clustering_params = rule_config.clustering
-        if clustering_params.get('method') == 'connected_components':
-            cluster_data = self.cluster_analyzer.connected_components_clustering(
-                binary_delta, clustering_params.get('min_size', 50)
-            )
-        else:
-            # Default to k-means
-            k = clustering_params.get('k', 5)
-            cluster_data = self.cluster_analyzer.kmeans_clustering(delta, k)
+        
+        def cluster():
+            # k-means clusters the delta itself; the other methods its thresholded mask
+            if clustering_params.get('method') not in ('connected_components', 'spatial_kmeans', 'dbscan'):
+                # Default to k-means
+                k = clustering_params.get('k', 5)
+                return self.cluster_analyzer.kmeans_clustering(delta, k)
+            mask = lambda: self._memo('mask', {'threshold': threshold},
+                                      lambda: self.cluster_analyzer.apply_threshold(delta, threshold))
+            
+            # Perform clustering
+            if clustering_params.get('method') == 'connected_components':
+                return self._components(mask, threshold, clustering_params.get('min_size', 50))
+            binary_delta = mask()
+            if clustering_params.get('method') == 'spatial_kmeans':
+                return self._spatial_kmeans(rule_config, raster_files, binary_delta == 1, meta)
+            return self._dbscan(clustering_params, binary_delta, meta)
         
         # Extract clusters
-        clusters = self.cluster_analyzer.extract_cluster_polygons(cluster_data, delta, meta)
+        clusters = self._clustered(self._label_params(clustering_params, threshold, self.clusters_mask(rule_config)),
+                                   cluster, delta, meta)
         
         return AnalysisResult(
             rule_name=rule_config.name,
@@ -463,34 +634,32 @@ class ClusterProcessor:
     def _process_threshold(self, rule_config: RuleConfig, raster_files: Dict[str, Tuple[np.ndarray, Dict[str, Any]]]) -> AnalysisResult:
         """Process threshold analysis."""
         # Get the main attribute data
-        main_data = None
-        meta = None
-        
-        for key, (data, raster_meta) in raster_files.items():
-            if rule_config.attributes[0].lower() in key.lower():
-                main_data = data
-                meta = raster_meta
-                break
-        
-        if main_data is None:
+        key = f"sim_{rule_config.baseline_id or 1}_{self.primary_attribute(rule_config)}"
+        if key not in raster_files:
             raise ValueError("Could not find data for threshold analysis")
+        main_data, meta = raster_files[key]
         
         # Apply threshold
         threshold = rule_config.thresholds.get('depth_threshold', 0.5)
-        binary_data = self.cluster_analyzer.apply_threshold(main_data, threshold)
-        
-        # Perform clustering
         clustering_params = rule_config.clustering
-        if clustering_params.get('method') == 'connected_components':
-            cluster_data = self.cluster_analyzer.connected_components_clustering(
-                binary_data, clustering_params.get('min_size', 50)
-            )
-        else:
+        
+        def cluster():
+            mask = lambda: self._memo('mask', {'threshold': threshold},
+                                      lambda: self.cluster_analyzer.apply_threshold(main_data, threshold))
+            
+            # Perform clustering
+            if clustering_params.get('method') == 'connected_components':
+                return self._components(mask, threshold, clustering_params.get('min_size', 50))
+            elif clustering_params.get('method') == 'spatial_kmeans':
+                return self._spatial_kmeans(rule_config, raster_files, mask() == 1, meta)
+            elif clustering_params.get('method') == 'dbscan':
+                return self._dbscan(clustering_params, mask(), meta)
             # Default to connected components for threshold analysis
-            cluster_data = self.cluster_analyzer.connected_components_clustering(binary_data, 50)
+            return self._components(mask, threshold, 50)
         
         # Extract clusters
-        clusters = self.cluster_analyzer.extract_cluster_polygons(cluster_data, main_data, meta)
+        clusters = self._clustered(self._label_params(clustering_params, threshold, self.clusters_mask(rule_config)),
+                                   cluster, main_data, meta)
         
         return AnalysisResult(
             rule_name=rule_config.name,
@@ -503,38 +672,46 @@ class ClusterProcessor:
     
     def _process_hazard(self, rule_config: RuleConfig, raster_files: Dict[str, Tuple[np.ndarray, Dict[str, Any]]]) -> AnalysisResult:
         """Process hazard analysis (depth × speed)."""
-        # Get depth and speed data
-        depth_data = None
-        speed_data = None
-        meta = None
-        
-        for key, (data, raster_meta) in raster_files.items():
-            if 'depth' in key.lower():
-                depth_data = data
-                meta = raster_meta
-            elif 'speed' in key.lower():
-                speed_data = data
-        
-        if depth_data is None or speed_data is None:
-            raise ValueError("Could not find both depth and speed data for hazard analysis")
+        def compute_hazard():
+            derived = self._evaluate_derive(rule_config, raster_files)
+            if derived is not None:
+                return derived
+            # Get depth and speed data
+            sim_id = rule_config.baseline_id or 1
+            depth_attr, speed_attr = self._hazard_attributes(rule_config)
+            depth_key, speed_key = f"sim_{sim_id}_{depth_attr}", f"sim_{sim_id}_{speed_attr}"
+            if depth_key not in raster_files or speed_key not in raster_files:
+                raise ValueError("Could not find both depth and speed data for hazard analysis")
+            depth_data, meta = raster_files[depth_key]
+            speed_data = raster_files[speed_key][0]
+            
+            # Compute hazard index
+            return self.cluster_analyzer.compute_hazard_index(depth_data, speed_data), meta
         
-        # Compute hazard index
-        hazard_data = self.cluster_analyzer.compute_hazard_index(depth_data, speed_data)
+        hazard_data, meta = self._memo_value(compute_hazard)
         
         # Apply threshold
         threshold = rule_config.thresholds.get('hazard_threshold', 1.0)
-        binary_hazard = self.cluster_analyzer.apply_threshold(hazard_data, threshold)
-        
-        # Perform clustering
         clustering_params = rule_config.clustering
-        if clustering_params.get('method') == 'kmeans':
-            k = clustering_params.get('k', 4)
-            cluster_data = self.cluster_analyzer.kmeans_clustering(hazard_data, k)
-        else:
-            cluster_data = self.cluster_analyzer.connected_components_clustering(binary_hazard, 50)
+        
+        def cluster():
+            # k-means clusters the hazard index itself; the other methods its thresholded mask
+            if clustering_params.get('method') == 'kmeans':
+                k = clustering_params.get('k', 4)
+                return self.cluster_analyzer.kmeans_clustering(hazard_data, k)
+            mask = lambda: self._memo('mask', {'threshold': threshold},
+                                      lambda: self.cluster_analyzer.apply_threshold(hazard_data, threshold))
+            
+            # Perform clustering
+            if clustering_params.get('method') == 'spatial_kmeans':
+                return self._spatial_kmeans(rule_config, raster_files, mask() == 1, meta)
+            elif clustering_params.get('method') == 'dbscan':
+                return self._dbscan(clustering_params, mask(), meta)
+            return self._components(mask, threshold, 50)
         
         # Extract clusters
-        clusters = self.cluster_analyzer.extract_cluster_polygons(cluster_data, hazard_data, meta)
+        clusters = self._clustered(self._label_params(clustering_params, threshold, self.clusters_mask(rule_config)),
+                                   cluster, hazard_data, meta)
         
         return AnalysisResult(
             rule_name=rule_config.name,
@@ -560,6 +737,323 @@ class ClusterProcessor:
         
         return result
     
+    def clusters_mask(self, rule_config: RuleConfig) -> bool:
+        """Whether the rule's clustering works on the threshold mask rather than the value raster (k-means)."""
+        method = rule_config.clustering.get('method')
+        if rule_config.analysis_type in (AnalysisType.COMPARISON, AnalysisType.RANKING):
+            return method in ('connected_components', 'spatial_kmeans', 'dbscan')
+        if rule_config.analysis_type == AnalysisType.HAZARD:
+            return method != 'kmeans'
+        return True
+    
+    def _stage_fingerprint(self, rule_config: RuleConfig, paths: Dict[str, str]) -> Optional[str]:
+        """Stage cache key of everything a rule's stages depend on besides their own parameters.
+        
+        Covers the input rasters (path, mtime and size), their pixel sample if
+        any, and the rule fields that decide how they are combined: analysis
+        type, simulations, attributes, features and derive formulas. None
+        disables memoization for the rule.
+        """
+        if self.stage_cache is None and self.stage_memo is None:
+            return None
+        try:
+            inputs = [f"{key}={file_fingerprint(path)}" for key, path in sorted(paths.items())]
+        except OSError:
+            return None
+        params = {
+            'analysis_type': rule_config.analysis_type.value,
+            'baseline_id': rule_config.baseline_id,
+            'candidate_id': rule_config.candidate_id,
+            'attributes': rule_config.attributes,
+            'features': rule_config.features,
+            'derive': rule_config.derive,
+            'analysis_attribute': rule_config.analysis_attribute
+        }
+        if self.pixel_sample is not None:
+            params['pixel_sample'] = self.pixel_sample.to_json()
+        return stage_key('inputs', inputs, params)
+    
+    def _stage(self, stage: str, params: Dict[str, Any], compute: Callable[[], Tuple[Dict[str, np.ndarray], Any]]
+               ) -> Tuple[Dict[str, np.ndarray], Any]:
+        """(arrays, payload) of a stage of the current rule: from the in-process stage
+        tree, the stage cache, or computed (and kept in both)."""
+        if self._stage_inputs is None:
+            return compute()
+        key = stage_key(stage, [self._stage_inputs], params)
+        if self.stage_memo is not None:
+            entry = self.stage_memo.get(key, stage)
+            if entry is not None:
+                return entry
+        entry = self.stage_cache.load(key, stage) if self.stage_cache is not None else None
+        if entry is None:
+            entry = compute()
+            if self.stage_cache is not None:
+                self.stage_cache.store(key, stage, *entry)
+        if self.stage_memo is not None:
+            self.stage_memo.put(key, *entry)
+        return entry
+    
+    def _memo(self, stage: str, params: Dict[str, Any], compute: Callable[[], np.ndarray]) -> np.ndarray:
+        """Array output of a stage of the current rule, computed once per set of inputs and parameters."""
+        arrays, _ = self._stage(stage, params, lambda: ({'data': compute()}, None))
+        return arrays['data']
+    
+    def _memo_value(self, compute: Callable[[], Tuple[np.ndarray, Dict[str, Any]]]
+                    ) -> Tuple[np.ndarray, Dict[str, Any]]:
+        """The analysed value raster of the current rule (delta, hazard index) and its metadata."""
+        if self._stage_inputs is None:
+            return compute()
+        
+        def encode():
+            value, meta = compute()
+            return {'data': value}, meta_to_json(meta)
+        
+        arrays, meta = self._stage('value', {}, encode)
+        return arrays['data'], meta_from_json(meta)
+    
+    def _components(self, mask: Callable[[], np.ndarray], threshold: float, min_size: int) -> np.ndarray:
+        """Connected components of a threshold mask without those under `min_size` pixels.
+        
+        The unfiltered components are a stage of their own, labeled once per
+        threshold and shared by every min_size. On a pixel sample `min_size`
+        is scaled to the cells of the sample.
+        """
+        components = self._memo('components', {'threshold': threshold},
+                                lambda: self.cluster_analyzer.label_components(mask()))
+        if self.pixel_sample is not None:
+            min_size = self.pixel_sample.cells(min_size)
+        return self.cluster_analyzer.filter_components(components, min_size)
+    
+    def _label_params(self, clustering_params: Dict[str, Any], threshold: float, uses_mask: bool) -> Dict[str, Any]:
+        """Stage parameters of a label raster: the clustering block, and the threshold if it clusters the mask."""
+        return {'clustering': clustering_params, 'threshold': threshold if uses_mask else None}
+    
+    def _clustered(self, label_params: Dict[str, Any], cluster: Callable[[], np.ndarray],
+                   values: np.ndarray, meta: Dict[str, Any]) -> List[ClusterMetrics]:
+        """Clusters of the label raster built by `cluster()`, with metrics over `values`.
+        
+        The clusters and the label raster are memoized; on a hit for the
+        clusters the labels are not even loaded. With metrics_sample_size set,
+        a stratified sample of the clusters' pixels is drawn as well (a stage
+        of its own, so it is not drawn again either).
+        """
+        if self._stage_inputs is None:
+            cluster_data = cluster()
+            if self.metrics_sample_size:
+                self._metric_sample = stratified_sample(cluster_data, values, self.metrics_sample_size)
+            return self.cluster_analyzer.extract_cluster_polygons(cluster_data, values, meta)
+        
+        def extract():
+            cluster_data = self._memo('labels', label_params, cluster)
+            clusters = self.cluster_analyzer.extract_cluster_polygons(cluster_data, values, meta)
+            return {}, [asdict(c) for c in clusters]
+        
+        params = {**label_params, 'simplify_tolerance_cells': self.cluster_analyzer.simplify_tolerance_cells}
+        _, clusters = self._stage('clusters', params, extract)
+        if self.metrics_sample_size:
+            def sample():
+                labels = self._memo('labels', label_params, cluster)
+                return dict(zip(('values', 'labels'), stratified_sample(labels, values, self.metrics_sample_size))), None
+            
+            arrays, _ = self._stage('metric_sample', {**label_params, 'size': self.metrics_sample_size}, sample)
+            self._metric_sample = (arrays['values'], arrays['labels'])
+        return [ClusterMetrics(**{**c, 'centroid': tuple(c['centroid'])}) for c in clusters]
+    
+    def _derive_target(self, rule_config: RuleConfig) -> Optional[str]:
+        """Name of the derive entry the rule's analysis uses, if the rule defines it."""
+        target = DERIVE_TARGETS.get(rule_config.analysis_type)
+        return target if target in rule_config.derive else None
+    
+    def _evaluate_derive(self, rule_config: RuleConfig, raster_files: Dict[str, Tuple[np.ndarray, Dict[str, Any]]]
+                         ) -> Optional[Tuple[np.ndarray, Dict[str, Any]]]:
+        """Evaluate the rule's derive entry for its analysis type; None if it has none."""
+        target = self._derive_target(rule_config)
+        if target is None:
+            return None
+        derive = DeriveSet(rule_config.derive)
+        baseline_id = rule_config.baseline_id or 1
+        metas = []
+        
+        def resolve(attr: str, sim_id: Optional[int]) -> np.ndarray:
+            key = f"sim_{sim_id or baseline_id}_{attr}"
+            if key not in raster_files:
+                raise ValueError(f"derive.{target} needs {attr} of sim {sim_id or baseline_id}, which is not loaded")
+            data, meta = raster_files[key]
+            metas.append(meta)
+            return data
+        
+        value = derive.evaluate(target, resolve)
+        self.logger.info(f"Derived {target} = {rule_config.derive[target]}")
+        return value, metas[0]
+    
+    def _dbscan(self, clustering_params: Dict[str, Any], binary_data: np.ndarray,
+                meta: Dict[str, Any]) -> np.ndarray:
+        """Grid DBSCAN with the rule's eps / eps_unit / min_samples."""
+        return self.cluster_analyzer.dbscan_clustering(
+            binary_data,
+            eps=clustering_params.get('eps', 1.5),
+            min_samples=clustering_params.get('min_samples', 5),
+            eps_unit=clustering_params.get('eps_unit', 'cells'),
+            meta=meta
+        )
+    
+    def _spatial_kmeans(self, rule_config: RuleConfig, raster_files: Dict[str, Tuple[np.ndarray, Dict[str, Any]]],
+                        foreground: np.ndarray, meta: Dict[str, Any]) -> np.ndarray:
+        """Spatial k-means of the foreground pixels over the rule's feature attributes.
+        
+        Features come from the clustering block's `features`, else the rule's `features`,
+        else its primary attribute. Comparison rules cluster on per-feature deltas; features
+        naming a derive entry are evaluated from their formula and used as is.
+        """
+        names = self._feature_names(rule_config)
+        comparison = rule_config.analysis_type in (AnalysisType.COMPARISON, AnalysisType.RANKING)
+        baseline_id = rule_config.baseline_id or 1
+        candidate_id = rule_config.candidate_id or 2
+        derive = DeriveSet(rule_config.derive)
+        
+        features = []
+        valid = np.ones(foreground.shape, dtype=bool)
+        for name in names:
+            if name in derive:
+                # Derived feature (e.g. a delta formula) is used as is
+                feature = derive.evaluate(name, lambda attr, sim_id: self._loaded(raster_files, attr, sim_id or baseline_id))
+                valid &= feature != -9999
+                features.append(feature)
+                continue
+            base = self._loaded(raster_files, name, baseline_id)
+            valid &= base != -9999
+            if comparison:
+                cand = self._loaded(raster_files, name, candidate_id)
+                valid &= cand != -9999
+                features.append(cand.astype(np.float64) - base)
+            else:
+                features.append(base)
+        
+        return self.cluster_analyzer.spatial_kmeans_clustering(
+            features, foreground, meta, rule_config.clustering, valid
+        )
+    
+    def _loaded(self, raster_files: Dict[str, Tuple[np.ndarray, Dict[str, Any]]], attr: str, sim_id: int) -> np.ndarray:
+        """Loaded raster of one attribute and simulation."""
+        key = f"sim_{sim_id}_{attr}"
+        if key not in raster_files:
+            raise ValueError(f"{attr} of sim {sim_id} is not loaded")
+        return raster_files[key][0]
+    
+    def _use_tiled_labeling(self, rule_config: RuleConfig) -> bool:
+        """Whether the rule should run through out-of-core tiled labeling."""
+        clustering = rule_config.clustering
+        if clustering.get('labeling', self.labeling_mode) != 'tiled':
+            return False
+        
+        # Tiled labeling only applies to connected-components clustering
+        method = clustering.get('method')
+        analysis_type = rule_config.analysis_type
+        if analysis_type in (AnalysisType.THRESHOLD, AnalysisType.VOLUME):
+            uses_components = True
+        elif analysis_type == AnalysisType.HAZARD:
+            uses_components = method != 'kmeans'
+        else:
+            uses_components = method == 'connected_components'
+        
+        if not uses_components:
+            self.logger.warning(f"Tiled labeling requested for rule {rule_config.name} but method "
+                                f"'{method}' is not connected_components; using in-memory processing")
+        return uses_components
+    
+    def _process_tiled(self, rule_config: RuleConfig) -> AnalysisResult:
+        """Process a connected-components rule with tiled, bounded-memory labeling."""
+        analysis_type = rule_config.analysis_type
+        clustering_params = rule_config.clustering
+        attr = self.primary_attribute(rule_config)
+        nodata = -9999
+        
+        derive_target = self._derive_target(rule_config)
+        if derive_target is not None:
+            # Rule-defined formula: read exactly its inputs and evaluate it per window
+            derive = DeriveSet(rule_config.derive)
+            baseline_id = rule_config.baseline_id or 1
+            sources = {}
+            for input_attr, sim_id in sorted(derive.required_inputs(derive_target, baseline_id)):
+                files = self.raster_processor.get_raster_files(sim_id, [input_attr], rule_config.timestep)
+                sources[f"sim_{sim_id}_{input_attr}"] = files[input_attr]
+            threshold_key = 'hazard_threshold' if analysis_type == AnalysisType.HAZARD else 'change_threshold'
+            threshold = rule_config.thresholds.get(threshold_key, 1.0 if analysis_type == AnalysisType.HAZARD else 0.01)
+            
+            def window_fn(arrays):
+                value = derive.evaluate(derive_target, lambda a, s: arrays[f"sim_{s or baseline_id}_{a}"])
+                valid = value != nodata
+                return (value > threshold) & valid, value, valid
+        
+        elif analysis_type in (AnalysisType.COMPARISON, AnalysisType.RANKING):
+            baseline_id = rule_config.baseline_id or 1
+            candidate_id = rule_config.candidate_id or 2
+            sources = {
+                'baseline': self.raster_processor.get_raster_files(baseline_id, [attr], rule_config.timestep)[attr],
+                'candidate': self.raster_processor.get_raster_files(candidate_id, [attr], rule_config.timestep)[attr]
+            }
+            threshold = rule_config.thresholds.get('change_threshold', 0.01)
+            
+            def window_fn(arrays):
+                valid = (arrays['baseline'] != nodata) & (arrays['candidate'] != nodata)
+                delta = np.where(valid, arrays['candidate'] - arrays['baseline'], nodata)
+                return (delta > threshold) & valid, delta, valid
+        
+        elif analysis_type == AnalysisType.HAZARD:
+            depth_attr, speed_attr = self._hazard_attributes(rule_config)
+            if depth_attr is None or speed_attr is None:
+                raise ValueError("Could not find both depth and speed data for hazard analysis")
+            files = self.raster_processor.get_raster_files(rule_config.baseline_id or 1, [depth_attr, speed_attr],
+                                                           rule_config.timestep)
+            sources = {'depth': files[depth_attr], 'speed': files[speed_attr]}
+            threshold = rule_config.thresholds.get('hazard_threshold', 1.0)
+            
+            def window_fn(arrays):
+                valid = (arrays['depth'] != nodata) & (arrays['speed'] != nodata)
+                hazard = np.where(valid, arrays['depth'] * arrays['speed'], nodata)
+                return (hazard > threshold) & valid, hazard, valid
+        
+        else:
+            sources = {'main': self.raster_processor.get_raster_files(rule_config.baseline_id or 1, [attr],
+                                                                    rule_config.timestep)[attr]}
+            threshold = rule_config.thresholds.get('depth_threshold', 0.5)
+            
+            def window_fn(arrays):
+                valid = arrays['main'] != nodata
+                return (arrays['main'] > threshold) & valid, arrays['main'], valid
+        
+        tile_size = int(clustering_params.get('tile_size', self.tile_size))
+        labeler = TiledLabeler(tile_size, work_dir=os.path.join(self.data_dir, ".cache", "tiles"))
+        # Same min_size as the in-memory paths, which use the default 50 for hazard rules
+        # and for threshold rules whose method is not connected_components
+        if clustering_params.get('method') == 'connected_components' and analysis_type != AnalysisType.HAZARD:
+            min_size = clustering_params.get('min_size', 50)
+        else:
+            min_size = 50
+        tiled = labeler.label(sources, window_fn, min_size)
+        try:
+            clusters = self.cluster_analyzer.clusters_from_statistics(tiled.stats, tiled.labels, tiled.meta)
+        finally:
+            tiled.close()
+        
+        if analysis_type == AnalysisType.RANKING:
+            clusters.sort(key=lambda c: c.max_value, reverse=True)
+        
+        # Report the same analysis_type as the in-memory path (volume -> threshold, ranking -> comparison)
+        reported_type = {
+            AnalysisType.VOLUME: AnalysisType.THRESHOLD,
+            AnalysisType.RANKING: AnalysisType.COMPARISON
+        }.get(analysis_type, analysis_type)
+        
+        return AnalysisResult(
+            rule_name=rule_config.name,
+            analysis_type=reported_type.value,
+            clusters=clusters,
+            raster_info=tiled.meta,
+            processing_params={**rule_config.clustering, 'labeling': 'tiled', 'tile_size': tile_size},
+            statistics={}
+        )
+    
     def _compute_statistics(self, clusters: List[ClusterMetrics]) -> Dict[str, Any]:
         """Compute overall statistics for clusters."""
         if not clusters:
@@ -568,6 +1062,7 @@ class ClusterProcessor:
         areas = [c.area for c in clusters]
         mean_values = [c.mean_value for c in clusters]
         max_values = [c.max_value for c in clusters]
+        vertices = summarize_vertex_counts(clusters)
         
         return {
             'total_clusters': len(clusters),
@@ -577,7 +1072,8 @@ class ClusterProcessor:
             'mean_cluster_value': np.mean(mean_values),
             'std_cluster_value': np.std(mean_values),
             'max_cluster_value': max(max_values),
-            'min_cluster_value': min(max_values)
+            'min_cluster_value': min(max_values),
+            **{f'vertices_{tier}': count for tier, count in vertices.items()}
         }
 
 
@@ -1,9 +1,12 @@
 # Exchange script: Create hw_polygon features from a GeoJSON file (no ODIC)
 # Usage:
-#   ICMExchange.exe scripts/create_polygons_from_geojson.rb <geojson_path> [model_path] [table] [id_field]
+#   ICMExchange.exe scripts/create_polygons_from_geojson.rb <geojson_path> [model_path] [table] [id_field] [tier]
 # Defaults:
 #   table: hw_polygon
 #   id_field: cluster_id
+#   tier: simplified - polygon detail tier to import (full, simplified, hull, bbox). The pipeline
+#         writes <rule>_clusters.geojson (full) and <rule>_clusters_<tier>.geojson; when the tier's
+#         file exists next to <geojson_path> it is imported instead, otherwise <geojson_path> is used.
 
 require 'json'
 
@@ -23,7 +26,7 @@ def read_config_model_path
 end
 
 if ARGV.length < 1
-  puts "Usage: create_polygons_from_geojson.rb <geojson_path> [model_path] [table] [id_field]"
+  puts "Usage: create_polygons_from_geojson.rb <geojson_path> [model_path] [table] [id_field] [tier]"
   puts "Example: create_polygons_from_geojson.rb data/output/clusters/depth_change_analysis/clusters.geojson"
   exit 1
 end
@@ -47,6 +50,7 @@ geojson_path ||= ARGV[0]
 model_path   = (args[0] && args[0] != '') ? args[0] : (read_config_model_path || 'models/standalone/Medium 2D/Ruby_Hackathon_Medium_2D_Model.icmm')
 table_name   = (args[1] && args[1] != '') ? args[1] : 'hw_polygon'
 id_field     = (args[2] && args[2] != '') ? args[2] : 'cluster_id'
+tier         = (args[3] && args[3] != '') ? args[3] : 'simplified'
 
 unless File.exist?(geojson_path)
   # Fallback: discover latest clusters.geojson (prefer hazard_about_one)
@@ -62,6 +66,17 @@ unless File.exist?(geojson_path)
   end
 end
 
+# Use the requested detail tier when the pipeline wrote one next to the full-resolution file
+if tier != 'full' && geojson_path.end_with?('_clusters.geojson')
+  tier_path = geojson_path.sub(/_clusters\.geojson\z/, "_clusters_#{tier}.geojson")
+  if File.exist?(tier_path)
+    geojson_path = tier_path
+    puts "Using #{tier} polygons: #{geojson_path}"
+  else
+    puts "Note: #{tier} polygons not found, importing full resolution"
+  end
+end
+
 begin
   data = JSON.parse(File.read(geojson_path))
 rescue => e
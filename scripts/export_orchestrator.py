@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+ICMExchange Export Orchestrator
+
+Raster and CSV exports are ICMExchange runs that take much longer than the
+Python side needs to start analysing. The orchestrator runs them in
+background threads, at most `max_concurrent` at a time (ICMExchange
+licences and CPU are the limit), and streams each job's output into the
+pipeline log line by line as it is produced.
+
+Jobs are keyed, and submitting a key that is already queued, running or
+finished returns the same future. The pipeline runner therefore queues
+every rule's exports when a run starts and later waits on them rule by
+rule: rule N is analysed while the exports of rules N+1... are still running,
+so a run takes roughly max(export, analysis) instead of their sum.
+forget() clears the finished jobs at the end of a run so that the next run
+exports again.
+"""
+
+import logging
+import subprocess
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, List, Optional
+
+
+DEFAULT_MAX_CONCURRENT = 1
+TAIL_LINES = 20
+
+
+class ExportOrchestrator:
+    """Runs ICMExchange jobs in background threads with a concurrency limit."""
+
+    def __init__(self, max_concurrent: int = DEFAULT_MAX_CONCURRENT, cwd: Optional[str] = None,
+                 logger: Optional[logging.Logger] = None):
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.cwd = cwd
+        self.logger = logger or logging.getLogger(__name__)
+        self._jobs: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def submit(self, key: Hashable, cmd: List[str], label: str,
+               on_success: Optional[Callable[[], None]] = None) -> Future:
+        """Queue a command (once per key); the future resolves to True on exit code 0.
+
+        Args:
+            key: Identity of the job; resubmitting it returns the existing future
+            cmd: Command line
+            label: Short name used to prefix the streamed output
+            on_success: Called in the export thread after a successful run
+        """
+        with self._lock:
+            future = self._jobs.get(key)
+            if future is None:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_concurrent,
+                                                        thread_name_prefix="icm-export")
+                future = self._executor.submit(self._run, cmd, label, on_success)
+                self._jobs[key] = future
+            return future
+
+    def _run(self, cmd: List[str], label: str, on_success: Optional[Callable[[], None]]) -> bool:
+        self.logger.info(f"Running {label}: {' '.join(cmd)}")
+        tail = deque(maxlen=TAIL_LINES)
+        try:
+            with subprocess.Popen(cmd, cwd=self.cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                  text=True, errors='replace') as proc:
+                for line in proc.stdout:
+                    line = line.rstrip()
+                    if line:
+                        tail.append(line)
+                        self.logger.info(f"[{label}] {line}")
+                returncode = proc.wait()
+        except Exception as e:
+            self.logger.error(f"Error running {label}: {e}")
+            return False
+
+        if returncode != 0:
+            self.logger.error(f"{label} failed with return code {returncode}")
+            if tail:
+                self.logger.error(f"Last output of {label}:\n" + "\n".join(tail))
+            return False
+        self.logger.info(f"{label} completed successfully")
+        if on_success is not None:
+            try:
+                on_success()
+            except Exception as e:
+                self.logger.warning(f"Post-export step of {label} failed: {e}")
+        return True
+
+    def pending(self) -> int:
+        """Jobs queued or running."""
+        with self._lock:
+            return sum(1 for future in self._jobs.values() if not future.done())
+
+    def forget(self) -> None:
+        """Drop finished jobs so that resubmitting them runs them again."""
+        with self._lock:
+            self._jobs = {key: future for key, future in self._jobs.items() if not future.done()}
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+            if not wait:
+                for future in self._jobs.values():
+                    future.cancel()
+        if executor is not None:
+            executor.shutdown(wait=wait)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+ICMExchange Export Planner
+
+Rules selected for one run usually read the same simulations with
+overlapping attribute lists, and each used to queue its own raster and CSV
+exports. The planner runs once before rule execution: it takes the union of
+what the selected rules need, keyed by (sim_id, output directory, timestep
+mode), so every simulation is exported once with the merged attribute list,
+and CSV results once per simulation and selection.
+
+Attributes the raster catalog records as exported to the same directory, in
+the same timestep mode and from the same source (RasterCatalog.record_export),
+and whose rasters are still on disk, are left out of the export; an export
+with nothing left is skipped. `force` ignores those records, and so does a
+planner without a source identity (everything is exported).
+
+export_rasters.rb always writes every timestep, so all exports currently use
+the 'all' timestep mode; the mode is still part of the key so that a future
+summary-only export can never stand in for an all-timesteps one.
+"""
+
+import os
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+
+EXPORT_TIMESTEP_MODE = "all"
+
+
+@dataclass
+class RasterExport:
+    """One planned raster export of a simulation into an output directory."""
+    sim_id: int
+    output_dir: str
+    timestep_mode: str = EXPORT_TIMESTEP_MODE
+    attributes: List[str] = field(default_factory=list)   # to export in this run
+    current: List[str] = field(default_factory=list)      # already exported with matching parameters
+    rules: List[str] = field(default_factory=list)
+    future: Optional[Future] = field(default=None, repr=False)
+
+    @property
+    def skipped(self) -> bool:
+        return not self.attributes
+
+
+@dataclass
+class CsvExport:
+    """One planned CSV results export of a simulation."""
+    sim_id: int
+    output_dir: str
+    selection: Optional[str] = None
+    rules: List[str] = field(default_factory=list)
+    future: Optional[Future] = field(default=None, repr=False)
+
+
+@dataclass
+class RuleExports:
+    """The planned exports one rule waits for, in the rule's order."""
+    rasters: List[Tuple[RasterExport, List[str]]] = field(default_factory=list)  # (export, attributes read)
+    csv: List[CsvExport] = field(default_factory=list)
+
+
+@dataclass
+class ExportPlan:
+    """Deduplicated exports of a run and the share of them each rule needs."""
+    rasters: List[RasterExport]
+    csv: List[CsvExport]
+    rules: Dict[str, RuleExports]
+    requested: int   # exports the rules would have run one by one
+
+    def summary(self) -> Dict[str, Any]:
+        """Counts for the run manifest and the markdown log."""
+        return {
+            'requested_exports': self.requested,
+            'raster_exports': sum(1 for export in self.rasters if not export.skipped),
+            'raster_exports_skipped': sum(1 for export in self.rasters if export.skipped),
+            'attributes_exported': sum(len(export.attributes) for export in self.rasters),
+            'attributes_current': sum(len(export.current) for export in self.rasters),
+            'csv_exports': len(self.csv),
+        }
+
+
+class ExportPlanner:
+    """Collects the exports of all selected rules and merges them into an ExportPlan."""
+
+    def __init__(self, catalog=None, source: Optional[str] = None, force: bool = False):
+        """
+        Args:
+            catalog: RasterCatalog with export records (None: export everything)
+            source: Identity of the simulation results, compared with the recorded exports
+                (None: unknown, export everything)
+            force: Export even attributes that are recorded as up to date
+        """
+        self.catalog = catalog
+        self.source = source
+        self.force = force
+        self._rasters: Dict[Tuple[int, str, str], RasterExport] = {}
+        self._csv: Dict[Tuple[int, str, Optional[str]], CsvExport] = {}
+        self._rules: Dict[str, RuleExports] = {}
+        self._requested = 0
+
+    def add_rasters(self, rule_name: str, sim_id: int, output_dir: str, attributes: List[str],
+                    timestep_mode: str = EXPORT_TIMESTEP_MODE) -> None:
+        """Request a raster export of `attributes` for one rule."""
+        key = (sim_id, os.path.abspath(output_dir), timestep_mode)
+        export = self._rasters.get(key)
+        if export is None:
+            export = self._rasters[key] = RasterExport(sim_id, output_dir, timestep_mode)
+        for attr in attributes:
+            if attr not in export.attributes:
+                export.attributes.append(attr)
+        if rule_name not in export.rules:
+            export.rules.append(rule_name)
+        self._rules.setdefault(rule_name, RuleExports()).rasters.append((export, list(attributes)))
+        self._requested += 1
+
+    def add_csv(self, rule_name: str, sim_id: int, output_dir: str, selection: Optional[str] = None) -> None:
+        """Request a CSV results export for one rule."""
+        key = (sim_id, os.path.abspath(output_dir), selection)
+        export = self._csv.get(key)
+        if export is None:
+            export = self._csv[key] = CsvExport(sim_id, output_dir, selection)
+        if rule_name not in export.rules:
+            export.rules.append(rule_name)
+        self._rules.setdefault(rule_name, RuleExports()).csv.append(export)
+        self._requested += 1
+
+    def rule(self, rule_name: str) -> None:
+        """Register a rule that needs no exports, so that the plan covers it."""
+        self._rules.setdefault(rule_name, RuleExports())
+
+    def plan(self) -> ExportPlan:
+        """Split each merged raster export into up-to-date and still-to-export attributes."""
+        for export in self._rasters.values():
+            if self.catalog is None or self.force or self.source is None:
+                continue
+            recorded = set(self.catalog.exported_attributes(export.output_dir, export.sim_id,
+                                                            export.timestep_mode, self.source))
+            export.current = [attr for attr in export.attributes if attr in recorded]
+            export.attributes = [attr for attr in export.attributes if attr not in recorded]
+        return ExportPlan(list(self._rasters.values()), list(self._csv.values()), dict(self._rules),
+                          self._requested)
@@ -13,6 +13,7 @@ from typing import Dict, List, Any, Optional
 import logging
 from dataclasses import asdict
 from cluster_processor import AnalysisResult, ClusterMetrics
+from polygon_lod import DEFAULT_EXPORT_TIERS, parse_tiers, tier_geometry, summarize_vertex_counts
 from datetime import datetime
 import pandas as pd
 
@@ -20,12 +21,26 @@ import pandas as pd
 class GeoJSONExporter:
     """Exports cluster data to GeoJSON format."""
     
-    def __init__(self, output_dir: str = "data/output/results"):
+    def __init__(self, output_dir: str = "data/output/results", tiers: Optional[List[str]] = None):
         self.output_dir = output_dir
+        # Polygon detail tiers to write (see polygon_lod.py); "full" goes to <rule>_clusters.geojson
+        self.tiers = parse_tiers(tiers, DEFAULT_EXPORT_TIERS)
         self.logger = logging.getLogger(__name__)
     
-    def export_clusters(self, result: AnalysisResult) -> str:
-        """Export clusters to GeoJSON format."""
+    @staticmethod
+    def tier_filename(rule_name: str, tier: str) -> str:
+        """File name of one tier: <rule>_clusters.geojson for full, <rule>_clusters_<tier>.geojson otherwise."""
+        return f"{rule_name}_clusters.geojson" if tier == "full" else f"{rule_name}_clusters_{tier}.geojson"
+    
+    def export_all_tiers(self, result: AnalysisResult) -> Dict[str, str]:
+        """Export one GeoJSON file per configured tier; returns tier -> path.
+        
+        Tiers other than full are built while their file is written (see polygon_lod.py).
+        """
+        return {tier: self.export_clusters(result, tier) for tier in self.tiers}
+    
+    def export_clusters(self, result: AnalysisResult, tier: str = "full") -> str:
+        """Export clusters to GeoJSON format at one polygon detail tier."""
         rule_name = result.rule_name
         output_dir = os.path.join(self.output_dir, rule_name)
         os.makedirs(output_dir, exist_ok=True)
@@ -35,7 +50,8 @@ class GeoJSONExporter:
             features = []
             
             for cluster in result.clusters:
-                if cluster.polygon:
+                geometry = tier_geometry(cluster, tier)
+                if geometry:
                     feature = {
                         "type": "Feature",
                         "properties": {
@@ -47,9 +63,10 @@ class GeoJSONExporter:
                             "std_value": cluster.std_value,
                             "pixel_count": cluster.pixel_count,
                             "centroid_lon": cluster.centroid[0],
-                            "centroid_lat": cluster.centroid[1]
+                            "centroid_lat": cluster.centroid[1],
+                            "vertex_count": cluster.vertex_counts.get(tier)
                         },
-                        "geometry": cluster.polygon
+                        "geometry": geometry
                     }
                     features.append(feature)
             
@@ -60,17 +77,20 @@ class GeoJSONExporter:
                     "rule_name": rule_name,
                     "analysis_type": result.analysis_type,
                     "total_clusters": len(result.clusters),
+                    "lod_tier": tier,
+                    "vertex_counts": {t: n for t, n in summarize_vertex_counts(result.clusters).items()
+                                      if t in ("full", tier)},
                     "created_at": datetime.now().isoformat(),
                     "statistics": result.statistics
                 }
             }
             
             # Save to file
-            output_path = os.path.join(output_dir, f"{rule_name}_clusters.geojson")
+            output_path = os.path.join(output_dir, self.tier_filename(rule_name, tier))
             with open(output_path, 'w', encoding='utf-8') as f:
                 json.dump(geojson_data, f, indent=2)
             
-            self.logger.info(f"Exported clusters to GeoJSON: {output_path}")
+            self.logger.info(f"Exported clusters to GeoJSON ({tier}): {output_path}")
             return output_path
             
         except Exception as e:
@@ -228,6 +248,7 @@ class ReportGenerator:
                 f.write("- `clusters.csv` - Cluster summary data\n")
                 f.write("- `statistics.csv` - Overall statistics\n")
                 f.write("- `clusters.geojson` - Cluster geometries (if available)\n")
+                f.write("- `clusters_<tier>.geojson` - Simplified / hull / bbox geometries, per configured tier\n")
                 f.write("- `REPORT.md` - This report\n")
                 
                 if viz_paths.get('overlay'):
@@ -268,9 +289,9 @@ class ReportGenerator:
 class CombinedExporter:
     """Combines all export functionality."""
     
-    def __init__(self, output_dir: str = "data/output/results"):
+    def __init__(self, output_dir: str = "data/output/results", geojson_tiers: Optional[List[str]] = None):
         self.output_dir = output_dir
-        self.geojson_exporter = GeoJSONExporter(output_dir)
+        self.geojson_exporter = GeoJSONExporter(output_dir, geojson_tiers)
         self.csv_exporter = CSVExporter(output_dir)
         self.report_generator = ReportGenerator(output_dir)
         self.logger = logging.getLogger(__name__)
@@ -280,9 +301,9 @@ class CombinedExporter:
         exported_files = {}
         
         try:
-            # Export GeoJSON
-            geojson_path = self.geojson_exporter.export_clusters(result)
-            exported_files['geojson'] = geojson_path
+            # Export GeoJSON, one file per polygon tier
+            for tier, geojson_path in self.geojson_exporter.export_all_tiers(result).items():
+                exported_files['geojson' if tier == 'full' else f'geojson_{tier}'] = geojson_path
             
             # Export CSV files
             csv_summary_path = self.csv_exporter.export_cluster_summary(result)
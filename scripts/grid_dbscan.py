@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Grid DBSCAN
+
+Density-based clustering that uses the raster lattice as the neighbourhood
+structure instead of pairwise distances:
+
+1. Neighbour counts: convolve the foreground mask with a disk of radius eps.
+2. Core pixels: foreground pixels with at least min_samples neighbours
+   (the pixel itself included, as in sklearn).
+3. Clusters: core pixels within eps of each other are joined - adjacent
+   ones by labeling, the rest by linking those components over the other
+   offsets of the eps disk.
+4. Border pixels: non-core foreground pixels within eps of a core pixel take
+   that core's cluster; the remaining foreground pixels are noise.
+
+Every step is a fixed-footprint filter, shifted comparison or labeling pass,
+so the cost is linear in the number of pixels for a given eps. Cluster
+membership of core and noise pixels matches sklearn's DBSCAN exactly; border
+pixels reachable from several clusters join one of them (as in DBSCAN, where
+this depends on visiting order).
+"""
+
+import numpy as np
+from scipy import ndimage
+from scipy.signal import oaconvolve
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from typing import Optional, Tuple
+from label_stats import label_dtype, NODATA
+
+
+def disk(radius: float) -> np.ndarray:
+    """Boolean disk footprint of the given radius in cells."""
+    r = int(np.floor(radius))
+    yy, xx = np.mgrid[-r:r + 1, -r:r + 1]
+    return (xx * xx + yy * yy) <= radius * radius + 1e-9
+
+
+def eps_to_cells(eps: float, unit: str = "cells", transform=None) -> float:
+    """Convert eps to cells; `unit` is "cells" or "m" (needs the raster transform)."""
+    if unit in ("cells", "cell", "pixels"):
+        return float(eps)
+    if unit in ("m", "metres", "meters"):
+        if transform is None:
+            raise ValueError("eps in metres needs the raster transform")
+        cell_size = (abs(transform.a) + abs(transform.e)) / 2.0
+        return float(eps) / cell_size
+    raise ValueError(f"Unknown eps unit '{unit}' (expected 'cells' or 'm')")
+
+
+def _shifted_pairs(labels: np.ndarray, dy: int, dx: int) -> np.ndarray:
+    """Distinct (label, label) pairs of labeled pixels `(dy, dx)` apart (dy >= 0)."""
+    h, w = labels.shape
+    a = labels[0:h - dy, max(0, -dx):w - max(0, dx)]
+    b = labels[dy:h, max(0, dx):w - max(0, -dx)]
+    linked = (a > 0) & (b > 0) & (a != b)
+    if not linked.any():
+        return np.zeros((0, 2), dtype=np.int64)
+    return np.unique(np.stack([a[linked], b[linked]], axis=1), axis=0)
+
+
+def _join_core_pixels(core: np.ndarray, eps: float) -> Tuple[np.ndarray, int]:
+    """Label core pixels so that cores within eps of each other share a cluster.
+
+    Pixels within one step are joined by an 8- (or 4-) connected labeling; the
+    remaining offsets of the eps disk only link those components, and the
+    component graph is resolved with a connected-components pass.
+    """
+    structure = ndimage.generate_binary_structure(2, 2 if eps >= np.sqrt(2) else 1)
+    components, n = ndimage.label(core, structure=structure)
+    r = int(np.floor(eps))
+    offsets = [(dy, dx) for dy in range(0, r + 1) for dx in range(-r, r + 1)
+               if (dy > 0 or dx > 0) and max(abs(dy), abs(dx)) > 1 and dy * dy + dx * dx <= eps * eps + 1e-9]
+    pairs = [_shifted_pairs(components, dy, dx) for dy, dx in offsets]
+    pairs = np.concatenate(pairs) if pairs else np.zeros((0, 2), dtype=np.int64)
+
+    if len(pairs):
+        graph = coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape=(n + 1, n + 1))
+        _, roots = connected_components(graph, directed=False)
+        # Renumber clusters 1..m in order of their first component
+        _, first, compact = np.unique(roots[1:], return_index=True, return_inverse=True)
+        order = np.argsort(np.argsort(first))
+        lut = np.concatenate(([0], order[compact] + 1))
+        n = len(first)
+    else:
+        lut = np.arange(n + 1)
+
+    dtype = label_dtype(n)
+    return lut.astype(dtype)[components], n
+
+
+def grid_dbscan(mask: np.ndarray, eps: float, min_samples: int,
+                valid: Optional[np.ndarray] = None) -> Tuple[np.ndarray, int]:
+    """DBSCAN of the foreground pixels of `mask` on the raster lattice.
+
+    Args:
+        mask: Foreground (points to cluster)
+        eps: Neighbourhood radius in cells (>= 1)
+        min_samples: Neighbours (including the pixel) needed for a core pixel
+        valid: Valid-data mask; pixels outside it become nodata (-9999)
+
+    Returns:
+        Tuple of (labels 1..n with 0 for background/noise, number of clusters)
+    """
+    if eps < 1:
+        raise ValueError(f"eps must be at least one cell, got {eps}")
+    mask = mask.astype(bool)
+    if valid is not None:
+        mask &= valid
+    footprint = disk(eps)
+
+    counts = oaconvolve(mask.astype(np.float32), footprint.astype(np.float32), mode='same')
+    core = mask & (np.rint(counts) >= min_samples)
+
+    labels, n = _join_core_pixels(core, eps)
+
+    # Border pixels take the label of a core pixel within eps
+    border = mask & ~core
+    if n and border.any():
+        reach = ndimage.maximum_filter(labels, footprint=footprint, mode='constant', cval=0)
+        labels[border] = reach[border]
+
+    if valid is not None:
+        labels[~valid] = NODATA
+    return labels, n
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+1-D K-Means
+
+K-means for a single value column (e.g. a depth delta raster). The sorted
+values are reduced to weighted points carrying exact count/sum/sum of squares,
+and the optimal contiguous partition of the points is found by dynamic
+programming (divide-and-conquer optimisation, O(k * m log m) for m points):
+
+- With at most max_bins distinct values the points are the distinct values,
+  and the partition is the exact optimum.
+- Otherwise the points are bins cut at both pixel quantiles and equal value
+  steps (never splitting equal values): the quantile cuts keep the bulk of
+  the data resolved however far an outlier stretches the range, the value
+  cuts keep outliers and sparse tails apart from it. The breakpoints found
+  on the bins are then refined on the raw sorted values with Lloyd
+  iterations, which never increase the inertia: the result is a local
+  optimum at least as good as the best partition that respects the bins.
+
+Pixels are assigned with a vectorized searchsorted against the midpoints
+between cluster centers.
+
+One fit solves every k up to k_max, so a parameter sweep over k shares a
+single sorted pass.
+"""
+
+import logging
+import numpy as np
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Tuple
+
+
+DEFAULT_MAX_BINS = 4096
+REFINE_MAX_ITER = 100  # Lloyd iterations on the raw values after a binned solve
+
+
+@dataclass
+class KMeans1DModel:
+    """Optimal k-means partition of one value column."""
+    k: int
+    centers: np.ndarray      # ascending cluster centers
+    boundaries: np.ndarray   # k-1 decision boundaries (midpoints between centers)
+    inertia: float           # within-cluster sum of squares of the weighted points
+
+    def predict(self, values: np.ndarray) -> np.ndarray:
+        """Cluster index 0..k-1 per value (0 = lowest center)."""
+        dtype = np.int8 if self.k <= np.iinfo(np.int8).max else np.int32
+        return np.searchsorted(self.boundaries, values, side='right').astype(dtype)
+
+
+class KMeans1D:
+    """Dynamic-programming k-means solver for 1-D data."""
+
+    def __init__(self, max_bins: int = DEFAULT_MAX_BINS):
+        self.max_bins = max_bins
+        self.logger = logging.getLogger(__name__)
+        self.k_max = 0
+        self._weights = None
+        self._sums = None
+        self._values = None  # sorted raw values, kept only when the points are bins
+        self._value_sums = None
+        self._shift = 0.0
+        self._pw = self._ps = self._pss = None
+        self._cost_tables: List[np.ndarray] = []
+        self._argmin_tables: List[np.ndarray] = []
+
+    def _weighted_points(self, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Reduce values to ascending (weight, sum, sum of squares) per point.
+
+        The points are the distinct values, or bins when there are more than
+        max_bins of them (the sorted values are then kept for refinement).
+        Half the bin cuts are pixel quantiles, half equal value steps.
+        """
+        ordered = np.sort(np.asarray(values, dtype=np.float64).ravel())
+        n = ordered.size
+        starts = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]])
+        self._values = self._value_sums = None
+        if len(starts) > self.max_bins:
+            half = self.max_bins // 2
+            quantile_cuts = ordered[np.linspace(0, n, half, endpoint=False).astype(np.int64)]
+            value_cuts = np.linspace(ordered[0], ordered[-1], self.max_bins - half, endpoint=False)
+            # Each cut moves to the start of its run of equal values
+            starts = np.unique(np.searchsorted(ordered, np.r_[quantile_cuts, value_cuts], side='left'))
+            self._values = ordered
+        weights = np.diff(np.r_[starts, n]).astype(np.float64)
+        return weights, np.add.reduceat(ordered, starts), np.add.reduceat(ordered * ordered, starts)
+
+    def fit(self, values: np.ndarray, k_max: int) -> "KMeans1D":
+        """Solve the optimal partitions of the weighted points for every k <= k_max."""
+        weights, sums, sum_sq = self._weighted_points(values)
+        m = len(weights)
+        self.k_max = max(1, min(int(k_max), m))
+
+        # Prefix sums of points shifted by the overall mean, for numerically stable costs
+        shift = sums.sum() / weights.sum()
+        shifted_sums = sums - shift * weights
+        shifted_sq = sum_sq - 2 * shift * sums + shift * shift * weights
+        self._pw = np.concatenate(([0.0], np.cumsum(weights)))
+        self._ps = np.concatenate(([0.0], np.cumsum(shifted_sums)))
+        self._pss = np.concatenate(([0.0], np.cumsum(shifted_sq)))
+        self._weights = weights
+        self._sums = sums
+
+        # Layer 0: one cluster covering points 0..j
+        ends = np.arange(m)
+        costs = [self._cost(np.zeros(m, dtype=np.int64), ends)]
+        argmins = [np.zeros(m, dtype=np.int64)]
+        for c in range(1, self.k_max):
+            cost, argmin = self._layer(costs[-1], c, m)
+            costs.append(cost)
+            argmins.append(argmin)
+        self._cost_tables = costs
+        self._argmin_tables = argmins
+        self.logger.debug(f"1-D k-means: {m} weighted points, solved k <= {self.k_max}")
+        return self
+
+    def _cost(self, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        """Within-cluster sum of squares of points starts..ends (inclusive)."""
+        w = self._pw[ends + 1] - self._pw[starts]
+        s = self._ps[ends + 1] - self._ps[starts]
+        ss = self._pss[ends + 1] - self._pss[starts]
+        return np.maximum(ss - s * s / np.maximum(w, 1e-300), 0.0)
+
+    def _layer(self, previous: np.ndarray, c: int, m: int) -> Tuple[np.ndarray, np.ndarray]:
+        """DP layer for c+1 clusters: best split for every end point, by divide and conquer.
+
+        The optimal start of the last cluster is monotone in the end point, so
+        each end point only searches between its neighbours' optima.
+        """
+        cost = np.full(m, np.inf)
+        argmin = np.zeros(m, dtype=np.int64)
+        stack = [(c, m - 1, c, m - 1)]
+        while stack:
+            j_lo, j_hi, opt_lo, opt_hi = stack.pop()
+            if j_lo > j_hi:
+                continue
+            j = (j_lo + j_hi) // 2
+            starts = np.arange(opt_lo, min(j, opt_hi) + 1)
+            candidates = previous[starts - 1] + self._cost(starts, np.full(len(starts), j))
+            best = int(np.argmin(candidates))
+            cost[j] = candidates[best]
+            argmin[j] = starts[best]
+            stack.append((j_lo, j - 1, opt_lo, argmin[j]))
+            stack.append((j + 1, j_hi, argmin[j], opt_hi))
+        return cost, argmin
+
+    def can_solve(self, k: int) -> bool:
+        """Whether model(k) is available without refitting."""
+        return bool(self._cost_tables) and (k <= self.k_max or self.k_max == len(self._weights))
+
+    def model(self, k: int) -> KMeans1DModel:
+        """Optimal model for k clusters (k is capped at the number of weighted points)."""
+        if not self._cost_tables:
+            raise ValueError("KMeans1D.fit must be called first")
+        k = max(1, min(int(k), len(self._weights)))
+        if k > self.k_max:
+            raise ValueError(f"Solved only up to k={self.k_max}; refit with a larger k_max")
+
+        # Backtrack the segment starts from the last point
+        m = len(self._weights)
+        end = m - 1
+        segments = []
+        for c in range(k - 1, -1, -1):
+            start = int(self._argmin_tables[c][end]) if c > 0 else 0
+            segments.append((start, end))
+            end = start - 1
+        segments.reverse()
+
+        centers = np.array([self._sums[s:e + 1].sum() / self._weights[s:e + 1].sum() for s, e in segments])
+        inertia = float(self._cost_tables[k - 1][m - 1])
+        if self._values is not None and k > 1:
+            centers, inertia = self._refine(centers)
+        return KMeans1DModel(
+            k=k,
+            centers=centers,
+            boundaries=(centers[:-1] + centers[1:]) / 2.0,
+            inertia=inertia
+        )
+
+    def _refine(self, centers: np.ndarray) -> Tuple[np.ndarray, float]:
+        """Lloyd iterations on the sorted raw values: (centers, inertia) of the refined partition."""
+        values = self._values
+        if self._value_sums is None:
+            # Prefix sums shifted by the mean, so each iteration costs O(k log n)
+            self._shift = values.mean()
+            self._value_sums = np.concatenate(([0.0], np.cumsum(values - self._shift)))
+        splits = None
+        for _ in range(REFINE_MAX_ITER):
+            moved = np.searchsorted(values, (centers[:-1] + centers[1:]) / 2.0, side='left')
+            if splits is not None and np.array_equal(moved, splits):
+                break
+            bounds = np.r_[0, moved, values.size]
+            counts = np.diff(bounds)
+            if np.any(counts == 0):
+                break
+            splits = moved
+            centers = self._shift + np.diff(self._value_sums[bounds]) / counts
+        # Inertia of the assignment predict() makes with the final centers
+        splits = np.searchsorted(values, (centers[:-1] + centers[1:]) / 2.0, side='left')
+        counts = np.diff(np.r_[0, splits, values.size])
+        inertia = float(((values - np.repeat(centers, counts)) ** 2).sum())
+        return centers, inertia
+
+    def sweep(self, values: np.ndarray, k_values: Iterable[int]) -> Dict[int, KMeans1DModel]:
+        """Fit once for max(k_values) and return the model for every requested k."""
+        k_values = list(k_values)
+        self.fit(values, max(k_values))
+        return {k: self.model(k) for k in k_values}
+
+
+def kmeans_1d(values: np.ndarray, k: int, max_bins: int = DEFAULT_MAX_BINS) -> Tuple[np.ndarray, KMeans1DModel]:
+    """Convenience wrapper: (labels 0..k-1, model) for one k."""
+    model = KMeans1D(max_bins).fit(values, k).model(k)
+    return model.predict(values), model
@@ -17,10 +17,21 @@ from sklearn.metrics import silhouette_score, calinski_harabasz_score, davies_bo
 from sklearn.cluster import KMeans, DBSCAN
 import itertools
 import sys
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from rule_parser import RuleParser, RuleConfig
 from cluster_processor import ClusterProcessor, AnalysisResult
+from raster_cache import process_raster_cache
 from pipeline_runner import PipelineRunner
+from parallel_rules import (DEFAULT_MEMORY_FRACTION, DEFAULT_RULE_BYTES, available_memory_bytes,
+                            combine_cache_stats, estimate_rule_bytes, worker_limit)
+from shared_rasters import SharedRasterRegistry, attach_shared_rasters
+from stage_cache import DEFAULT_STAGE_MEMO_BYTES, StageMemo, combine_node_stats, combine_stage_stats
+from pixel_sample import PixelSample
+from search_strategies import STRATEGIES, SearchSpace, Trial, create_strategy, load_warm_start
+from sample_metrics import DEFAULT_SAMPLE_SIZE, pixel_metrics
 from crash_recovery import CrashRecovery, SafeErrorLogger, safe_execute
 
 
@@ -127,6 +138,23 @@ class ClusterQualityMetrics:
         
         return total_cohesion / len(clusters)
     
+    def compute_pixel_metrics(self, result: AnalysisResult) -> Dict[str, Optional[float]]:
+        """Silhouette, Calinski-Harabasz and Davies-Bouldin scores of a result at bounded cost.
+        
+        Calinski-Harabasz and Davies-Bouldin come from the clusters' pixel
+        counts, means and standard deviations; the silhouette from the result's
+        stratified pixel sample (None without one). See sample_metrics.py.
+        """
+        clusters = result.clusters
+        try:
+            return pixel_metrics(np.array([c.pixel_count for c in clusters], dtype=np.float64),
+                                 np.array([c.mean_value for c in clusters], dtype=np.float64),
+                                 np.array([c.std_value for c in clusters], dtype=np.float64),
+                                 result.metric_sample)
+        except Exception as e:
+            self.logger.warning(f"Could not compute pixel metrics: {e}")
+            return {'silhouette_score': None, 'calinski_harabasz_score': 0.0, 'davies_bouldin_rms_score': float('inf')}
+    
     def compute_cluster_separation(self, clusters: List[Any]) -> float:
         """Compute cluster separation based on centroid distances."""
         if len(clusters) < 2:
@@ -147,11 +175,14 @@ class ClusterQualityMetrics:
         
         return total_distance / count if count > 0 else 0.0
     
-    def compute_composite_score(self, result: AnalysisResult) -> float:
-        """Compute a composite quality score for the clustering result."""
+    def compute_composite_score(self, result: AnalysisResult,
+                                pixel_scores: Optional[Dict[str, Optional[float]]] = None) -> float:
+        """Compute a composite quality score for the clustering result.
+        
+        With a silhouette in `pixel_scores` (see compute_pixel_metrics) the
+        silhouette and Davies-Bouldin scores join cohesion and separation.
+        """
         try:
-            # Extract data and labels from the result (this would need to be stored)
-            # For now, use available metrics
             cohesion = self.compute_cluster_cohesion(result.clusters)
             separation = self.compute_cluster_separation(result.clusters)
             
@@ -161,6 +192,13 @@ class ClusterQualityMetrics:
             # Combine metrics (cohesion + separation)
             composite_score = (cohesion + normalized_separation) / 2.0
             
+            silhouette = (pixel_scores or {}).get('silhouette_score')
+            if silhouette is not None:
+                # Pixel-level terms on a 0-1 scale (Davies-Bouldin: lower is better)
+                davies_bouldin = pixel_scores['davies_bouldin_rms_score']
+                composite_score = (cohesion + normalized_separation + (silhouette + 1.0) / 2.0 +
+                                   1.0 / (1.0 + davies_bouldin)) / 4.0
+            
             return composite_score
         except Exception as e:
             self.logger.warning(f"Could not compute composite score: {e}")
@@ -172,13 +210,36 @@ class ParameterOptimizer:
     
     def __init__(self, 
                  data_dir: str = "data/output",
-                 experiments_dir: str = "data/output/experiments"):
+                 experiments_dir: str = "data/output/experiments",
+                 workers: int = 1,
+                 strategy: str = "grid",
+                 budget: Optional[int] = None,
+                 search_space: Optional[SearchSpace] = None,
+                 seed: int = 42,
+                 metrics_sample_size: int = DEFAULT_SAMPLE_SIZE):
         self.data_dir = data_dir
         self.experiments_dir = experiments_dir
+        self.workers = workers
+        
+        # Search strategy ("grid": every combination of OptimizationParams; see search_strategies.py)
+        self.strategy = strategy
+        self.budget = budget
+        self.search_space = search_space
+        self.seed = seed
         self.cluster_processor = ClusterProcessor(data_dir)
         self.quality_metrics = ClusterQualityMetrics()
+        
+        # Pixels sampled per experiment for the silhouette (0: no sample, silhouette not computed)
+        self.metrics_sample_size = metrics_sample_size
+        self.cluster_processor.metrics_sample_size = metrics_sample_size or None
         self.logger = logging.getLogger(__name__)
         
+        # Counters reported by experiment workers and throughput of the last optimize_rule
+        self._worker_cache_stats: List[Dict[str, Any]] = []
+        self._worker_stage_stats: List[Dict[str, Any]] = []
+        self._worker_node_stats: List[Dict[str, Dict[str, int]]] = []
+        self.execution: Dict[str, Any] = {}
+        
         os.makedirs(experiments_dir, exist_ok=True)
     
     def generate_parameter_combinations(self, rule_config: RuleConfig, 
@@ -227,6 +288,21 @@ class ParameterOptimizer:
                                 }
                             }
                             combinations.append(params)
+                        elif algorithm == 'dbscan' and k == opt_params.k_values[0]:
+                            # DBSCAN does not depend on k: one experiment per threshold
+                            params = {
+                                **base_params,
+                                'clustering': {
+                                    'method': 'dbscan',
+                                    'eps': 1.5,
+                                    'min_samples': 5
+                                },
+                                'thresholds': {
+                                    'change_threshold': threshold,
+                                    'min_cluster_area': 100.0
+                                }
+                            }
+                            combinations.append(params)
         
         elif rule_config.analysis_type.value == "threshold":
             # For threshold analysis, vary thresholds and min_size
@@ -286,26 +362,22 @@ class ParameterOptimizer:
         
         try:
             # Create original rule config with new parameters
-            modified_config = RuleConfig(
-                name=rule_config.name,
-                analysis_type=rule_config.analysis_type,
-                query_text=rule_config.query_text,
-                attributes=parameters.get('attributes', rule_config.attributes),
-                thresholds=parameters.get('thresholds', rule_config.thresholds),
-                clustering=parameters.get('clustering', rule_config.clustering),
-                visualization=rule_config.visualization,
-                outputs=rule_config.outputs,
-                baseline_id=parameters.get('baseline_id', rule_config.baseline_id),
-                candidate_id=parameters.get('candidate_id', rule_config.candidate_id)
-            )
+            modified_config = self._experiment_config(rule_config, parameters)
             
-            # Process the rule with modified parameters
-            result = self.cluster_processor.process_rule(modified_config)
+            # Process the rule with modified parameters (on a pixel sample for low-fidelity experiments)
+            sample = parameters.get('pixel_sample')
+            self.cluster_processor.pixel_sample = PixelSample(**sample) if sample else None
+            try:
+                result = self.cluster_processor.process_rule(modified_config)
+            finally:
+                self.cluster_processor.pixel_sample = None
             
             # Compute quality metrics
-            composite_score = self.quality_metrics.compute_composite_score(result)
+            pixel_scores = self.quality_metrics.compute_pixel_metrics(result)
+            composite_score = self.quality_metrics.compute_composite_score(result, pixel_scores)
             cohesion = self.quality_metrics.compute_cluster_cohesion(result.clusters)
             separation = self.quality_metrics.compute_cluster_separation(result.clusters)
+            silhouette = pixel_scores['silhouette_score']
             
             processing_time = (datetime.now() - start_time).total_seconds()
             
@@ -317,9 +389,9 @@ class ParameterOptimizer:
                     'composite_score': composite_score,
                     'cohesion': cohesion,
                     'separation': separation,
-                    'silhouette_score': -1.0,  # Would need raw data
-                    'calinski_harabasz_score': 0.0,  # Would need raw data
-                    'davies_bouldin_score': float('inf')  # Would need raw data
+                    'silhouette_score': silhouette if silhouette is not None else -1.0,
+                    'calinski_harabasz_score': pixel_scores['calinski_harabasz_score'],
+                    'davies_bouldin_rms_score': pixel_scores['davies_bouldin_rms_score']
                 },
                 clusters_count=len(result.clusters),
                 total_area=result.statistics.get('total_area', 0.0),
@@ -332,43 +404,186 @@ class ParameterOptimizer:
             
         except Exception as e:
             self.logger.error(f"Error in experiment {experiment_id}: {e}")
-            # Return a failed experiment result
-            return ExperimentResult(
-                experiment_id=experiment_id,
-                rule_name=rule_config.name,
-                parameters=parameters,
-                metrics={'composite_score': 0.0, 'cohesion': 0.0, 'separation': 0.0},
-                clusters_count=0,
-                total_area=0.0,
-                mean_cluster_value=0.0,
-                processing_time=0.0,
-                timestamp=datetime.now().isoformat()
-            )
+            return self._failed_experiment(rule_config, parameters, experiment_id)
+    
+    def _experiment_config(self, rule_config: RuleConfig, parameters: Dict[str, Any]) -> RuleConfig:
+        """The rule with an experiment's parameters applied."""
+        return RuleConfig(
+            name=rule_config.name,
+            analysis_type=rule_config.analysis_type,
+            query_text=rule_config.query_text,
+            attributes=parameters.get('attributes', rule_config.attributes),
+            thresholds=parameters.get('thresholds', rule_config.thresholds),
+            clustering=parameters.get('clustering', rule_config.clustering),
+            visualization=rule_config.visualization,
+            outputs=rule_config.outputs,
+            baseline_id=parameters.get('baseline_id', rule_config.baseline_id),
+            candidate_id=parameters.get('candidate_id', rule_config.candidate_id),
+            timestep=rule_config.timestep,
+            features=rule_config.features,
+            derive=rule_config.derive,
+            analysis_attribute=rule_config.analysis_attribute
+        )
+    
+    def _failed_experiment(self, rule_config: RuleConfig, parameters: Dict[str, Any],
+                           experiment_id: str) -> ExperimentResult:
+        """Result recorded for an experiment that raised."""
+        return ExperimentResult(
+            experiment_id=experiment_id,
+            rule_name=rule_config.name,
+            parameters=parameters,
+            metrics={'composite_score': 0.0, 'cohesion': 0.0, 'separation': 0.0},
+            clusters_count=0,
+            total_area=0.0,
+            mean_cluster_value=0.0,
+            processing_time=0.0,
+            timestamp=datetime.now().isoformat()
+        )
     
     def optimize_rule(self, rule_config: RuleConfig, 
                      opt_params: OptimizationParams) -> List[ExperimentResult]:
-        """Optimize parameters for a single rule."""
+        """Optimize parameters for a single rule.
+        
+        With `workers` > 1 the experiments run in a process pool (see
+        ExperimentExecutor); results are logged as they complete and returned
+        in experiment order either way. With a strategy other than "grid" the
+        experiments are proposed by that search strategy instead of being the
+        combinations of `opt_params` (see search).
+        """
         self.logger.info(f"Optimizing rule: {rule_config.name}")
+        process_raster_cache().reset_counters()
+        self._worker_cache_stats = []
+        self._worker_stage_stats = []
+        self._worker_node_stats = []
+        stage_cache = self.cluster_processor.stage_cache
+        if stage_cache is not None:
+            stage_cache.reset_counters()
+        if self.strategy != "grid":
+            return self.search(rule_config, opt_params)
         
         # Generate parameter combinations
         combinations = self.generate_parameter_combinations(rule_config, opt_params)
         self.logger.info(f"Generated {len(combinations)} parameter combinations")
+        experiments = [(f"{rule_config.name}_{i:03d}", params) for i, params in enumerate(combinations)]
+        branches = self.stage_branches(rule_config, experiments)
+        self.logger.info(f"Stage tree: {len(branches)} branches below the shared value raster")
         
-        # Run experiments
-        results = []
-        for i, params in enumerate(combinations):
-            experiment_id = f"{rule_config.name}_{i:03d}"
-            self.logger.info(f"Running experiment {i+1}/{len(combinations)}: {experiment_id}")
-            
-            result = self.run_experiment(rule_config, params, experiment_id)
-            results.append(result)
+        # Solve all k values of the sweep in one 1-D k-means fit per input raster
+        k_values = sorted({c['clustering']['k'] for c in combinations if c['clustering'].get('method') == 'kmeans'})
+        with ExperimentExecutor(self, rule_config, min(self.workers, len(experiments)), k_values) as executor:
+            order = {experiment_id: i for i, (experiment_id, _) in enumerate(experiments)}
+            results = sorted(executor.run(branches), key=lambda r: order[r.experiment_id])
+        self.execution = executor.summary()
+        self._log_execution(len(results))
+        return results
+    
+    def search(self, rule_config: RuleConfig, opt_params: OptimizationParams) -> List[ExperimentResult]:
+        """Experiments proposed round by round by the optimizer's search strategy.
         
+        The strategy searches `search_space` (default: SearchSpace() with the
+        algorithms of `opt_params`) with a budget of `budget` experiments and
+        is warm-started with the rule's current parameters and the best ones
+        of a previous run. Each round runs through one ExperimentExecutor, so
+        the worker pool and shared inputs are kept for the whole search.
+        """
+        space = self.search_space or SearchSpace(algorithms=list(opt_params.algorithms))
+        warm_start = [space.from_parameters(rule_config, {'clustering': rule_config.clustering,
+                                                          'thresholds': rule_config.thresholds})]
+        previous = load_warm_start(self.experiments_dir, rule_config.name)
+        if previous is not None:
+            warm_start.append(space.from_parameters(rule_config, previous))
+        
+        k_values = []
+        if 'kmeans' in space.algorithms_for(rule_config):
+            k_values = list(range(space.k_range[0], space.k_range[1] + 1))
+        results: List[ExperimentResult] = []
+        with ExperimentExecutor(self, rule_config, self.workers, k_values) as executor:
+            strategy = create_strategy(self.strategy, space, rule_config, self.budget, warm_start, self.seed,
+                                       batch_size=executor.workers)
+            self.logger.info(f"Search strategy: {strategy.name} (budget {strategy.budget}, "
+                             f"{len(strategy.warm_start)} warm-start candidates)")
+            while True:
+                trials = strategy.ask()
+                if not trials:
+                    break
+                experiments = [(f"{rule_config.name}_{len(results) + i:03d}", self._trial_parameters(space, rule_config, t))
+                               for i, t in enumerate(trials)]
+                batch = {r.experiment_id: r for r in executor.run(self.stage_branches(rule_config, experiments))}
+                for trial, (experiment_id, _) in zip(trials, experiments):
+                    trial.score = batch[experiment_id].metrics.get('composite_score', 0.0)
+                    results.append(batch[experiment_id])
+                strategy.tell(trials)
+        self.execution = {**executor.summary(), 'search': strategy.summary()}
+        self._log_execution(len(results))
+        self.logger.info(f"Search cost: {self.execution['search']['full_resolution_equivalents']:.1f} "
+                         f"full-resolution experiments")
         return results
     
+    def _trial_parameters(self, space: SearchSpace, rule_config: RuleConfig, trial: Trial) -> Dict[str, Any]:
+        """Experiment parameters of a trial; low-fidelity trials carry their pixel sample."""
+        params = space.to_parameters(rule_config, trial.point)
+        sample = trial.sample()
+        if sample is not None:
+            params['pixel_sample'] = sample.to_json()
+        return params
+    
+    def _log_execution(self, experiments: int) -> None:
+        self.logger.info(f"Ran {experiments} experiments in {self.execution['elapsed_seconds']:.1f}s with "
+                         f"{self.execution['workers']} workers ({self.execution['experiments_per_second']:.2f} "
+                         f"experiments/s)")
+        nodes = self.execution['stage_tree']
+        self.logger.info("Stage tree nodes computed/reused: " +
+                         ", ".join(f"{stage} {c['computed']}/{c['reused']}" for stage, c in nodes.items()))
+        
+        stats = self.stage_cache_stats()
+        if stats is not None:
+            self.logger.info(f"Stage cache: {stats['hits']} hits / {stats['misses']} misses ({stats['hit_rate']:.0%})")
+    
+    def stage_branches(self, rule_config: RuleConfig, experiments: List[Tuple[str, Dict[str, Any]]]
+                       ) -> List[List[Tuple[str, Dict[str, Any]]]]:
+        """Experiments grouped by the branch of the rule's stage tree they share.
+        
+        Every experiment of a rule reads the same inputs and value raster (delta
+        or hazard index). Below it, k-means experiments share one 1-D solver of
+        the value raster; experiments clustering the threshold mask share the
+        mask of their thresholds, and connected components also its unfiltered
+        components, whatever their min_size. A branch is run in one process with
+        the stage tree in memory (StageMemo), so each node is computed once.
+        Experiments on a pixel sample have a tree of their own per sample.
+        """
+        branches: Dict[str, List[Tuple[str, Dict[str, Any]]]] = {}
+        for experiment_id, params in experiments:
+            config = self._experiment_config(rule_config, params)
+            sample = params.get('pixel_sample')
+            if self.cluster_processor.clusters_mask(config):
+                branch = json.dumps({'thresholds': config.thresholds, 'pixel_sample': sample},
+                                    sort_keys=True, default=str)
+            else:
+                branch = json.dumps({'value': True, 'pixel_sample': sample}, sort_keys=True)
+            branches.setdefault(branch, []).append((experiment_id, params))
+        return list(branches.values())
+    
+    def raster_cache_stats(self) -> Dict[str, Any]:
+        """In-memory raster cache counters of the last optimize_rule (workers included)."""
+        return combine_cache_stats([process_raster_cache().stats()] + self._worker_cache_stats)
+    
+    def stage_cache_stats(self) -> Optional[Dict[str, Any]]:
+        """Stage cache counters of the last optimize_rule (workers included); None if disabled."""
+        stage_cache = self.cluster_processor.stage_cache
+        if stage_cache is None:
+            return None
+        return combine_stage_stats([stage_cache.stats()] + self._worker_stage_stats)
+    
     def find_best_parameters(self, experiment_results: List[ExperimentResult]) -> Dict[str, Any]:
-        """Find the best parameters from experiment results."""
+        """Find the best parameters from experiment results.
+        
+        Only full-resolution experiments are considered when there are any:
+        scores on a pixel sample just rank candidates for promotion.
+        """
         if not experiment_results:
             return {}
+        experiment_results = [r for r in experiment_results
+                              if 'pixel_sample' not in r.parameters] or experiment_results
         
         # Sort by composite score (higher is better)
         sorted_results = sorted(experiment_results, 
@@ -418,6 +633,9 @@ class ParameterOptimizer:
             'rule_name': rule_name,
             'timestamp': timestamp,
             'total_experiments': len(results),
+            'execution': self.execution,
+            'raster_cache': self.raster_cache_stats(),
+            'stage_cache': self.stage_cache_stats(),
             'results': serializable_results,
             'best_parameters': self.find_best_parameters(results)
         }
@@ -429,12 +647,190 @@ class ParameterOptimizer:
         return filepath
 
 
+class ExperimentExecutor:
+    """Runs the experiments of one rule, in this process or in a pool of experiment workers.
+    
+    With more than one worker, the rule's input rasters are loaded once into
+    shared memory (shared_rasters.py) and every worker attaches them read-only
+    when it starts, so experiments do not re-read them. The worker count is
+    capped by the CPU count and by how many experiment working sets fit in
+    memory (parallel_rules.worker_limit). Experiments are run branch by branch
+    of the rule's stage tree (ParameterOptimizer.stage_branches), each branch
+    in one process with the tree's nodes kept in a StageMemo; a branch larger
+    than its share of the workers is split. Results are yielded as they
+    complete; counters of the workers are handed back to the optimizer.
+    """
+    
+    def __init__(self, optimizer: ParameterOptimizer, rule_config: RuleConfig, workers: int,
+                 kmeans_k_values: Optional[List[int]] = None):
+        self.optimizer = optimizer
+        self.rule_config = rule_config
+        self.requested = workers
+        self.kmeans_k_values = list(kmeans_k_values or [])
+        self.workers = 1
+        self.completed = 0
+        self.shared = 0
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._registry: Optional[SharedRasterRegistry] = None
+        self._nodes: List[Dict[str, Dict[str, int]]] = []
+        self._start = time.perf_counter()
+        self._elapsed: Optional[float] = None
+    
+    def __enter__(self) -> "ExperimentExecutor":
+        processor = self.optimizer.cluster_processor
+        if self.requested > 1:
+            try:
+                estimate = estimate_rule_bytes(processor.catalog, processor.required_inputs(self.rule_config))
+            except Exception:
+                estimate = DEFAULT_RULE_BYTES
+            self.workers = worker_limit(self.requested, [estimate] * self.requested, available_memory_bytes(),
+                                        DEFAULT_MEMORY_FRACTION)
+        if self.workers > 1:
+            self._registry = SharedRasterRegistry()
+            descriptors = self._publish_inputs()
+            self.shared = len(descriptors)
+            cache_bytes = process_raster_cache().max_bytes // self.workers
+            # spawn: workers start clean on every platform instead of inheriting this process's state
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_experiment_worker,
+                initargs=(self.optimizer.data_dir, self.optimizer.experiments_dir, self.kmeans_k_values,
+                          cache_bytes, descriptors, self.optimizer.metrics_sample_size))
+        else:
+            processor.cluster_analyzer.kmeans_k_values = self.kmeans_k_values
+            processor.stage_memo = StageMemo()
+        self._start = time.perf_counter()
+        return self
+    
+    def _publish_inputs(self) -> List[Any]:
+        processor = self.optimizer.cluster_processor
+        if processor._use_tiled_labeling(self.rule_config):
+            return []  # tiled rules stream windows from disk
+        descriptors = []
+        try:
+            for path in processor.input_paths(self.rule_config).values():
+                descriptors.append(self._registry.publish(path, processor.raster_processor.read_raster))
+        except Exception as e:
+            # Unshared rasters are simply read by the workers
+            self.optimizer.logger.warning(f"Could not share input rasters of {self.rule_config.name}: {e}")
+        return descriptors
+    
+    def run(self, branches: List[List[Tuple[str, Dict[str, Any]]]]):
+        """Run branches of (experiment_id, parameters) pairs; yields each ExperimentResult as it completes."""
+        total = sum(len(branch) for branch in branches)
+        if self._pool is None:
+            for branch in branches:
+                for experiment_id, params in branch:
+                    result = self.optimizer.run_experiment(self.rule_config, params, experiment_id)
+                    self._completed(result, total)
+                    yield result
+            return
+        
+        # Whole branches per task, split so that every worker gets a share of the grid
+        chunk = max(1, -(-total // self.workers))
+        tasks = [branch[i:i + chunk] for branch in branches for i in range(0, len(branch), chunk)]
+        futures = {self._pool.submit(_run_experiments_in_worker, self.rule_config, task): task for task in tasks}
+        for future in as_completed(futures):
+            task = futures[future]
+            try:
+                results, counters = future.result()
+                self.optimizer._worker_cache_stats.append(counters['raster_cache'])
+                self.optimizer._worker_node_stats.append(counters['stage_tree'])
+                if counters['stage_cache'] is not None:
+                    self.optimizer._worker_stage_stats.append(counters['stage_cache'])
+            except Exception as e:
+                self.optimizer.logger.error(f"Error in experiments {task[0][0]}..{task[-1][0]}: worker failed: {e}")
+                results = [self.optimizer._failed_experiment(self.rule_config, params, experiment_id)
+                           for experiment_id, params in task]
+            for result in results:
+                self._completed(result, total)
+                yield result
+    
+    def _completed(self, result: ExperimentResult, total: int) -> None:
+        self.completed += 1
+        self.optimizer.logger.info(
+            f"Experiment {self.completed}/{total} done: {result.experiment_id} "
+            f"(score {result.metrics.get('composite_score', 0.0):.4f}, {self.rate():.2f} experiments/s)")
+    
+    def rate(self) -> float:
+        """Experiments completed per second of wall-clock time."""
+        elapsed = self._elapsed if self._elapsed is not None else time.perf_counter() - self._start
+        return self.completed / elapsed if elapsed > 0 else 0.0
+    
+    def summary(self) -> Dict[str, Any]:
+        """Workers, throughput and stage tree nodes computed/reused, for the experiment results file."""
+        memo = self.optimizer.cluster_processor.stage_memo
+        nodes = self._nodes if self._elapsed is not None else [memo.stats()] if memo is not None else []
+        return {
+            'requested_workers': self.requested,
+            'workers': self.workers,
+            'shared_rasters': self.shared,
+            'experiments': self.completed,
+            'elapsed_seconds': self._elapsed if self._elapsed is not None else time.perf_counter() - self._start,
+            'experiments_per_second': self.rate(),
+            'stage_tree': combine_node_stats(nodes + self.optimizer._worker_node_stats)
+        }
+    
+    def __exit__(self, *exc) -> None:
+        self._elapsed = time.perf_counter() - self._start
+        self.optimizer.cluster_processor.cluster_analyzer.kmeans_k_values = []
+        # The in-process stage tree is only kept for the rule's run
+        memo = self.optimizer.cluster_processor.stage_memo
+        self._nodes = [memo.stats()] if memo is not None else []
+        self.optimizer.cluster_processor.stage_memo = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+        if self._registry is not None:
+            self._registry.close()
+            self._registry = None
+
+
+# Optimizer of an experiment worker process (created by _init_experiment_worker)
+_worker_optimizer: Optional[ParameterOptimizer] = None
+
+
+def _init_experiment_worker(data_dir: str, experiments_dir: str, kmeans_k_values: List[int],
+                            memory_cache_bytes: int, shared: List[Any], metrics_sample_size: int) -> None:
+    """Process pool initializer: one optimizer per worker, with the shared inputs attached."""
+    global _worker_optimizer
+    _worker_optimizer = ParameterOptimizer(data_dir, experiments_dir, metrics_sample_size=metrics_sample_size)
+    _worker_optimizer.cluster_processor.cluster_analyzer.kmeans_k_values = kmeans_k_values
+    # Stage tree nodes stay in memory for every branch this worker runs; workers share the budget
+    _worker_optimizer.cluster_processor.stage_memo = StageMemo(
+        DEFAULT_STAGE_MEMO_BYTES * memory_cache_bytes // max(process_raster_cache().max_bytes, 1))
+    cache = process_raster_cache()
+    cache.max_bytes = memory_cache_bytes
+    attach_shared_rasters(shared, cache)
+
+
+def _run_experiments_in_worker(rule_config: RuleConfig, experiments: List[Tuple[str, Dict[str, Any]]]
+                               ) -> Tuple[List[ExperimentResult], Dict[str, Any]]:
+    """Process-pool entry point: experiments of one branch, with the counters they caused."""
+    processor = _worker_optimizer.cluster_processor
+    cache = process_raster_cache()
+    cache.reset_counters()
+    processor.stage_memo.reset_counters()
+    if processor.stage_cache is not None:
+        processor.stage_cache.reset_counters()
+    results = [_worker_optimizer.run_experiment(rule_config, params, experiment_id)
+               for experiment_id, params in experiments]
+    return results, {'raster_cache': cache.stats(),
+                     'stage_tree': processor.stage_memo.stats(),
+                     'stage_cache': processor.stage_cache.stats() if processor.stage_cache is not None else None}
+
+
 class PipelineOptimizer:
     """Main optimizer that orchestrates the optimization process."""
     
     def __init__(self, 
                  scripts_dir: str = "scripts",
-                 data_dir: str = "data/output"):
+                 data_dir: str = "data/output",
+                 workers: int = 1,
+                 strategy: str = "grid",
+                 budget: Optional[int] = None,
+                 search_space: Optional[SearchSpace] = None,
+                 metrics_sample_size: int = DEFAULT_SAMPLE_SIZE):
         self.scripts_dir = scripts_dir
         self.data_dir = data_dir
         
@@ -449,7 +845,9 @@ class PipelineOptimizer:
             self.rules_dir = os.path.join(project_root, "data", "input", "rules")
         
         self.rule_parser = RuleParser(self.rules_dir)
-        self.parameter_optimizer = ParameterOptimizer(data_dir)
+        self.parameter_optimizer = ParameterOptimizer(data_dir, workers=workers, strategy=strategy, budget=budget,
+                                                      search_space=search_space,
+                                                      metrics_sample_size=metrics_sample_size)
         self.logger = logging.getLogger(__name__)
     
     def save_best_params(self, rule_name: str, best_params: Dict[str, Any]) -> str:
@@ -549,7 +947,8 @@ class PipelineOptimizer:
                     continue
                 
                 f.write(f"**Status:** ✅ Success\n")
-                f.write(f"**Total experiments:** {result.get('total_experiments', 0)}\n\n")
+                f.write(f"**Total experiments:** {result.get('total_experiments', 0)} "
+                        f"({result.get('experiments_per_second', 0.0):.2f} experiments/s)\n\n")
                 
                 best_params = result.get('best_parameters', {})
                 if best_params:
@@ -646,6 +1045,7 @@ class PipelineOptimizer:
                 optimization_results[rule_config.name] = {
                     'best_parameters': best_params,
                     'total_experiments': len(experiment_results),
+                    'experiments_per_second': self.parameter_optimizer.execution.get('experiments_per_second', 0.0),
                     'results_file': results_file,
                     'best_params_file': best_params_file,
                     'rule_json_updated': update_success
@@ -703,6 +1103,7 @@ class PipelineOptimizer:
                 'rule_name': rule_name,
                 'best_parameters': best_params,
                 'total_experiments': len(experiment_results),
+                'experiments_per_second': self.parameter_optimizer.execution.get('experiments_per_second', 0.0),
                 'results_file': results_file
             }
             
@@ -720,17 +1121,44 @@ def main():
     parser.add_argument('--all-rules', action='store_true', help='Optimize all rules')
     parser.add_argument('--scripts-dir', default='scripts', help='Scripts directory')
     parser.add_argument('--data-dir', default='data/output', help='Data output directory')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                       help='Experiments run in parallel (process pool, capped by available memory); '
+                            'default: CPU count')
+    parser.add_argument('--strategy', choices=STRATEGIES, default='grid',
+                       help='Search strategy: every grid combination (default), random search, '
+                            'successive halving on pixel samples, or Bayesian (model-based) search')
+    parser.add_argument('--budget', type=int,
+                       help='Candidates of an adaptive strategy (halving: candidates of the first rung)')
+    parser.add_argument('--k-range', type=int, nargs=2, metavar=('MIN', 'MAX'),
+                       help='k range of an adaptive strategy')
+    parser.add_argument('--threshold-range', type=float, nargs=2, metavar=('MIN', 'MAX'),
+                       help='Threshold range of an adaptive strategy (searched on a log scale)')
+    parser.add_argument('--min-size-range', type=int, nargs=2, metavar=('MIN', 'MAX'),
+                       help='min_size range of an adaptive strategy (searched on a log scale)')
+    parser.add_argument('--metrics-sample-size', type=int, default=DEFAULT_SAMPLE_SIZE,
+                       help='Pixels sampled per experiment (balanced across clusters) for the exact silhouette '
+                            'score, whose cost grows with the square of the sample size; 0 disables it '
+                            f'(default: {DEFAULT_SAMPLE_SIZE})')
     
     args = parser.parse_args()
     
     # Set up logging
     logging.basicConfig(level=logging.INFO)
     
-    # Initialize optimizer
-    optimizer = PipelineOptimizer(args.scripts_dir, args.data_dir)
-    
     # Set up optimization parameters
     opt_params = OptimizationParams()
+    search_space = SearchSpace(algorithms=list(opt_params.algorithms))
+    if args.k_range:
+        search_space.k_range = tuple(args.k_range)
+    if args.threshold_range:
+        search_space.threshold_range = tuple(args.threshold_range)
+    if args.min_size_range:
+        search_space.min_size_range = tuple(args.min_size_range)
+    
+    # Initialize optimizer
+    optimizer = PipelineOptimizer(args.scripts_dir, args.data_dir, workers=args.workers, strategy=args.strategy,
+                                  budget=args.budget, search_space=search_space,
+                                  metrics_sample_size=args.metrics_sample_size)
     
     crash_recovery = CrashRecovery()
     error_logger = SafeErrorLogger()
@@ -766,6 +1194,7 @@ def main():
                     print(f"  Best params file: {result.get('best_params_file', 'N/A')}")
                     print(f"  Rule JSON updated: {result.get('rule_json_updated', False)}")
                     print(f"  Total experiments: {result.get('total_experiments', 0)}")
+                    print(f"  Throughput: {result.get('experiments_per_second', 0.0):.2f} experiments/s")
         
         elif args.rule:
             # Optimize single rule with crash protection
@@ -789,6 +1218,7 @@ def main():
                 print(f"  [OK] Success")
                 print(f"  Best parameters: {result.get('best_parameters', {})}")
                 print(f"  Total experiments: {result.get('total_experiments', 0)}")
+                print(f"  Throughput: {result.get('experiments_per_second', 0.0):.2f} experiments/s")
                 
                 # Also save best params and update JSON for single rule
                 best_params = result.get('best_parameters', {})
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Parallel Rule Execution Helpers
+
+Rules are independent once their rasters are exported, so the pipeline runner
+can analyse several of them at once in a process pool. This module holds the
+pieces that decide how many: an estimate of each rule's working set from the
+raster catalog, the machine's available memory, and the resulting worker cap.
+It also merges the raster cache counters that workers report back.
+
+A rule's working set is its input grids (float32) times a factor for the
+arrays built from them: the derived quantity, the mask, the label raster and
+the visualization copies.
+"""
+
+import os
+import sys
+import logging
+from typing import Any, Dict, List, Optional
+
+
+WORKING_SET_FACTOR = 6
+DEFAULT_RULE_BYTES = 512 * 1024 ** 2
+DEFAULT_MEMORY_FRACTION = 0.75
+CACHE_COUNTERS = ('hits', 'misses', 'conversions', 'evictions', 'bytes_loaded', 'bytes_served')
+
+logger = logging.getLogger(__name__)
+
+
+def available_memory_bytes() -> Optional[int]:
+    """Physical memory currently available, or None if it cannot be determined."""
+    try:
+        import psutil
+        return int(psutil.virtual_memory().available)
+    except ImportError:
+        pass
+    if hasattr(os, 'sysconf'):
+        try:
+            return int(os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE'))
+        except (ValueError, OSError):
+            pass
+    if sys.platform == 'win32':
+        try:
+            import ctypes
+
+            class MemoryStatus(ctypes.Structure):
+                _fields_ = [('dwLength', ctypes.c_ulong), ('dwMemoryLoad', ctypes.c_ulong),
+                            ('ullTotalPhys', ctypes.c_ulonglong), ('ullAvailPhys', ctypes.c_ulonglong),
+                            ('ullTotalPageFile', ctypes.c_ulonglong), ('ullAvailPageFile', ctypes.c_ulonglong),
+                            ('ullTotalVirtual', ctypes.c_ulonglong), ('ullAvailVirtual', ctypes.c_ulonglong),
+                            ('ullAvailExtendedVirtual', ctypes.c_ulonglong)]
+
+            status = MemoryStatus()
+            status.dwLength = ctypes.sizeof(MemoryStatus)
+            if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+                return int(status.ullAvailPhys)
+        except Exception as e:
+            logger.debug(f"Could not query Windows memory status: {e}")
+    return None
+
+
+def estimate_rule_bytes(catalog, required: Dict[int, List[str]],
+                        factor: int = WORKING_SET_FACTOR) -> int:
+    """Working-set estimate of one rule from the catalogued size of its inputs.
+
+    Args:
+        catalog: RasterCatalog holding the exported rasters
+        required: Attributes per simulation id (ClusterProcessor.required_inputs)
+        factor: Arrays held per input grid while the rule runs
+
+    Returns:
+        Estimated peak bytes (DEFAULT_RULE_BYTES when no input is catalogued)
+    """
+    input_bytes = 0
+    for sim_id, attributes in required.items():
+        for attr in attributes:
+            rows = [r for r in catalog.find(sim_id, attr) if r.get('width') and r.get('height')]
+            if rows:
+                input_bytes += max(r['width'] * r['height'] for r in rows) * 4
+    if input_bytes == 0:
+        return DEFAULT_RULE_BYTES
+    return input_bytes * factor
+
+
+def worker_limit(requested: int, rule_bytes: List[int], available: Optional[int] = None,
+                 memory_fraction: float = DEFAULT_MEMORY_FRACTION,
+                 cpu_count: Optional[int] = None) -> int:
+    """Number of rules to run at once.
+
+    Bounded by the requested workers, the number of rules, the CPU count and
+    by how many of the largest rules fit in `memory_fraction` of the
+    available memory. Never below one.
+    """
+    limit = min(requested, len(rule_bytes), cpu_count or os.cpu_count() or 1)
+    if available is not None and rule_bytes:
+        largest = max(max(rule_bytes), 1)
+        limit = min(limit, int(available * memory_fraction) // largest)
+    return max(1, limit)
+
+
+def combine_cache_stats(stats: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Sum raster cache counters reported by several processes.
+
+    Counters (CACHE_COUNTERS) are summed and the hit rate recomputed; sizes
+    and limits are taken from the first entry, the parent's own cache.
+    """
+    combined = dict(stats[0])
+    for entry in stats[1:]:
+        for key in CACHE_COUNTERS:
+            if key in entry:
+                combined[key] = combined.get(key, 0) + entry[key]
+    if 'hits' in combined and 'misses' in combined:
+        lookups = combined['hits'] + combined['misses']
+        combined['hit_rate'] = combined['hits'] / lookups if lookups else 0.0
+    return combined
@@ -12,14 +12,27 @@ import subprocess
 import logging
 import time
 from datetime import datetime
-from typing import Dict, List, Any, Optional
+from typing import Dict, Iterable, List, Any, Optional
 import json
 import argparse
+import threading
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, as_completed, wait
 
 from rule_parser import RuleParser, RuleConfig
 from cluster_processor import ClusterProcessor
+from raster_cache import process_raster_cache
 from visualizer import RasterVisualizer, VisualizationConfig
 from exporter import CombinedExporter
+from polygon_lod import DEFAULT_TOLERANCE_CELLS, DEFAULT_EXPORT_TIERS
+from parallel_rules import (DEFAULT_MEMORY_FRACTION, DEFAULT_RULE_BYTES, available_memory_bytes,
+                            combine_cache_stats, estimate_rule_bytes, worker_limit)
+from shared_rasters import SharedRasterRegistry, attach_shared_rasters, detach_all
+from stage_cache import DEFAULT_STAGE_CACHE_BYTES, combine_stage_stats
+from export_orchestrator import DEFAULT_MAX_CONCURRENT, ExportOrchestrator
+from export_planner import EXPORT_TIMESTEP_MODE, ExportPlan, ExportPlanner
+from raster_watcher import (DEFAULT_DEBOUNCE, DEFAULT_POLL_INTERVAL, DEFAULT_QUEUE_SIZE, RasterChange,
+                            RasterWatcher, RuleTriggerQueue, affected_rules)
 from verify_pipeline_results import PipelineVerifier
 from crash_recovery import CrashRecovery, SafeErrorLogger
 
@@ -33,13 +46,20 @@ class PipelineRunner:
                  icm_exchange_path: str = "output/ICM_Release.x64/ICMExchange.exe",
                  run_simulations: bool = False,
                  monitor_mode: bool = False,
-                 disable_git: bool = False):
+                 disable_git: bool = False,
+                 worker: bool = False,
+                 force_export: bool = False):
         self.scripts_dir = scripts_dir
         self.data_dir = data_dir
         self.icm_exchange_path = icm_exchange_path
         self.run_simulations = run_simulations
         self.monitor_mode = monitor_mode
         self.disable_git = disable_git
+        # Export even what the catalog records as already exported with matching parameters
+        self.force_export = force_export
+        # Worker runners (parallel mode) buffer their markdown lines for the parent to write
+        self.worker = worker
+        self._md_buffer: Optional[List[str]] = [] if worker else None
         
         # Determine project root - parent directory of scripts_dir
         # If scripts_dir is relative, resolve from current working directory
@@ -67,7 +87,7 @@ class PipelineRunner:
         self.rule_parser = RuleParser(rules_dir)
         self.rules_dir = rules_dir  # Store for reference
         self.cluster_processor = ClusterProcessor(data_dir)
-        self.visualizer = RasterVisualizer(os.path.join(data_dir, "viz"))
+        self.visualizer = RasterVisualizer(os.path.join(data_dir, "viz"), self.cluster_processor.raster_processor)
         self.exporter = CombinedExporter(os.path.join(data_dir, "results"))
         self.verifier = PipelineVerifier(data_dir)
         
@@ -75,13 +95,47 @@ class PipelineRunner:
         self.logger = self._setup_logging()
 
         # Markdown log setup - use active folder for running pipelines
-        logs_dir = os.path.join(self.data_dir, "logs", "active")
-        os.makedirs(logs_dir, exist_ok=True)
-        self.md_log_path = os.path.join(logs_dir, f"pipeline_run_{datetime.now().strftime('%Y%m%d_%H%M%S')}.md")
-        self._md_init()
+        if worker:
+            self.md_log_path = None
+            self._load_config()
+        else:
+            logs_dir = os.path.join(self.data_dir, "logs", "active")
+            os.makedirs(logs_dir, exist_ok=True)
+            self.md_log_path = os.path.join(logs_dir, f"pipeline_run_{datetime.now().strftime('%Y%m%d_%H%M%S')}.md")
+            self._md_init()
+        
+        # Labeling mode from pipeline config ("in_memory" or "tiled"); rule JSON clustering blocks may override
+        self.cluster_processor.labeling_mode = self._cfg.get('labeling_mode', 'in_memory')
+        self.cluster_processor.tile_size = int(self._cfg.get('tile_size', 1024))
+        
+        # Polygon detail tiers: tolerance of the simplified tier (cells) and tiers written as GeoJSON
+        self.cluster_processor.cluster_analyzer.simplify_tolerance_cells = float(
+            self._cfg.get('simplify_tolerance_cells', DEFAULT_TOLERANCE_CELLS))
+        self.geojson_tiers = self._cfg.get('geojson_tiers', DEFAULT_EXPORT_TIERS)
+        
+        # Background ICMExchange exports, limited by licences/CPU (max_concurrent_exports)
+        self.exports = ExportOrchestrator(int(self._cfg.get('max_concurrent_exports', DEFAULT_MAX_CONCURRENT)),
+                                          cwd=self.project_root, logger=self.logger)
+        # Exports of the whole run, planned before the first rule (see plan_exports)
+        self._export_plan: Optional[ExportPlan] = None
+        
+        # Memory-mapped raster cache (data/output/.cache/rasters), size-bounded
+        self.cluster_processor.raster_processor.configure_cache(
+            bool(self._cfg.get('raster_cache_enabled', True)),
+            int(float(self._cfg.get('raster_cache_max_gb', 10)) * 1024 ** 3)
+        )
+        # Process-wide in-memory LRU shared by processing, visualization and the optimizer
+        process_raster_cache().max_bytes = int(float(self._cfg.get('raster_memory_cache_mb', 2048)) * 1024 ** 2)
+        # Memoized delta/mask/label/cluster stage outputs (data/output/.cache/stages), size-bounded
+        self.cluster_processor.configure_stage_cache(
+            bool(self._cfg.get('stage_cache_enabled', True)),
+            int(float(self._cfg.get('stage_cache_max_gb', DEFAULT_STAGE_CACHE_BYTES / 1024 ** 3)) * 1024 ** 3)
+        )
         
         # Results tracking
         self.results = []
+        self._worker_cache_stats: List[Dict[str, Any]] = []
+        self._worker_stage_stats: List[Dict[str, Any]] = []
         self.run_manifest = {
             'start_time': None,
             'end_time': None,
@@ -104,6 +158,14 @@ class PipelineRunner:
             '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
         )
         
+        if self.worker:
+            # Workers log to the console only (once per process); the parent owns the run's log files
+            if not logger.handlers:
+                console_handler = logging.StreamHandler()
+                console_handler.setFormatter(formatter)
+                logger.addHandler(console_handler)
+            return logger
+        
         # File handler
         log_file = os.path.join(log_dir, f"pipeline_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
         file_handler = logging.FileHandler(log_file)
@@ -118,6 +180,9 @@ class PipelineRunner:
         return logger
 
     def _md_write(self, text: str) -> None:
+        if self._md_buffer is not None:
+            self._md_buffer.append(text)
+            return
         try:
             with open(self.md_log_path, 'a', encoding='utf-8') as f:
                 f.write(text + "\n")
@@ -127,7 +192,9 @@ class PipelineRunner:
     def _md_init(self) -> None:
         self._md_write(f"# Cluster Analysis Pipeline Run")
         self._md_write("")
+        self._load_config()
 
+    def _load_config(self) -> None:
         # Load pipeline config for naming
         self._cfg = {}
         try:
@@ -195,58 +262,72 @@ class PipelineRunner:
         self._md_write("")
     
     def run_ruby_export(self, sim_id: int, attributes: List[str], output_dir: str) -> bool:
-        """Run Ruby script to export rasters via ICMExchange."""
-        try:
-            # Prepare command with absolute script path and default cwd
-            script_path = os.path.abspath(os.path.join(self.scripts_dir, "export_rasters.rb"))
-            cmd = [
-                self.icm_exchange_path,
-                script_path,
-                str(sim_id),
-                output_dir,
-                ','.join(attributes)
-            ]
-            self.logger.info(f"Running Ruby export: {' '.join(cmd)}")
-            
-            result = subprocess.run(
-                cmd,
-                cwd=self.project_root,
-                capture_output=True,
-                text=True
-            )
-            
-            if result.returncode == 0:
-                self.logger.info("Ruby export completed successfully")
-                self.logger.info(f"Export output: {result.stdout}")
-                return True
-            else:
-                self.logger.error(f"Ruby export failed with return code {result.returncode}")
-                self.logger.error(f"Error output: {result.stderr}")
-                return False
-                
-        except Exception as e:
-            self.logger.error(f"Error running Ruby export: {e}")
-            return False
+        """Run Ruby script to export rasters via ICMExchange (waits for the export)."""
+        return self.submit_ruby_export(sim_id, attributes, output_dir).result()
+    
+    def submit_ruby_export(self, sim_id: int, attributes: List[str], output_dir: str) -> Future:
+        """Queue a raster export on the export orchestrator; the future resolves to success.
+        
+        The export is indexed in the raster catalog as soon as it lands, so
+        lookups never have to walk the output tree, and recorded with its
+        parameters so that later runs can skip it while it is up to date.
+        """
+        # Prepare command with absolute script path and default cwd
+        script_path = os.path.abspath(os.path.join(self.scripts_dir, "export_rasters.rb"))
+        cmd = [
+            self.icm_exchange_path,
+            script_path,
+            str(sim_id),
+            output_dir,
+            ','.join(attributes)
+        ]
+        catalog = self.cluster_processor.raster_processor.catalog
+        source = self._export_source()
+        
+        def landed():
+            catalog.index_directory(output_dir)
+            # export_rasters.rb always writes every timestep; without a source identity nothing is up to date
+            if source is not None:
+                catalog.record_export(output_dir, sim_id, attributes, EXPORT_TIMESTEP_MODE, source)
+        
+        return self.exports.submit(('raster', sim_id, tuple(attributes), os.path.abspath(output_dir)), cmd,
+                                   f"Ruby export sim {sim_id}", landed)
+    
+    def _export_source(self) -> Optional[str]:
+        """Identity of the results being exported: the model and when it was last written.
+        
+        For a model file, its path and modification time; for a model
+        directory, its path and the newest modification time of the files in
+        it (simulation results included). Rasters exported from another model,
+        or before it was last written (e.g. by a simulation re-run), are not up
+        to date. None when the model cannot be found: nothing is then recorded
+        or skipped as up to date.
+        """
+        mp = self._cfg.get('model_path') or ''
+        if not mp:
+            return None
+        path = os.path.abspath(mp if os.path.isabs(mp) else os.path.join(self.project_root, mp))
+        if os.path.isfile(path):
+            return f"{path}@{os.stat(path).st_mtime_ns}"
+        if os.path.isdir(path):
+            newest = max((os.stat(os.path.join(root, name)).st_mtime_ns
+                          for root, _, files in os.walk(path) for name in files), default=None)
+            if newest is not None:
+                return f"{path}@{newest}"
+        return None
     
     def run_results_csv_export(self, sim_id: int, output_dir: str, selection_json: Optional[str] = None) -> bool:
-        """Run Ruby script to export simulation results to CSV via ICMExchange."""
-        try:
-            script_path = os.path.abspath(os.path.join(self.scripts_dir, "export_results_csv.rb"))
-            cmd = [self.icm_exchange_path, script_path, str(sim_id), output_dir]
-            if selection_json:
-                cmd.append(selection_json)
-            self.logger.info(f"Running CSV export: {' '.join(cmd)}")
-            result = subprocess.run(cmd, cwd=self.project_root, capture_output=True, text=True)
-            if result.returncode == 0:
-                if result.stdout.strip():
-                    self.logger.info(result.stdout)
-                return True
-            else:
-                self.logger.error(f"CSV export failed: rc={result.returncode}\n{result.stderr}")
-                return False
-        except Exception as e:
-            self.logger.error(f"Error running CSV export: {e}")
-            return False
+        """Run Ruby script to export simulation results to CSV via ICMExchange (waits for the export)."""
+        return self.submit_results_csv_export(sim_id, output_dir, selection_json).result()
+    
+    def submit_results_csv_export(self, sim_id: int, output_dir: str, selection_json: Optional[str] = None) -> Future:
+        """Queue a CSV results export on the export orchestrator; the future resolves to success."""
+        script_path = os.path.abspath(os.path.join(self.scripts_dir, "export_results_csv.rb"))
+        cmd = [self.icm_exchange_path, script_path, str(sim_id), output_dir]
+        if selection_json:
+            cmd.append(selection_json)
+        return self.exports.submit(('csv', sim_id, os.path.abspath(output_dir), selection_json), cmd,
+                                   f"CSV export sim {sim_id}")
 
     def run_ruby_script(self, script_name: str, *args) -> bool:
         """Run a Ruby script via ICMExchange."""
@@ -345,155 +426,261 @@ class PipelineRunner:
         self._md_write(f"\n## Rule: `{rule_config.name}` ({rule_config.analysis_type.value})")
         
         try:
-            # Export rasters if needed
-            if export_rasters:
-                # Determine which simulations to export
-                if rule_config.analysis_type.value == "comparison":
-                    sim_ids = [rule_config.baseline_id or 1, rule_config.candidate_id or 2]
-                else:
-                    sim_ids = [rule_config.baseline_id or 1]
-                
-                # Export rasters for each simulation
-                # Use raster/db/grupa/run/sim_<id> structure (instead of data_dir/db/grupa/run/rasters)
-                for sim_id in sim_ids:
-                    # Build raster path: raster/db/grupa/run/sim_<id>
-                    # Note: _run_name_for_sim already returns sim_<id>, so we use it directly
-                    run_name = self._run_name_for_sim(sim_id)
-                    raster_parts = ["raster", self._database_name(), self._group_name(), run_name]
-                    output_dir = os.path.join(self.data_dir, *raster_parts)
-                    os.makedirs(output_dir, exist_ok=True)
-                    
-                    success = self.run_ruby_export(sim_id, rule_config.attributes, output_dir)
-                    if not success:
-                        self.logger.error(f"Failed to export rasters for simulation {sim_id}")
-                        self._md_write(f"- Export failed for simulation {sim_id}")
-                        return None
-                    else:
-                        self._md_write(f"- Exported rasters for simulation {sim_id} → `{output_dir}`")
-            
-            # Optionally export CSV results (2D/1D) for downstream analytics
+            sim_ids = self.prepare_rule_inputs(rule_config, export_rasters)
+            if sim_ids is None:
+                return None
+            return self.analyze_rule(rule_config, sim_ids)
+        except Exception as e:
+            return self._rule_failed(rule_config, e)
+    
+    def _raster_export_dir(self, sim_id: int) -> str:
+        """Export directory of a simulation: raster/db/grupa/run/sim_<id> (not data_dir/db/grupa/run/rasters)."""
+        # Note: _run_name_for_sim already returns sim_<id>, so we use it directly
+        run_name = self._run_name_for_sim(sim_id)
+        raster_parts = ["raster", self._database_name(), self._group_name(), run_name]
+        return os.path.join(self.data_dir, *raster_parts)
+    
+    def plan_exports(self, rules: List[RuleConfig], export_rasters: bool = True) -> ExportPlan:
+        """Plan the ICMExchange exports of a set of rules (rasters, optional CSV results).
+        
+        Exports are merged across the rules, one per simulation with the union
+        of the attributes the rules read, and attributes the raster catalog
+        records as exported with matching parameters are skipped (unless
+        force_export). The plan's exports are queued on the export
+        orchestrator right away, so they run in the background while earlier
+        rules are analysed.
+        """
+        planner = ExportPlanner(self.cluster_processor.raster_processor.catalog, self._export_source(),
+                                force=self.force_export)
+        # Optionally export CSV results (2D/1D) for downstream analytics
+        export_csv = False
+        csv_selection = None
+        try:
+            cfg_path = os.path.join(self.config_dir, 'pipeline_config.json')
+            if os.path.exists(cfg_path):
+                with open(cfg_path, 'r', encoding='utf-8-sig') as f:
+                    cfg = json.load(f)
+                    export_csv = cfg.get('export_csv', False)
+                    sel = cfg.get('csv_selection', None)
+                    if sel is not None:
+                        csv_selection = json.dumps(sel)
+        except Exception as e:
+            self.logger.warning(f"CSV export step skipped due to error: {e}")
+        
+        for rule_config in rules:
             try:
-                cfg_path = os.path.join(self.config_dir, 'pipeline_config.json')
-                export_csv = False
-                csv_selection = None
-                if os.path.exists(cfg_path):
-                    with open(cfg_path, 'r', encoding='utf-8-sig') as f:
-                        cfg = json.load(f)
-                        export_csv = cfg.get('export_csv', False)
-                        sel = cfg.get('csv_selection', None)
-                        if sel is not None:
-                            csv_selection = json.dumps(sel)
-                if export_csv:
-                    for sim_id in ( [rule_config.baseline_id or 1] if rule_config.analysis_type.value != 'comparison' else [rule_config.baseline_id or 1, rule_config.candidate_id or 2] ):
-                        csv_dir = os.path.join(self.data_dir, "experiments", "csv", f"sim_{sim_id}")
-                        os.makedirs(csv_dir, exist_ok=True)
-                        if self.run_results_csv_export(sim_id, csv_dir, csv_selection):
-                            self._md_write(f"- Exported CSV results for simulation {sim_id} → `{csv_dir}`")
-                        else:
-                            self._md_write(f"- CSV export failed for simulation {sim_id}")
+                # Export only the attributes the rule reads, per simulation
+                required = self.cluster_processor.required_inputs(rule_config) if export_rasters else {}
             except Exception as e:
-                self.logger.warning(f"CSV export step skipped due to error: {e}")
-
-            # Re-point outputs to structured layout per first sim (or None)
-            target_sim = (sim_ids[0] if 'sim_ids' in locals() and sim_ids else None)
-            structured_root = self._structured_root(target_sim)
-            self.visualizer = RasterVisualizer(os.path.join(structured_root, "viz"))
-            self.exporter = CombinedExporter(os.path.join(structured_root, "results"))
+                # Left out of the plan: the rule is planned (and fails) on its own when processed
+                if len(rules) > 1:
+                    self.logger.debug(f"Could not plan exports of {rule_config.name}: {e}")
+                    continue
+                raise
+            planner.rule(rule_config.name)
+            for sim_id, attributes in required.items():
+                planner.add_rasters(rule_config.name, sim_id, self._raster_export_dir(sim_id), attributes)
+            if export_csv:
+                for sim_id in ( [rule_config.baseline_id or 1] if rule_config.analysis_type.value != 'comparison' else [rule_config.baseline_id or 1, rule_config.candidate_id or 2] ):
+                    csv_dir = os.path.join(self.data_dir, "experiments", "csv", f"sim_{sim_id}")
+                    planner.add_csv(rule_config.name, sim_id, csv_dir, csv_selection)
+        
+        plan = planner.plan()
+        for export in plan.rasters:
+            if export.skipped:
+                export.future = Future()
+                export.future.set_result(True)
+            else:
+                os.makedirs(export.output_dir, exist_ok=True)
+                export.future = self.submit_ruby_export(export.sim_id, export.attributes, export.output_dir)
+        for export in plan.csv:
+            os.makedirs(export.output_dir, exist_ok=True)
+            export.future = self.submit_results_csv_export(export.sim_id, export.output_dir, export.selection)
+        return plan
+    
+    def schedule_rule_inputs(self, rule_config: RuleConfig, export_rasters: bool = True) -> List[Dict[str, Any]]:
+        """The ICMExchange exports a rule waits for.
+        
+        Taken from the run's export plan; a rule processed on its own (e.g.
+        run_single_rule) is planned here.
+        
+        Returns:
+            Export jobs in order: kind ('raster' or 'csv'), sim_id, attributes
+            the rule reads, the attributes exported in this run, output_dir
+            and the export future
+        """
+        plan = self._export_plan
+        if plan is None or rule_config.name not in plan.rules:
+            plan = self.plan_exports([rule_config], export_rasters)
+        rule_exports = plan.rules[rule_config.name]
+        
+        jobs = []
+        for export, attributes in rule_exports.rasters:
+            jobs.append({'kind': 'raster', 'sim_id': export.sim_id, 'attributes': attributes,
+                         'exported': [a for a in attributes if a in export.attributes],
+                         'output_dir': export.output_dir, 'future': export.future})
+        for export in rule_exports.csv:
+            jobs.append({'kind': 'csv', 'sim_id': export.sim_id, 'attributes': [], 'exported': [],
+                         'output_dir': export.output_dir, 'future': export.future})
+        return jobs
+    
+    def prepare_rule_inputs(self, rule_config: RuleConfig, export_rasters: bool = True) -> Optional[List[int]]:
+        """Run the ICMExchange exports a rule needs and wait for them.
+        
+        Returns:
+            Simulation ids whose rasters were exported (empty without export),
+            or None if a raster export failed
+        """
+        sim_ids = []
+        for job in self.schedule_rule_inputs(rule_config, export_rasters):
+            sim_id = job['sim_id']
+            success = job['future'].result()
+            if job['kind'] == 'raster':
+                if not success:
+                    self.logger.error(f"Failed to export rasters for simulation {sim_id}")
+                    self._md_write(f"- Export failed for simulation {sim_id}")
+                    return None
+                sim_ids.append(sim_id)
+                current = [a for a in job['attributes'] if a not in job['exported']]
+                if job['exported']:
+                    self._md_write(f"- Exported {', '.join(job['exported'])} for simulation {sim_id} → `{job['output_dir']}`")
+                if current:
+                    self._md_write(f"- Up to date: {', '.join(current)} for simulation {sim_id} → `{job['output_dir']}`")
+            elif success:
+                self._md_write(f"- Exported CSV results for simulation {sim_id} → `{job['output_dir']}`")
+            else:
+                self._md_write(f"- CSV export failed for simulation {sim_id}")
+        return sim_ids
+    
+    def analyze_rule(self, rule_config: RuleConfig, sim_ids: List[int]) -> Optional[Dict[str, Any]]:
+        """Cluster, visualize, export and verify a rule whose inputs are in place.
+        
+        Runs in the parent for sequential runs and in a worker process with
+        `--workers N`; outputs land under the structured root of the first
+        exported simulation.
+        """
+        self._point_outputs(rule_config, sim_ids)
 
-            # Process the rule
-            result = self.cluster_processor.process_rule(rule_config)
-            self.results.append(result)
-            self._md_write(f"- Clusters: {len(result.clusters)}")
-            
-            # Create visualizations
-            viz_config = VisualizationConfig()
-            viz_paths = {
-                'overlay': self.visualizer.create_cluster_overlay(result, viz_config),
-                'heatmap': self.visualizer.create_heatmap(result, viz_config),
-                'difference': self.visualizer.create_difference_map(result, viz_config),
-                'animation': self.visualizer.create_animation(result, viz_config)
+        # Process the rule
+        result = self.cluster_processor.process_rule(rule_config)
+        self.results.append(result)
+        self._md_write(f"- Clusters: {len(result.clusters)}")
+        
+        # Create visualizations
+        viz_config = VisualizationConfig()
+        viz_paths = {
+            'overlay': self.visualizer.create_cluster_overlay(result, viz_config),
+            'heatmap': self.visualizer.create_heatmap(result, viz_config),
+            'difference': self.visualizer.create_difference_map(result, viz_config),
+            'animation': self.visualizer.create_animation(result, viz_config)
+        }
+        self._md_write("- Visualizations:")
+        for k, v in viz_paths.items():
+            if v:
+                self._md_write(f"  - {k}: `{v}`")
+        
+        # Export results
+        exported_files = self.exporter.export_all(result, viz_paths)
+        if exported_files:
+            self._md_write("- Exports:")
+            for p in exported_files:
+                self._md_write(f"  - `{p}`")
+        
+        # Track results
+        rule_result = {
+            'rule_name': rule_config.name,
+            'analysis_type': rule_config.analysis_type.value,
+            'clusters_count': len(result.clusters),
+            'statistics': result.statistics,
+            'exported_files': exported_files,
+            'visualization_paths': viz_paths,
+            'processing_time': time.time()
+        }
+        
+        # Run verification
+        self.logger.info(f"Verifying output for rule: {rule_config.name}")
+        try:
+            rule_config_dict = {
+                'outputs': rule_config.outputs.__dict__ if hasattr(rule_config.outputs, '__dict__') else rule_config.outputs
             }
-            self._md_write("- Visualizations:")
-            for k, v in viz_paths.items():
-                if v:
-                    self._md_write(f"  - {k}: `{v}`")
-            
-            # Export results
-            exported_files = self.exporter.export_all(result, viz_paths)
-            if exported_files:
-                self._md_write("- Exports:")
-                for p in exported_files:
-                    self._md_write(f"  - `{p}`")
+            verification_result, verification_log = self.verifier.verify_and_log(
+                rule_config.name,
+                rule_config_dict,
+                os.path.join(self.data_dir, "logs", "active")
+            )
             
-            # Track results
-            rule_result = {
-                'rule_name': rule_config.name,
-                'analysis_type': rule_config.analysis_type.value,
-                'clusters_count': len(result.clusters),
-                'statistics': result.statistics,
-                'exported_files': exported_files,
-                'visualization_paths': viz_paths,
-                'processing_time': time.time()
+            # Add verification status to rule result
+            rule_result['verification'] = {
+                'status': verification_result.get('overall_status', 'unknown'),
+                'passed_checks': verification_result.get('summary', {}).get('passed_checks', 0),
+                'total_checks': verification_result.get('summary', {}).get('total_checks', 0),
+                'log_file': verification_log
             }
             
-            # Run verification
-            self.logger.info(f"Verifying output for rule: {rule_config.name}")
-            try:
-                rule_config_dict = {
-                    'outputs': rule_config.outputs.__dict__ if hasattr(rule_config.outputs, '__dict__') else rule_config.outputs
-                }
-                verification_result, verification_log = self.verifier.verify_and_log(
-                    rule_config.name,
-                    rule_config_dict,
-                    os.path.join(self.data_dir, "logs", "active")
-                )
-                
-                # Add verification status to rule result
-                rule_result['verification'] = {
-                    'status': verification_result.get('overall_status', 'unknown'),
-                    'passed_checks': verification_result.get('summary', {}).get('passed_checks', 0),
-                    'total_checks': verification_result.get('summary', {}).get('total_checks', 0),
-                    'log_file': verification_log
-                }
-                
-                verification_status = verification_result.get('overall_status', 'unknown')
-                if verification_status == 'passed':
-                    self._md_write("- Verification: ✅ passed")
-                elif verification_status == 'partial':
-                    self._md_write("- Verification: ⚠️ partial")
-                else:
-                    self._md_write("- Verification: ❌ failed")
-                    self.logger.warning(f"Verification failed for rule: {rule_config.name}")
-                    # Add to manifest errors but don't fail the rule
-                    self.run_manifest['errors'].append(f"Verification failed for rule {rule_config.name}: see {verification_log}")
-                
-                self._md_write(f"- Verification log: `{verification_log}`")
-                
-            except Exception as e:
-                self.logger.warning(f"Error during verification: {e}")
-                rule_result['verification'] = {
-                    'status': 'error',
-                    'error': str(e)
-                }
-                self._md_write(f"- Verification: ❌ error ({e})")
-            
-            self.run_manifest['rules_processed'].append(rule_result)
+            verification_status = verification_result.get('overall_status', 'unknown')
+            if verification_status == 'passed':
+                self._md_write("- Verification: ✅ passed")
+            elif verification_status == 'partial':
+                self._md_write("- Verification: ⚠️ partial")
+            else:
+                self._md_write("- Verification: ❌ failed")
+                self.logger.warning(f"Verification failed for rule: {rule_config.name}")
+                # Add to manifest errors but don't fail the rule
+                self.run_manifest['errors'].append(f"Verification failed for rule {rule_config.name}: see {verification_log}")
             
-            self.logger.info(f"Successfully processed rule: {rule_config.name}")
-            self._md_write("- Status: success")
-            return rule_result
+            self._md_write(f"- Verification log: `{verification_log}`")
             
         except Exception as e:
-            error_msg = f"Error processing rule {rule_config.name}: {e}"
-            self.logger.error(error_msg)
-            self.run_manifest['errors'].append(error_msg)
-            self._md_write(f"- Status: failed\n- Error: {e}")
-            return None
+            self.logger.warning(f"Error during verification: {e}")
+            rule_result['verification'] = {
+                'status': 'error',
+                'error': str(e)
+            }
+            self._md_write(f"- Verification: ❌ error ({e})")
+        
+        self.run_manifest['rules_processed'].append(rule_result)
+        
+        self.logger.info(f"Successfully processed rule: {rule_config.name}")
+        self._md_write("- Status: success")
+        return rule_result
+    
+    def _point_outputs(self, rule_config: RuleConfig, sim_ids: List[int]) -> None:
+        # Re-point outputs to structured layout per first sim (or None)
+        target_sim = sim_ids[0] if sim_ids else None
+        structured_root = self._structured_root(target_sim)
+        self.visualizer = RasterVisualizer(os.path.join(structured_root, "viz"),
+                                           self.cluster_processor.raster_processor)
+        self.exporter = CombinedExporter(os.path.join(structured_root, "results"),
+                                         rule_config.outputs.get('geojson_tiers', self.geojson_tiers))
+    
+    def _rule_failed(self, rule_config: RuleConfig, e: Exception) -> None:
+        error_msg = f"Error processing rule {rule_config.name}: {e}"
+        self.logger.error(error_msg)
+        self.run_manifest['errors'].append(error_msg)
+        self._md_write(f"- Status: failed\n- Error: {e}")
+        return None
     
-    def run_pipeline(self, rule_names: Optional[List[str]] = None, export_rasters: bool = True) -> Dict[str, Any]:
-        """Run the complete pipeline for specified rules."""
+    def run_pipeline(self, rule_names: Optional[List[str]] = None, export_rasters: bool = True,
+                     workers: Optional[int] = None) -> Dict[str, Any]:
+        """Run the complete pipeline for specified rules.
+        
+        With `workers` > 1 the rules are analysed in a process pool (see
+        _process_rules_parallel); the default comes from `workers` in
+        pipeline_config.json, and 1 processes the rules one after another.
+        """
         self.logger.info("Starting cluster analysis pipeline")
+        # Each run reports only its own rules (monitor mode runs the pipeline repeatedly)
+        self.results = []
+        self.run_manifest['rules_processed'] = []
+        self.run_manifest['errors'] = []
         self.run_manifest['start_time'] = datetime.now().isoformat()
+        process_raster_cache().reset_counters()
+        self._worker_cache_stats = []
+        self._worker_stage_stats = []
+        if self.cluster_processor.stage_cache is not None:
+            self.cluster_processor.stage_cache.reset_counters()
+        if workers is None:
+            workers = int(self._cfg.get('workers', 1))
         
         try:
             # Setup cluster network if simulations are enabled
@@ -519,10 +706,19 @@ class PipelineRunner:
             
             self.logger.info(f"Processing {len(rules_to_process)} rules")
             
+            # Plan every rule's exports up front: one merged export per simulation,
+            # running in the background while earlier rules are analysed
+            self._export_plan = self.plan_exports(rules_to_process, export_rasters)
+            self._log_export_plan(self._export_plan)
+            
             # Process each rule
+            if workers > 1 and len(rules_to_process) > 1:
+                rule_results = self._process_rules_parallel(rules_to_process, export_rasters, workers)
+            else:
+                rule_results = (self.process_rule(rule_config, export_rasters) for rule_config in rules_to_process)
+            
             successful_rules = 0
-            for rule_config in rules_to_process:
-                result = self.process_rule(rule_config, export_rasters)
+            for result in rule_results:
                 if result:
                     successful_rules += 1
                 
@@ -544,6 +740,10 @@ class PipelineRunner:
                 'failed_rules': len(rules_to_process) - successful_rules,
                 'total_clusters': sum(len(r.clusters) for r in self.results)
             }
+            self.run_manifest['raster_cache'] = self._raster_cache_stats()
+            stage_stats = self.stage_cache_stats()
+            if stage_stats is not None:
+                self.run_manifest['stage_cache'] = stage_stats
             
             # Save manifest - use config/active folder for active runs
             config_dir = os.path.join(self.data_dir, "config", "active")
@@ -559,6 +759,12 @@ class PipelineRunner:
             stats = self.run_manifest['statistics']
             self._md_write(f"- Rules: {stats.get('successful_rules',0)}/{stats.get('total_rules',0)}")
             self._md_write(f"- Total clusters: {stats.get('total_clusters',0)}")
+            mem_cache = self.run_manifest['raster_cache']['memory']
+            self._md_write(f"- Raster cache: {mem_cache['hits']} hits / {mem_cache['misses']} misses, "
+                           f"{mem_cache['bytes_loaded'] / 1024 ** 2:.1f} MB loaded")
+            if stage_stats is not None:
+                self._md_write(f"- Stage cache: {stage_stats['hits']} hits / {stage_stats['misses']} misses "
+                               f"({stage_stats['hit_rate']:.0%})")
             if self.run_manifest['errors']:
                 self._md_write("- Errors:")
                 for err in self.run_manifest['errors']:
@@ -572,6 +778,251 @@ class PipelineRunner:
             self.run_manifest['end_time'] = datetime.now().isoformat()
             self.run_manifest['errors'].append(str(e))
             raise
+        
+        finally:
+            self._export_plan = None
+            self.exports.forget()
+    
+    def _log_export_plan(self, plan: ExportPlan) -> None:
+        """Record the export plan in the manifest and the markdown log."""
+        summary = plan.summary()
+        self.run_manifest['exports'] = summary
+        self.logger.info(f"Export plan: {summary['raster_exports']} raster and {summary['csv_exports']} CSV exports "
+                         f"for {summary['requested_exports']} requested, {summary['raster_exports_skipped']} "
+                         f"up to date; queued {self.exports.pending()} ({self.exports.max_concurrent} at a time)")
+        self._md_write("\n### Export Plan")
+        self._md_write(f"- Requested by rules: {summary['requested_exports']}")
+        self._md_write(f"- Raster exports: {summary['raster_exports']} ({summary['attributes_exported']} attributes), "
+                       f"{summary['raster_exports_skipped']} skipped as up to date")
+        self._md_write(f"- Attributes already exported: {summary['attributes_current']}")
+        self._md_write(f"- CSV exports: {summary['csv_exports']}")
+    
+    def _process_rules_parallel(self, rules: List[RuleConfig], export_rasters: bool,
+                                workers: int) -> Iterable[Optional[Dict[str, Any]]]:
+        """Analyse rules in a process pool; returns the rule results in rule order.
+        
+        When the memory estimate or the CPU count allows a single worker, the
+        rules are processed sequentially in this process instead (no pool).
+        
+        Exports run on the export orchestrator in this process. Each rule is
+        handed to a worker runner as soon as its exports have landed, while
+        later exports are still running. At most as many rules run at once as
+        the memory estimate allows. Their input rasters are loaded once into
+        shared memory (unless `shared_rasters` is false in
+        pipeline_config.json) and attached read-only by the workers; the
+        shared copies count towards each rule's memory estimate, a rule is
+        only published and submitted once a worker is free, and its blocks
+        are released as soon as it completes (a block read by several running
+        rules is kept until the last one is done). Workers
+        send back their rule result, analysis result, markdown lines, errors
+        and raster cache counters; these are merged in rule order, so the
+        markdown log and the manifest do not depend on completion order.
+        """
+        # Estimates come from rasters already catalogued (earlier exports of the same grids)
+        catalog = self.cluster_processor.raster_processor.catalog
+        share = bool(self._cfg.get('shared_rasters', True))
+        estimates = []
+        for rule_config in rules:
+            try:
+                required = self.cluster_processor.required_inputs(rule_config)
+                estimate = estimate_rule_bytes(catalog, required)
+                if share and not self.cluster_processor._use_tiled_labeling(rule_config):
+                    # The rule's inputs are also held in shared memory while it runs
+                    estimate += estimate_rule_bytes(catalog, required, factor=1)
+                estimates.append(estimate)
+            except Exception:
+                estimates.append(DEFAULT_RULE_BYTES)  # the rule's own failure is reported when it is prepared
+        available = available_memory_bytes()
+        limit = worker_limit(workers, estimates, available,
+                             float(self._cfg.get('worker_memory_fraction', DEFAULT_MEMORY_FRACTION)))
+        largest_mb = max(estimates, default=0) / 1024 ** 2
+        available_text = f"{available / 1024 ** 2:.0f} MB" if available is not None else "unknown"
+        self.logger.info(f"Analysing {len(rules)} rules with {limit} workers (requested {workers}, "
+                         f"largest rule ~{largest_mb:.0f} MB, available memory {available_text})")
+        if limit <= 1:
+            # A single worker gains nothing over this process, and would cost a spawn and the shared copies
+            self.run_manifest['parallel'] = {
+                'requested_workers': workers,
+                'workers': limit,
+                'rule_bytes_estimates': {r.name: b for r, b in zip(rules, estimates)},
+                'available_memory_bytes': available,
+                'shared_rasters': 0,
+                'shared_bytes': 0,
+                'shared_peak_bytes': 0
+            }
+            return (self.process_rule(rule_config, export_rasters) for rule_config in rules)
+        
+        # Workers share the in-memory raster cache budget
+        options = {
+            'scripts_dir': self.scripts_dir,
+            'data_dir': self.data_dir,
+            'icm_exchange_path': self.icm_exchange_path,
+            'disable_git': self.disable_git
+        }
+        cache_bytes = process_raster_cache().max_bytes // limit
+        
+        prepared = []
+        outcomes: Dict[int, Dict[str, Any]] = {}
+        registry = SharedRasterRegistry()
+        try:
+            # spawn: workers start clean on every platform instead of inheriting this process's state
+            with ProcessPoolExecutor(max_workers=limit, mp_context=multiprocessing.get_context('spawn')) as pool:
+                futures = {}
+                for i, rule_config in enumerate(rules):
+                    self._md_buffer = []
+                    self.logger.info(f"Preparing rule: {rule_config.name}")
+                    self._md_write(f"\n## Rule: `{rule_config.name}` ({rule_config.analysis_type.value})")
+                    try:
+                        sim_ids = self.prepare_rule_inputs(rule_config, export_rasters)
+                    except Exception as e:
+                        self._rule_failed(rule_config, e)
+                        sim_ids = None
+                    prepared.append((rule_config, self._md_buffer, sim_ids))
+                    self._md_buffer = None
+                    if sim_ids is not None:
+                        # Hold shared inputs only for rules a worker can start on
+                        running = {f for f in futures if not f.done()}
+                        while len(running) >= limit:
+                            running = wait(running, return_when=FIRST_COMPLETED).not_done
+                        descriptors = self._publish_inputs(registry, rule_config) if share else []
+                        future = pool.submit(_analyze_rule_in_worker, options, cache_bytes,
+                                             rule_config, sim_ids, descriptors)
+                        future.add_done_callback(lambda _, shared=descriptors: registry.release(shared))
+                        futures[future] = i
+                for future in as_completed(futures):
+                    i = futures[future]
+                    try:
+                        outcomes[i] = future.result()
+                    except Exception as e:
+                        outcomes[i] = {'crash': e}
+        finally:
+            self._md_buffer = None
+            registry.close()
+        shared_count, shared_bytes, shared_peak = registry.published, registry.published_bytes, registry.peak_bytes
+        
+        self._md_write("\n### Parallel Execution")
+        self._md_write(f"- Workers: {limit} (requested {workers})")
+        self._md_write(f"- Largest rule estimate: {largest_mb:.0f} MB, available memory: {available_text}")
+        self._md_write(f"- Shared rasters: {shared_count} ({shared_bytes / 1024 ** 2:.1f} MB, "
+                       f"at most {shared_peak / 1024 ** 2:.1f} MB held at once)")
+        self.run_manifest['parallel'] = {
+            'requested_workers': workers,
+            'workers': limit,
+            'rule_bytes_estimates': {r.name: b for r, b in zip(rules, estimates)},
+            'available_memory_bytes': available,
+            'shared_rasters': shared_count,
+            'shared_bytes': shared_bytes,
+            'shared_peak_bytes': shared_peak
+        }
+        
+        rule_results = []
+        for i, (rule_config, md_lines, sim_ids) in enumerate(prepared):
+            for line in md_lines:
+                self._md_write(line)
+            outcome = outcomes.get(i)
+            if outcome is None:
+                rule_results.append(None)
+                continue
+            # The summary report follows the last analysed rule, as in a sequential run
+            self._point_outputs(rule_config, sim_ids)
+            if 'crash' in outcome:
+                rule_results.append(self._rule_failed(rule_config, RuntimeError(f"worker failed: {outcome['crash']}")))
+                continue
+            for line in outcome['md_lines']:
+                self._md_write(line)
+            self.results.extend(outcome['results'])
+            self.run_manifest['rules_processed'].extend(outcome['rules_processed'])
+            self.run_manifest['errors'].extend(outcome['errors'])
+            self._worker_cache_stats.append(outcome['raster_cache'])
+            if outcome['stage_cache'] is not None:
+                self._worker_stage_stats.append(outcome['stage_cache'])
+            rule_results.append(outcome['rule_result'])
+        return rule_results
+    
+    def _publish_inputs(self, registry: SharedRasterRegistry, rule_config: RuleConfig) -> List[Any]:
+        """Load a rule's input rasters into shared memory (once per run); returns their descriptors."""
+        if self.cluster_processor._use_tiled_labeling(rule_config):
+            return []  # tiled rules stream windows from disk
+        descriptors = []
+        try:
+            for path in self.cluster_processor.input_paths(rule_config).values():
+                descriptors.append(registry.publish(path, self.cluster_processor.raster_processor.read_raster))
+        except Exception as e:
+            # Unshared rasters are simply read by the worker
+            self.logger.warning(f"Could not share input rasters of {rule_config.name}: {e}")
+        return descriptors
+    
+    def _raster_cache_stats(self) -> Dict[str, Any]:
+        """Hit/miss/byte counters of the in-memory and on-disk raster caches (workers included)."""
+        stats = {'memory': process_raster_cache().stats()}
+        file_cache = self.cluster_processor.raster_processor.file_cache
+        if file_cache is not None:
+            stats['disk'] = file_cache.stats()
+        for kind in ('memory', 'disk'):
+            worker_stats = [w[kind] for w in self._worker_cache_stats if kind in w]
+            if worker_stats and kind in stats:
+                stats[kind] = combine_cache_stats([stats[kind]] + worker_stats)
+        return stats
+    
+    def stage_cache_stats(self) -> Optional[Dict[str, Any]]:
+        """Hit/miss counters of the stage cache, overall and per stage (workers included); None if disabled."""
+        stage_cache = self.cluster_processor.stage_cache
+        if stage_cache is None:
+            return None
+        return combine_stage_stats([stage_cache.stats()] + self._worker_stage_stats)
+    
+    def monitor(self, rule_names: Optional[List[str]] = None, workers: Optional[int] = None) -> None:
+        """Monitor mode: re-run the rules whose input rasters change, until interrupted.
+        
+        A RasterWatcher (inotify, or polling every `monitor_poll_seconds`) runs
+        in a background thread. Once a simulation has been quiet for
+        `monitor_debounce_seconds`, its changed directories are re-indexed in
+        the raster catalog and every rule reading a changed (simulation,
+        attribute) is queued; a rule triggered again before it runs is
+        coalesced, so a whole export burst runs each affected rule once.
+        """
+        catalog = self.cluster_processor.raster_processor.catalog
+        watcher = RasterWatcher(self.data_dir,
+                                float(self._cfg.get('monitor_debounce_seconds', DEFAULT_DEBOUNCE)),
+                                self._cfg.get('monitor_backend', 'auto'),
+                                float(self._cfg.get('monitor_poll_seconds', DEFAULT_POLL_INTERVAL)))
+        queue = RuleTriggerQueue(DEFAULT_QUEUE_SIZE)
+        stop = threading.Event()
+        
+        def on_changes(changes: List[RasterChange]) -> None:
+            # An exception here would end the watcher thread, and with it monitor mode
+            try:
+                for change in changes:
+                    for directory in sorted(change.directories):
+                        if os.path.isdir(directory):
+                            catalog.index_directory(directory)
+                        else:
+                            catalog.refresh()
+                    self.logger.info(f"Rasters changed: sim {change.sim_id} ({change.files} files, "
+                                     f"{', '.join(sorted(change.attributes))})")
+                rules = [r for r in self.rule_parser.parse_all_rules() if not rule_names or r.name in rule_names]
+                for name, sim_ids in affected_rules(changes, rules, self.cluster_processor.required_inputs).items():
+                    if not queue.put(name, sim_ids):
+                        self.logger.info(f"Rule {name} already queued; trigger coalesced")
+            except Exception as e:
+                self.logger.error(f"Error handling raster changes: {e}")
+        
+        self.logger.info(f"Monitor mode: watching {os.path.abspath(self.data_dir)} ({watcher.backend.name})")
+        # Process what is already there, as after an arrival
+        if catalog.count() or catalog.refresh():
+            self.run_pipeline(rule_names, export_rasters=False, workers=workers)
+        
+        thread = threading.Thread(target=watcher.run, args=(on_changes, stop), name="raster-watcher", daemon=True)
+        thread.start()
+        try:
+            while thread.is_alive():
+                batch = queue.get_batch(timeout=1.0)
+                if batch:
+                    self.logger.info(f"Running {len(batch)} rules affected by new rasters: {', '.join(batch)}")
+                    self.run_pipeline(list(batch), export_rasters=False, workers=workers)
+        finally:
+            stop.set()
+            thread.join(timeout=5)
     
     def run_single_rule(self, rule_name: str, export_rasters: bool = True) -> Optional[Dict[str, Any]]:
         """Run pipeline for a single rule."""
@@ -588,6 +1039,37 @@ class PipelineRunner:
         return [rule.name for rule in rules]
 
 
+def _analyze_rule_in_worker(options: Dict[str, Any], memory_cache_bytes: int, rule_config: RuleConfig,
+                            sim_ids: List[int], shared: List[Any]) -> Dict[str, Any]:
+    """Process-pool entry point: analyse one prepared rule in a worker runner.
+    
+    `shared` are the descriptors of the rule's inputs in shared memory; they
+    are attached before the rule loads its rasters and detached afterwards,
+    so the parent's release frees the blocks while the worker lives on.
+    """
+    runner = PipelineRunner(worker=True, **options)
+    cache = process_raster_cache()
+    cache.max_bytes = memory_cache_bytes
+    cache.reset_counters()
+    attach_shared_rasters(shared, cache)
+    try:
+        try:
+            rule_result = runner.analyze_rule(rule_config, sim_ids)
+        except Exception as e:
+            rule_result = runner._rule_failed(rule_config, e)
+        return {
+            'rule_result': rule_result,
+            'results': runner.results,
+            'rules_processed': runner.run_manifest['rules_processed'],
+            'errors': runner.run_manifest['errors'],
+            'md_lines': runner._md_buffer,
+            'raster_cache': runner._raster_cache_stats(),
+            'stage_cache': runner.stage_cache_stats()
+        }
+    finally:
+        detach_all(cache)
+
+
 def main():
     """Main entry point for the pipeline."""
     parser = argparse.ArgumentParser(description='Cluster Analysis Pipeline')
@@ -608,6 +1090,11 @@ def main():
                        help='Path to .icmm model file (bypasses waiting for model)')
     parser.add_argument('--skip-model-wait', action='store_true',
                        help='Skip waiting for model in standalone folder')
+    parser.add_argument('--workers', type=int,
+                       help='Rules analysed in parallel (process pool, capped by available memory); '
+                            'default: workers from pipeline_config.json, else 1')
+    parser.add_argument('--force-export', action='store_true',
+                       help='Re-export rasters even if the catalog records them as up to date')
     
     args = parser.parse_args()
     
@@ -648,7 +1135,8 @@ def main():
         icm_exchange_path=args.icm_exchange,
         run_simulations=run_sims,
         monitor_mode=args.monitor_mode,
-        disable_git=args.disable_git
+        disable_git=args.disable_git,
+        force_export=args.force_export
     )
     
     try:
@@ -662,27 +1150,14 @@ def main():
             # Run pipeline
             export_rasters = not args.no_export
             if args.monitor_mode:
-                # Simple polling monitor: wait for new rasters then process existing data
                 print("Monitor mode: waiting for incoming rasters (.tif) ... Press Ctrl+C to exit.")
-                last_seen = 0
                 try:
-                    while True:
-                        newest = 0
-                        for root, _, files in os.walk(os.path.join(args.data_dir, 'rasters')):
-                            for fn in files:
-                                if fn.endswith('.tif'):
-                                    ts = os.path.getmtime(os.path.join(root, fn))
-                                    newest = max(newest, ts)
-                        if newest > last_seen:
-                            last_seen = newest
-                            manifest = runner.run_pipeline(args.rules, export_rasters=False)
-                            print("Processed after new rasters arrival.")
-                        time.sleep(5)
+                    runner.monitor(args.rules, workers=args.workers)
                 except KeyboardInterrupt:
                     print("Exiting monitor mode.")
-                    return
+                return
             else:
-                manifest = runner.run_pipeline(args.rules, export_rasters)
+                manifest = runner.run_pipeline(args.rules, export_rasters, workers=args.workers)
             
             print("\nPipeline Results:")
             print(f"  Rules processed: {manifest['statistics']['successful_rules']}/{manifest['statistics']['total_rules']}")
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Pixel samples of input rasters
+
+Low-fidelity optimizer experiments (see search_strategies.py) cluster a
+regular sample of the input pixels instead of all of them: every stride-th
+row and column, from a random offset. A random subset of single pixels
+would break the connectivity that connected components and DBSCAN rely on;
+the decimated grid keeps it, covers the whole extent and carries a
+transform with stride-times larger cells, so cluster areas, centroids and
+the composite score stay in map units and comparable across fractions.
+
+A `fraction` of the pixels is met with the nearest integer stride
+(1 / stride**2 of the pixels). Counts of full-resolution cells, such as a
+connected-components min_size, are scaled to the sampled grid with `cells`.
+"""
+
+import math
+import numpy as np
+from dataclasses import dataclass
+from typing import Any, Dict, Tuple
+from rasterio.coords import BoundingBox
+from rasterio.transform import Affine, array_bounds
+
+
+@dataclass(frozen=True)
+class PixelSample:
+    """Every stride-th pixel of a raster, with the offset drawn from `seed`."""
+    fraction: float
+    seed: int = 0
+
+    @property
+    def stride(self) -> int:
+        return max(1, int(round(1.0 / math.sqrt(self.fraction))))
+
+    def offsets(self) -> Tuple[int, int]:
+        """Row and column offset of the sample (the same for every raster of a seed)."""
+        row, col = np.random.default_rng(self.seed).integers(0, self.stride, 2)
+        return int(row), int(col)
+
+    def cells(self, count: int) -> int:
+        """A number of full-resolution cells expressed in cells of the sample."""
+        return max(1, int(round(count / self.stride ** 2)))
+
+    def apply(self, data: np.ndarray, meta: Dict[str, Any]) -> Tuple[np.ndarray, Dict[str, Any]]:
+        """The sampled array and its metadata (transform, size and bounds of the sampled grid)."""
+        stride = self.stride
+        if stride == 1:
+            return data, meta
+        row, col = self.offsets()
+        sampled = np.ascontiguousarray(data[row::stride, col::stride])
+        height, width = sampled.shape
+        transform = meta['transform'] * Affine.translation(col, row) * Affine.scale(stride)
+        return sampled, {
+            **meta,
+            'transform': transform,
+            'width': width,
+            'height': height,
+            'bounds': BoundingBox(*array_bounds(height, width, transform))
+        }
+
+    def to_json(self) -> Dict[str, Any]:
+        return {'fraction': self.fraction, 'seed': self.seed}
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Cluster Polygon Level of Detail
+
+Raster-derived cluster polygons carry a vertex at every corner of the cell
+staircase along their boundary, which makes full-resolution GeoJSON large and
+slow to import into ICM. Each cluster geometry is therefore kept in several
+tiers:
+
+    full         the polygonized geometry, unchanged
+    simplified   Douglas-Peucker simplification at a tolerance (default one
+                 cell), topology-preserving: rings stay valid, holes stay holes
+    hull         convex hull of the cluster
+    bbox         bounding box of the cluster
+
+Only the full geometry is kept on each cluster; the other tiers are built on
+demand by the consumer that needs them, so tiers nobody writes cost nothing.
+The GeoJSON exporter writes one file per configured tier, the visualizer draws
+the simplified outlines and the ICM importer reads the simplified file when it
+exists.
+"""
+
+import logging
+from shapely.geometry import shape, mapping
+from typing import Any, Dict, Iterable, List, Optional
+
+
+LOD_TIERS = ("full", "simplified", "hull", "bbox")
+DEFAULT_EXPORT_TIERS = ["full", "simplified"]
+DEFAULT_TOLERANCE_CELLS = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+def count_vertices(geometry: Optional[Dict[str, Any]]) -> int:
+    """Number of vertices in a GeoJSON Polygon/MultiPolygon (closing points included)."""
+    if not geometry:
+        return 0
+    polygons = geometry['coordinates'] if geometry['type'] == 'MultiPolygon' else [geometry['coordinates']]
+    return sum(len(ring) for polygon in polygons for ring in polygon)
+
+
+def _as_geojson(geom) -> Dict[str, Any]:
+    """GeoJSON dict with plain nested lists, matching the polygonizer's output."""
+    data = mapping(geom)
+    if data['type'] == 'Polygon':
+        coordinates = [[list(pt) for pt in ring] for ring in data['coordinates']]
+    else:
+        coordinates = [[[list(pt) for pt in ring] for ring in polygon] for polygon in data['coordinates']]
+    return {"type": data['type'], "coordinates": coordinates}
+
+
+def build_tier(geometry: Optional[Dict[str, Any]], tier: str, tolerance: float) -> Optional[Dict[str, Any]]:
+    """One LOD tier of a cluster geometry.
+
+    Args:
+        geometry: Full-resolution GeoJSON Polygon/MultiPolygon
+        tier: Tier name (see LOD_TIERS)
+        tolerance: Simplification tolerance in map units
+
+    Returns:
+        GeoJSON geometry of the tier (the full geometry if it cannot be simplified)
+    """
+    if not geometry or tier == "full":
+        return geometry
+    try:
+        geom = shape(geometry)
+        if tier == "simplified":
+            simplified = geom.simplify(tolerance, preserve_topology=True) if tolerance > 0 else geom
+            # A sliver can collapse entirely; keep the full geometry rather than lose the cluster
+            return _as_geojson(simplified) if not simplified.is_empty else geometry
+        if tier == "hull":
+            hull = geom.convex_hull
+            return _as_geojson(hull) if hull.geom_type == 'Polygon' else _as_geojson(geom.envelope)
+        return _as_geojson(geom.envelope)
+    except Exception as e:
+        logger.warning(f"Could not simplify cluster geometry: {e}")
+        return geometry
+
+
+def build_lod(geometry: Optional[Dict[str, Any]], tolerance: float) -> Dict[str, Dict[str, Any]]:
+    """Every LOD tier of one cluster geometry (tier name -> geometry, empty if there is no geometry)."""
+    if not geometry:
+        return {}
+    return {tier: build_tier(geometry, tier, tolerance) for tier in LOD_TIERS}
+
+
+def vertex_counts(lod: Dict[str, Dict[str, Any]]) -> Dict[str, int]:
+    """Vertex count per tier."""
+    return {tier: count_vertices(geometry) for tier, geometry in lod.items()}
+
+
+def tier_geometry(cluster, tier: str = "full") -> Optional[Dict[str, Any]]:
+    """Geometry of a cluster at the given tier, built from its full polygon.
+
+    The tier's vertex count is recorded in the cluster's vertex_counts.
+    """
+    if tier not in LOD_TIERS:
+        raise ValueError(f"Unknown polygon tier '{tier}' (expected one of {LOD_TIERS})")
+    geometry = build_tier(cluster.polygon, tier, getattr(cluster, 'simplify_tolerance', 0.0))
+    if geometry:
+        cluster.vertex_counts[tier] = count_vertices(geometry)
+    return geometry
+
+
+def summarize_vertex_counts(clusters: Iterable[Any]) -> Dict[str, int]:
+    """Total vertex count per tier over a set of clusters (tiers counted so far)."""
+    totals = {}
+    for cluster in clusters:
+        for tier, count in (getattr(cluster, 'vertex_counts', None) or {}).items():
+            totals[tier] = totals.get(tier, 0) + count
+    return totals
+
+
+def parse_tiers(tiers: Any, default: List[str]) -> List[str]:
+    """Validate a tier list from a rule or config (a single name is accepted)."""
+    if tiers is None:
+        return list(default)
+    if isinstance(tiers, str):
+        tiers = [tiers]
+    unknown = [t for t in tiers if t not in LOD_TIERS]
+    if unknown:
+        raise ValueError(f"Unknown polygon tier(s) {unknown} (expected any of {LOD_TIERS})")
+    return list(tiers)
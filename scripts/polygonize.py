@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Label Raster Polygonization
+
+Turns a cluster label raster into one GeoJSON geometry per label, keeping
+holes and disjoint parts (Polygon or MultiPolygon). Two strategies:
+
+- whole: rasterio.features.shapes over the whole label raster once, with the
+  shapes grouped by label. The raster is cut into row bands that each hold
+  complete labels, and the bands run in a thread pool. Cost is one raster
+  scan plus the boundary length, however many labels there are, and only
+  band windows are read, so memmapped label rasters stay cheap.
+- crops: one shapes call per label on its bounding-box crop, in a thread
+  pool. Each call has a fixed setup cost, so this only wins for a few compact
+  clusters in a large raster.
+
+"auto" picks crops for at most 32 labels whose boxes cover under a quarter
+of the raster, and the whole-raster pass otherwise.
+"""
+
+import os
+import logging
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from rasterio.features import shapes
+from rasterio.windows import Window, transform as window_transform
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BAND_ROWS = 1024
+CROPS_MAX_LABELS = 32
+
+Rings = List[List[Tuple[float, float]]]  # exterior ring followed by hole rings
+
+
+def geometry_from_polygons(polygons: List[Rings]) -> Optional[Dict[str, Any]]:
+    """GeoJSON Polygon (one part) or MultiPolygon (several parts) from ring lists."""
+    if not polygons:
+        return None
+    if len(polygons) == 1:
+        return {"type": "Polygon", "coordinates": polygons[0]}
+    return {"type": "MultiPolygon", "coordinates": polygons}
+
+
+def _band_plan(labels: Sequence[int], slices: Sequence[Tuple[slice, slice]],
+               band_rows: Optional[int]) -> List[Tuple[int, int, int, int, List[int]]]:
+    """Group labels into row bands; each band window fully contains its labels.
+
+    Returns:
+        List of (row0, row1, col0, col1, band labels)
+    """
+    entries = sorted((s[0].start, s[0].stop, s[1].start, s[1].stop, int(l))
+                     for l, s in zip(labels, slices) if s is not None)
+    bands = []
+    for r0, r1, c0, c1, label_id in entries:
+        if bands and (band_rows is None or r0 < bands[-1][0] + band_rows):
+            band = bands[-1]
+            band[1] = max(band[1], r1)
+            band[2] = min(band[2], c0)
+            band[3] = max(band[3], c1)
+            band[4].append(label_id)
+        else:
+            bands.append([r0, r1, c0, c1, [label_id]])
+    return [tuple(band) for band in bands]
+
+
+def polygonize_whole(label_data: np.ndarray, labels: Sequence[int], slices: Sequence[Tuple[slice, slice]],
+                     transform, band_rows: Optional[int] = DEFAULT_BAND_ROWS,
+                     workers: Optional[int] = None) -> Dict[int, Optional[Dict[str, Any]]]:
+    """Vectorize the label raster once and group the shapes by label.
+
+    The raster is processed in row bands (each holding whole labels, so no
+    shape is cut at a band edge); bands run in a thread pool and only one band
+    window is read at a time per worker, which keeps memmapped rasters cheap.
+    `band_rows=None` vectorizes the whole raster in a single call.
+    """
+    labels = [int(l) for l in labels]
+    band_of = np.full(max(labels) + 1, -1, dtype=np.int32)
+    plan = _band_plan(labels, slices, band_rows)
+    for b, (_, _, _, _, band_labels) in enumerate(plan):
+        band_of[band_labels] = b
+
+    def run(b):
+        r0, r1, c0, c1, _ = plan[b]
+        window = np.asarray(label_data[r0:r1, c0:c1])
+        values = np.where(window > 0, window, 0).astype(np.int32, copy=False)
+        values[values >= len(band_of)] = 0
+        in_band = band_of[values] == b
+        values[~in_band] = 0
+        band_transform = window_transform(Window(c0, r0, c1 - c0, r1 - r0), transform)
+        return [(int(value), geom['coordinates'])
+                for geom, value in shapes(values, mask=in_band, transform=band_transform)]
+
+    parts: Dict[int, List[Rings]] = {}
+    for band_shapes in _map(run, range(len(plan)), workers):
+        for value, coordinates in band_shapes:
+            parts.setdefault(value, []).append(coordinates)
+    return {label_id: geometry_from_polygons(parts.get(label_id, [])) for label_id in labels}
+
+
+def _map(func, items, workers: Optional[int]) -> List[Any]:
+    """map() over a thread pool (rasterio releases the GIL while polygonizing)."""
+    items = list(items)
+    workers = workers or min(8, os.cpu_count() or 1)
+    if workers <= 1 or len(items) < 2:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(func, items))
+
+
+def _polygonize_crop(label_data: np.ndarray, label_id: int, slices: Tuple[slice, slice],
+                     transform) -> Optional[Dict[str, Any]]:
+    row_slice, col_slice = slices
+    mask = np.asarray(label_data[row_slice, col_slice]) == label_id
+    crop_transform = window_transform(Window.from_slices(row_slice, col_slice), transform)
+    polygons = [geom['coordinates'] for geom, value in
+                shapes(mask.astype(np.uint8), mask=mask, transform=crop_transform) if value == 1]
+    return geometry_from_polygons(polygons)
+
+
+def polygonize_crops(label_data: np.ndarray, labels: Sequence[int], slices: Sequence[Tuple[slice, slice]],
+                     transform, workers: Optional[int] = None) -> Dict[int, Optional[Dict[str, Any]]]:
+    """Vectorize each label from its bounding-box crop, in a thread pool."""
+    def run(item):
+        label_id, label_slices = item
+        try:
+            return _polygonize_crop(label_data, label_id, label_slices, transform)
+        except Exception as e:
+            logger.warning(f"Error extracting polygon for cluster {label_id}: {e}")
+            return None
+
+    items = [(int(l), s) for l, s in zip(labels, slices)]
+    geometries = _map(run, items, workers)
+    return {label_id: geometry for (label_id, _), geometry in zip(items, geometries)}
+
+
+def choose_strategy(label_data: np.ndarray, slices: Sequence[Tuple[slice, slice]]) -> str:
+    """'crops' for a few compact clusters in a large raster, 'whole' otherwise.
+
+    Each shapes() call has a fixed setup cost (~0.5 ms), so per-label crops only
+    pay off when there are few labels and their boxes cover little of the raster.
+    """
+    bbox_pixels = sum((s[0].stop - s[0].start) * (s[1].stop - s[1].start) for s in slices if s)
+    if len(slices) <= CROPS_MAX_LABELS and bbox_pixels * 4 < label_data.size:
+        return "crops"
+    return "whole"
+
+
+def polygonize_labels(label_data: np.ndarray, labels: Sequence[int], slices: Sequence[Tuple[slice, slice]],
+                      transform, strategy: str = "auto",
+                      workers: Optional[int] = None) -> Dict[int, Optional[Dict[str, Any]]]:
+    """GeoJSON geometry (with holes and parts) for each label.
+
+    Args:
+        label_data: Label raster (positive labels are clusters)
+        labels: Label ids to vectorize
+        slices: Bounding box (row slice, col slice) per label
+        transform: Affine transform of the raster
+        strategy: "auto", "whole" or "crops"
+        workers: Thread pool size (bands for "whole", labels for "crops")
+
+    Returns:
+        Mapping of label id -> GeoJSON Polygon/MultiPolygon (None if empty)
+    """
+    if len(labels) == 0:
+        return {}
+    if strategy == "auto":
+        strategy = choose_strategy(label_data, slices)
+    if strategy == "whole":
+        return polygonize_whole(label_data, labels, slices, transform, workers=workers)
+    if strategy == "crops":
+        return polygonize_crops(label_data, labels, slices, transform, workers)
+    raise ValueError(f"Unknown polygonize strategy '{strategy}' (expected 'auto', 'whole' or 'crops')")
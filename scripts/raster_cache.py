@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+Raster Cache
+
+Two cache layers for raster bands:
+
+- RasterFileCache converts exported (compressed) GeoTIFF bands into uncompressed
+  .npy array files with a JSON metadata sidecar (transform, CRS, nodata, bounds).
+  Later loads are zero-copy np.memmap views instead of a full GeoTIFF decode.
+  Entries are keyed on the source path and band, and each version of the
+  source (its mtime and size) is written under a file name of its own: a
+  re-exported GeoTIFF never overwrites a .npy that may still be memory-mapped
+  (which Windows refuses). Superseded versions and the least recently used
+  entries are removed by evict(), which keeps the directory under a size limit.
+  Layout: <cache_dir>/<key>.<mtime_ns>-<size>.npy + .json
+
+- RasterMemoryCache is a process-wide LRU of loaded bands keyed by
+  (path, mtime, band) with a memory budget, so rules, visualizations and
+  optimizer experiments in one process share a single load of each raster.
+  Bands published by a parent process in shared memory (shared_rasters.py)
+  are pinned into it: they are served like cached bands but never evicted
+  and not counted against the budget, since no process holds a private copy.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+import rasterio
+from rasterio.coords import BoundingBox
+from rasterio.crs import CRS
+from rasterio.transform import Affine
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+DEFAULT_MAX_BYTES = 10 * 1024 ** 3  # 10 GB
+DEFAULT_MEMORY_BYTES = 2 * 1024 ** 3  # 2 GB
+
+
+def _source_signature(filepath: str) -> Dict[str, int]:
+    st = os.stat(filepath)
+    return {'mtime_ns': st.st_mtime_ns, 'size': st.st_size}
+
+
+def meta_to_json(meta: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'transform': list(meta['transform'])[:6],
+        'crs': meta['crs'].to_wkt() if meta.get('crs') else None,
+        'width': meta['width'],
+        'height': meta['height'],
+        'bounds': list(meta['bounds']),
+        'nodata': meta['nodata']
+    }
+
+
+def meta_from_json(data: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'transform': Affine(*data['transform']),
+        'crs': CRS.from_wkt(data['crs']) if data.get('crs') else None,
+        'width': data['width'],
+        'height': data['height'],
+        'bounds': BoundingBox(*data['bounds']),
+        'nodata': data['nodata']
+    }
+
+
+class RasterFileCache:
+    """Disk cache of decoded raster bands served as read-only memory maps."""
+
+    def __init__(self, cache_dir: str = "data/output/.cache/rasters",
+                 max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.logger = logging.getLogger(__name__)
+        self.hits = 0
+        self.conversions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _key(self, filepath: str, band: int) -> str:
+        digest = hashlib.sha1(f"{os.path.abspath(filepath)}|{band}".encode('utf-8')).hexdigest()[:20]
+        stem = os.path.splitext(os.path.basename(filepath))[0]
+        return f"{stem}_{digest}"
+
+    def _paths(self, key: str, signature: Dict[str, int]) -> Tuple[str, str]:
+        base = os.path.join(self.cache_dir, f"{key}.{signature['mtime_ns']}-{signature['size']}")
+        return base + ".npy", base + ".json"
+
+    @staticmethod
+    def _version(name: str) -> Tuple[str, int]:
+        """(entry key, source mtime_ns) of a cached file name."""
+        key, _, version = name[:-len('.npy')].rpartition('.')
+        try:
+            return key, int(version.split('-')[0])
+        except ValueError:
+            return name, 0
+
+    def load(self, filepath: str, band: int = 1) -> Tuple[np.ndarray, Dict[str, Any]]:
+        """Return (read-only memmap, metadata) for a raster band, converting on first access."""
+        signature = _source_signature(filepath)
+        data_path, sidecar_path = self._paths(self._key(filepath, band), signature)
+
+        sidecar = self._read_sidecar(sidecar_path)
+        if sidecar and sidecar.get('source') == signature and os.path.exists(data_path):
+            try:
+                data = np.load(data_path, mmap_mode='r')
+                # Touch the data file: its mtime is the LRU access marker
+                os.utime(data_path, None)
+                self.hits += 1
+                return data, meta_from_json(sidecar['meta'])
+            except (OSError, ValueError) as e:
+                self.logger.warning(f"Discarding unreadable cache entry {data_path}: {e}")
+
+        return self._convert(filepath, band, signature, data_path, sidecar_path)
+
+    def _read_sidecar(self, sidecar_path: str) -> Optional[Dict[str, Any]]:
+        if not os.path.exists(sidecar_path):
+            return None
+        try:
+            with open(sidecar_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _convert(self, filepath: str, band: int, signature: Dict[str, int],
+                 data_path: str, sidecar_path: str) -> Tuple[np.ndarray, Dict[str, Any]]:
+        """Decode the GeoTIFF band once and write the .npy + sidecar pair atomically."""
+        with rasterio.open(filepath) as src:
+            array = src.read(band)
+            meta = {
+                'transform': src.transform,
+                'crs': src.crs,
+                'width': src.width,
+                'height': src.height,
+                'bounds': src.bounds,
+                'nodata': src.nodata
+            }
+
+        # Write to temp names and rename, so concurrent readers never see partial files.
+        # The name is new for every source version; it can only be taken by another
+        # process converting the same version, whose copy may be mapped already.
+        tmp_suffix = f".{os.getpid()}.tmp"
+        try:
+            with open(data_path + tmp_suffix, 'wb') as f:
+                np.save(f, array)
+            os.replace(data_path + tmp_suffix, data_path)
+
+            with open(sidecar_path + tmp_suffix, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'source_path': os.path.abspath(filepath),
+                    'band': band,
+                    'source': signature,
+                    'dtype': str(array.dtype),
+                    'shape': list(array.shape),
+                    'meta': meta_to_json(meta)
+                }, f, indent=2)
+            os.replace(sidecar_path + tmp_suffix, sidecar_path)
+        except OSError as e:
+            self.logger.warning(f"Could not cache raster {filepath}, serving the decoded GeoTIFF: {e}")
+            for tmp in (data_path + tmp_suffix, sidecar_path + tmp_suffix):
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+            return array, meta
+
+        self.conversions += 1
+        self.logger.debug(f"Cached raster {filepath} -> {data_path}")
+        self.evict(keep=data_path)
+
+        del array
+        return np.load(data_path, mmap_mode='r'), meta
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        """(access time, size, path) of every cached array file.
+
+        Other processes share the directory, so an entry removed between the
+        listing and its stat is skipped.
+        """
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.npy'):
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        return entries
+
+    def size_bytes(self) -> int:
+        """Total size of cached array files."""
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, keep: Optional[str] = None) -> int:
+        """Remove superseded versions, then least recently used entries until the cache fits in max_bytes.
+
+        Args:
+            keep: Data file that must not be evicted (the entry just written)
+
+        Returns:
+            Number of entries removed
+        """
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        # Current version of each key: the one just written, else the newest source mtime
+        current: Dict[str, Tuple[float, float, str]] = {}
+        for accessed, _, path in entries:
+            key, mtime_ns = self._version(os.path.basename(path))
+            rank = (mtime_ns, accessed, path)
+            if keep and os.path.abspath(path) == os.path.abspath(keep):
+                rank = (float('inf'), accessed, path)
+            current[key] = max(current.get(key, rank), rank)
+
+        def superseded(path: str) -> bool:
+            return current[self._version(os.path.basename(path))[0]][2] != path
+
+        removed = 0
+        # Superseded versions first, then by access time
+        for _, size, path in sorted(entries, key=lambda e: (not superseded(e[2]), e[0])):
+            if total <= self.max_bytes and not superseded(path):
+                break
+            if keep and os.path.abspath(path) == os.path.abspath(keep):
+                continue
+            try:
+                os.remove(path)
+                sidecar = path[:-len('.npy')] + '.json'
+                if os.path.exists(sidecar):
+                    os.remove(sidecar)
+                total -= size
+                removed += 1
+            except OSError as e:
+                # Entry may still be mapped by another process (Windows); try again later
+                self.logger.debug(f"Could not evict {path}: {e}")
+
+        if removed:
+            self.logger.info(f"Evicted {removed} raster cache entries ({total / 1024 ** 2:.1f} MB in cache)")
+        return removed
+
+    def clear(self) -> None:
+        """Remove every cache entry."""
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(('.npy', '.json')):
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {'hits': self.hits, 'conversions': self.conversions}
+
+
+class RasterMemoryCache:
+    """Process-wide LRU of loaded raster bands, bounded by total array bytes."""
+
+    def __init__(self, max_bytes: int = DEFAULT_MEMORY_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple[str, int, int], Tuple[np.ndarray, Dict[str, Any]]]" = OrderedDict()
+        self._pinned: Dict[Tuple[str, int, int], Tuple[np.ndarray, Dict[str, Any]]] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+        self.reset_counters()
+
+    def reset_counters(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_loaded = 0
+        self.bytes_served = 0
+
+    def get_or_load(self, filepath: str, band: int,
+                    loader: Callable[[str, int], Tuple[np.ndarray, Dict[str, Any]]]) -> Tuple[np.ndarray, Dict[str, Any]]:
+        """Return a cached (data, meta) for the band, calling `loader` on a miss.
+
+        Cached arrays are shared between callers and therefore marked read-only;
+        each caller gets its own shallow copy of the metadata dict.
+        """
+        path = os.path.abspath(filepath)
+        key = (path, os.stat(path).st_mtime_ns, band)
+
+        with self._lock:
+            entry = self._pinned.get(key)
+            if entry is None:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+            if entry is not None:
+                self.hits += 1
+                self.bytes_served += entry[0].nbytes
+                return entry[0], dict(entry[1])
+            # Drop stale versions of the same file and band before loading, so their
+            # memory maps are released before the file cache writes the new version
+            for stale in [k for k in self._entries if k[0] == path and k[2] == band]:
+                self._bytes -= self._entries.pop(stale)[0].nbytes
+
+        data, meta = loader(filepath, band)
+        if data.flags.writeable:
+            data.setflags(write=False)
+
+        with self._lock:
+            self.misses += 1
+            self.bytes_loaded += data.nbytes
+            self.bytes_served += data.nbytes
+            if key not in self._entries and data.nbytes <= self.max_bytes:
+                self._entries[key] = (data, meta)
+                self._bytes += data.nbytes
+                while self._bytes > self.max_bytes:
+                    _, (old_data, _) = self._entries.popitem(last=False)
+                    self._bytes -= old_data.nbytes
+                    self.evictions += 1
+        return data, dict(meta)
+
+    def pin(self, filepath: str, band: int, mtime_ns: int, data: np.ndarray, meta: Dict[str, Any]) -> None:
+        """Serve a band from an array owned elsewhere (e.g. shared memory) until unpinned.
+
+        The entry only matches while the file keeps the given mtime, so a
+        re-exported raster is loaded afresh.
+        """
+        if data.flags.writeable:
+            data.setflags(write=False)
+        with self._lock:
+            self._pinned[(os.path.abspath(filepath), mtime_ns, band)] = (data, meta)
+
+    def unpin_all(self) -> None:
+        with self._lock:
+            self._pinned.clear()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters for the run manifest."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'bytes_loaded': self.bytes_loaded,
+                'bytes_served': self.bytes_served,
+                'bytes_cached': self._bytes,
+                'entries': len(self._entries),
+                'pinned_entries': len(self._pinned),
+                'max_bytes': self.max_bytes
+            }
+
+
+_process_cache: Optional[RasterMemoryCache] = None
+
+
+def process_raster_cache() -> RasterMemoryCache:
+    """The process-wide RasterMemoryCache shared by all RasterProcessor instances."""
+    global _process_cache
+    if _process_cache is None:
+        _process_cache = RasterMemoryCache()
+    return _process_cache
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Raster Catalog
+
+Persistent SQLite index of exported rasters, stored at data/output/raster_catalog.sqlite.
+Maps (database, group, run, sim_id, attribute, timestep) to the GeoTIFF path and
+its raster metadata, so lookups are index queries instead of directory walks.
+
+The catalog is updated incrementally: the pipeline indexes each export directory
+as soon as an export lands (and the monitor watcher indexes rasters written
+outside the pipeline). A simulation's directory is re-indexed on lookup only
+when a requested attribute or timestep is missing (only new or changed files are
+read), and a full rescan only happens when a simulation is not catalogued yet
+(or on `--rebuild`). Each export is also recorded with its parameters (timestep
+mode and source model version), which the export planner uses to skip exports
+that are already up to date.
+
+Recognised layouts (relative to data/output):
+    raster/<db>/<group>/<run>/sim_<id>/<ATTR>_<timestep>.tif
+    raster/<model>/<run>/sim_<id>/<ATTR>_<timestep>.tif
+    raster/<model>/sim_<id>/<ATTR>_<timestep>.tif
+    <db>/<group>/<run>/rasters/sim_<id>/<ATTR>_<timestep>.tif   (old structured)
+    rasters/sim_<id>/<ATTR>_<timestep>.tif                      (legacy)
+"""
+
+import os
+import re
+import json
+import glob
+import sqlite3
+import logging
+import argparse
+import rasterio
+from contextlib import closing
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+
+CATALOG_FILENAME = "raster_catalog.sqlite"
+
+# Layout rank: lower ranks are preferred when a simulation exists in several layouts
+RANK_RASTER, RANK_STRUCTURED, RANK_LEGACY = 0, 1, 2
+
+_SIM_DIR = re.compile(r"^sim_(\d+)$")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rasters (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    layout_rank INTEGER NOT NULL,
+    database TEXT,
+    grp TEXT,
+    run TEXT,
+    sim_id INTEGER NOT NULL,
+    attribute TEXT NOT NULL,
+    timestep TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    dtype TEXT,
+    nodata REAL,
+    crs TEXT,
+    transform TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_rasters_sim_attr ON rasters (sim_id, attribute);
+CREATE INDEX IF NOT EXISTS idx_rasters_directory ON rasters (directory);
+CREATE TABLE IF NOT EXISTS exports (
+    directory TEXT NOT NULL,
+    sim_id INTEGER NOT NULL,
+    attribute TEXT NOT NULL,
+    timestep_mode TEXT NOT NULL,
+    source TEXT NOT NULL,
+    exported_at TEXT NOT NULL,
+    PRIMARY KEY (directory, sim_id, attribute, timestep_mode)
+);
+"""
+
+
+def parse_raster_filename(filename: str) -> Optional[Dict[str, str]]:
+    """Split '<ATTR>_<timestep>.tif' into attribute and raw timestep token."""
+    stem, ext = os.path.splitext(filename)
+    if ext.lower() != '.tif' or '_' not in stem:
+        return None
+    attribute, timestep = stem.split('_', 1)
+    return {'attribute': attribute, 'timestep': timestep}
+
+
+def classify_raster_path(data_dir: str, filepath: str) -> Optional[Dict[str, Any]]:
+    """Derive layout, database/group/run and sim id from a raster path under data_dir."""
+    rel = os.path.relpath(os.path.abspath(filepath), os.path.abspath(data_dir))
+    parts = rel.replace('\\', '/').split('/')
+    if len(parts) < 3:
+        return None
+    sim_match = _SIM_DIR.match(parts[-2])
+    if not sim_match:
+        return None
+
+    info = {'sim_id': int(sim_match.group(1)), 'database': None, 'grp': None, 'run': None}
+    middle = parts[1:-2]
+    if parts[0] == 'raster' and 1 <= len(middle) <= 3:
+        info['layout_rank'] = RANK_RASTER
+        if len(middle) == 3:
+            info['database'], info['grp'], info['run'] = middle
+        elif len(middle) == 2:
+            info['database'], info['run'] = middle
+        else:
+            info['database'] = middle[0]
+    elif parts[0] == 'rasters' and len(parts) == 3:
+        info['layout_rank'] = RANK_LEGACY
+    elif len(parts) == 6 and parts[3] == 'rasters':
+        info['layout_rank'] = RANK_STRUCTURED
+        info['database'], info['grp'], info['run'] = parts[0:3]
+    else:
+        return None
+    return info
+
+
+class RasterCatalog:
+    """SQLite-backed index of exported raster files."""
+
+    def __init__(self, data_dir: str = "data/output", db_path: Optional[str] = None):
+        self.data_dir = data_dir
+        self.db_path = db_path or os.path.join(data_dir, CATALOG_FILENAME)
+        self.logger = logging.getLogger(__name__)
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # One short-lived connection per operation keeps the catalog safe across processes
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    # ------------------------------------------------------------------
+    # Indexing
+    # ------------------------------------------------------------------
+
+    def index_directory(self, directory: str) -> int:
+        """Index (or re-index) every .tif in one simulation directory.
+
+        Unchanged files (same mtime and size) are skipped and rows for files
+        that no longer exist are removed.
+
+        Returns:
+            Number of files added or updated
+        """
+        directory = os.path.abspath(directory)
+        if not os.path.isdir(directory):
+            return 0
+
+        with closing(self._connect()) as conn, conn:
+            known = {row['path']: (row['mtime_ns'], row['size']) for row in
+                     conn.execute("SELECT path, mtime_ns, size FROM rasters WHERE directory = ?", (directory,))}
+            present = set()
+            updated = 0
+            for entry in os.scandir(directory):
+                if not entry.is_file():
+                    continue
+                parsed = parse_raster_filename(entry.name)
+                info = classify_raster_path(self.data_dir, entry.path)
+                if parsed is None or info is None:
+                    continue
+                path = os.path.abspath(entry.path)
+                present.add(path)
+                st = entry.stat()
+                if known.get(path) == (st.st_mtime_ns, st.st_size):
+                    continue
+                row = {**info, **parsed, **self._raster_header(path),
+                       'path': path, 'directory': directory,
+                       'mtime_ns': st.st_mtime_ns, 'size': st.st_size}
+                conn.execute(
+                    "INSERT OR REPLACE INTO rasters (path, directory, layout_rank, database, grp, run, sim_id, "
+                    "attribute, timestep, mtime_ns, size, width, height, dtype, nodata, crs, transform) VALUES "
+                    "(:path, :directory, :layout_rank, :database, :grp, :run, :sim_id, :attribute, :timestep, "
+                    ":mtime_ns, :size, :width, :height, :dtype, :nodata, :crs, :transform)", row)
+                updated += 1
+
+            removed = [p for p in known if p not in present]
+            conn.executemany("DELETE FROM rasters WHERE path = ?", [(p,) for p in removed])
+
+        if updated or removed:
+            self.logger.info(f"Catalog: indexed {updated} rasters, removed {len(removed)} in {directory}")
+        return updated
+
+    def record_export(self, directory: str, sim_id: int, attributes: List[str],
+                      timestep_mode: str, source: str) -> None:
+        """Remember that attributes of a simulation were exported to a directory.
+
+        Args:
+            directory: Export output directory
+            sim_id: Simulation id
+            attributes: Exported attributes
+            timestep_mode: Timestep mode of the export (e.g. 'all')
+            source: Identity of the exported results, e.g. the model file and its mtime
+        """
+        directory = os.path.abspath(directory)
+        exported_at = datetime.now().isoformat()
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO exports (directory, sim_id, attribute, timestep_mode, source, exported_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(directory, sim_id, attr, timestep_mode, source, exported_at) for attr in attributes])
+
+    def _raster_header(self, path: str) -> Dict[str, Any]:
+        """Read raster metadata from the GeoTIFF header (no pixel data)."""
+        try:
+            with rasterio.open(path) as src:
+                return {
+                    'width': src.width,
+                    'height': src.height,
+                    'dtype': src.dtypes[0],
+                    'nodata': src.nodata,
+                    'crs': src.crs.to_wkt() if src.crs else None,
+                    'transform': json.dumps(list(src.transform)[:6])
+                }
+        except Exception as e:
+            self.logger.warning(f"Could not read raster header {path}: {e}")
+            return {'width': None, 'height': None, 'dtype': None, 'nodata': None, 'crs': None, 'transform': None}
+
+    def simulation_directories(self) -> List[str]:
+        """Find simulation directories in all recognised layouts (one directory walk)."""
+        found = []
+        raster_root = os.path.join(self.data_dir, "raster")
+        if os.path.isdir(raster_root):
+            for root, dirs, _ in os.walk(raster_root):
+                for d in dirs:
+                    if _SIM_DIR.match(d):
+                        found.append(os.path.join(root, d))
+        found.extend(glob.glob(os.path.join(self.data_dir, "*", "*", "*", "rasters", "sim_*")))
+        found.extend(glob.glob(os.path.join(self.data_dir, "rasters", "sim_*")))
+        return [d for d in found if os.path.isdir(d)]
+
+    def refresh(self) -> int:
+        """Rescan all layouts, indexing new/changed files and dropping vanished directories."""
+        directories = {os.path.abspath(d) for d in self.simulation_directories()}
+        updated = sum(self.index_directory(d) for d in directories)
+        with closing(self._connect()) as conn, conn:
+            stale = [row['directory'] for row in conn.execute("SELECT DISTINCT directory FROM rasters")
+                     if row['directory'] not in directories]
+            conn.executemany("DELETE FROM rasters WHERE directory = ?", [(d,) for d in stale])
+            conn.executemany("DELETE FROM exports WHERE directory = ?", [(d,) for d in stale])
+        return updated
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+
+    def sim_directory(self, sim_id: int) -> Optional[str]:
+        """Preferred directory for a simulation (newest layout first)."""
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT directory FROM rasters WHERE sim_id = ? ORDER BY layout_rank, directory LIMIT 1",
+                (sim_id,)).fetchone()
+        return row['directory'] if row else None
+
+    def find(self, sim_id: int, attribute: Optional[str] = None,
+             directory: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Catalog rows for a simulation, optionally filtered by attribute and directory."""
+        query = "SELECT * FROM rasters WHERE sim_id = ?"
+        params: List[Any] = [sim_id]
+        if attribute is not None:
+            query += " AND attribute = ?"
+            params.append(attribute)
+        if directory is not None:
+            query += " AND directory = ?"
+            params.append(os.path.abspath(directory))
+        query += " ORDER BY layout_rank, directory, attribute, timestep"
+        with closing(self._connect()) as conn:
+            return [dict(row) for row in conn.execute(query, params)]
+
+    def exported_attributes(self, directory: str, sim_id: int, timestep_mode: str, source: str) -> List[str]:
+        """Attributes exported to a directory with matching parameters whose rasters are still on disk."""
+        directory = os.path.abspath(directory)
+        with closing(self._connect()) as conn:
+            recorded = [row['attribute'] for row in conn.execute(
+                "SELECT attribute FROM exports WHERE directory = ? AND sim_id = ? AND timestep_mode = ? "
+                "AND source = ? ORDER BY attribute", (directory, sim_id, timestep_mode, source))]
+        current = []
+        for attr in recorded:
+            rows = self.find(sim_id, attr, directory)
+            if rows and all(os.path.exists(row['path']) for row in rows):
+                current.append(attr)
+        return current
+
+    def first_raster(self) -> Optional[str]:
+        """Any catalogued raster (newest layout first), e.g. as a visualization backdrop."""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT path FROM rasters ORDER BY layout_rank, directory, path LIMIT 1").fetchone()
+        if row is None:
+            self.refresh()
+            with closing(self._connect()) as conn:
+                row = conn.execute("SELECT path FROM rasters ORDER BY layout_rank, directory, path LIMIT 1").fetchone()
+        if row and os.path.exists(row['path']):
+            return row['path']
+        return None
+
+    def count(self) -> int:
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM rasters").fetchone()[0]
+
+
+def main():
+    """Rebuild or inspect the raster catalog."""
+    parser = argparse.ArgumentParser(description='Raster catalog maintenance')
+    parser.add_argument('--data-dir', default='data/output', help='Data output directory')
+    parser.add_argument('--rebuild', action='store_true', help='Rescan all raster layouts')
+    parser.add_argument('--sim', type=int, help='List catalogued rasters for a simulation id')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    catalog = RasterCatalog(args.data_dir)
+    if args.rebuild:
+        catalog.refresh()
+    if args.sim is not None:
+        for row in catalog.find(args.sim):
+            print(f"  {row['attribute']:<10} {row['timestep']:<20} {row['path']}")
+    print(f"Catalog: {catalog.count()} rasters in {catalog.db_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Raster Time Cube
+
+Lazily loaded (t, y, x) view over the per-timestep GeoTIFFs that
+export_rasters.rb writes in AllTimestepsMode (e.g. DEPTH2D_1200.000000.tif).
+Timesteps are parsed from the filenames and sorted numerically; slices are
+only read when indexed, through RasterProcessor.load_raster (so they share the
+raster caches).
+
+Rules choose what to analyse with a "timestep" selector:
+    "final" (default) / "first"       last / first exported timestep
+    "max" / "min" / "mean"            per-cell envelope over all timesteps
+    5, -1, {"index": 5}               timestep by position
+    {"time": 3600}                    timestep nearest to 3600 s
+    {"range": [1800, 3600], "reduce": "max"}
+                                      envelope over timesteps within a time range (s)
+"""
+
+import logging
+import numpy as np
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from raster_envelope import compute_envelope
+
+
+DEFAULT_TIMESTEP = "final"
+REDUCTIONS = ("max", "min", "mean")
+
+Loader = Callable[[str], Tuple[np.ndarray, Dict[str, Any]]]
+
+
+def parse_timestep(token: str) -> Optional[float]:
+    """Parse the timestep part of '<ATTR>_<timestep>.tif' into seconds (None if not numeric)."""
+    try:
+        return float(token)
+    except (TypeError, ValueError):
+        return None
+
+
+class RasterCube:
+    """Time-ordered stack of single-band rasters for one simulation attribute."""
+
+    def __init__(self, attribute: str, paths: Sequence[str], tokens: Sequence[str], loader: Loader):
+        """
+        Args:
+            attribute: Attribute name (e.g. DEPTH2D)
+            paths: Raster path per timestep
+            tokens: Timestep token per path, as found in the filename
+            loader: Callable returning (data, meta) for a path
+        """
+        entries = sorted(zip(tokens, paths), key=lambda e: self._sort_key(e[0]))
+        self.attribute = attribute
+        self.tokens = [token for token, _ in entries]
+        self.paths = [path for _, path in entries]
+        self.times = [parse_timestep(token) for token in self.tokens]
+        self._loader = loader
+        self.logger = logging.getLogger(__name__)
+        if not self.paths:
+            raise ValueError(f"No timesteps found for attribute {attribute}")
+
+    @staticmethod
+    def _sort_key(token: str) -> Tuple[int, float, str]:
+        # Numeric timesteps first in time order, anything else after them by name
+        time = parse_timestep(token)
+        return (0, time, token) if time is not None else (1, 0.0, token)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    @property
+    def shape(self) -> Tuple[int, int, int]:
+        data, _ = self.load(0)
+        return (len(self),) + data.shape
+
+    def load(self, index: int) -> Tuple[np.ndarray, Dict[str, Any]]:
+        """Return (data, meta) for one timestep."""
+        return self._loader(self.paths[index])
+
+    def __getitem__(self, key) -> np.ndarray:
+        """Numpy-style indexing over (t, y, x); only the selected timesteps are read."""
+        if not isinstance(key, tuple):
+            key = (key,)
+        t_key, spatial = key[0], key[1:]
+        if isinstance(t_key, (int, np.integer)):
+            return self.load(int(t_key))[0][spatial]
+        indices = range(len(self))[t_key] if isinstance(t_key, slice) else t_key
+        return np.stack([self.load(int(i))[0][spatial] for i in indices])
+
+    def index_at(self, seconds: float) -> int:
+        """Index of the timestep nearest to `seconds`."""
+        timed = [i for i, t in enumerate(self.times) if t is not None]
+        if not timed:
+            raise ValueError(f"Timesteps of {self.attribute} are not numeric: {self.tokens}")
+        return min(timed, key=lambda i: abs(self.times[i] - seconds))
+
+    def indices_between(self, start: float, end: float) -> List[int]:
+        """Indices of timesteps with start <= time <= end."""
+        return [i for i, t in enumerate(self.times) if t is not None and start <= t <= end]
+
+    def resolve(self, selector: Any = DEFAULT_TIMESTEP) -> Tuple[List[int], Optional[str]]:
+        """Turn a timestep selector into (timestep indices, reduction or None)."""
+        if selector is None or selector in ("final", "last"):
+            return [len(self) - 1], None
+        if selector == "first":
+            return [0], None
+        if selector in REDUCTIONS:
+            return list(range(len(self))), selector
+        if isinstance(selector, (int, np.integer)) and not isinstance(selector, bool):
+            return [range(len(self))[int(selector)]], None
+        if isinstance(selector, dict):
+            if 'index' in selector:
+                return [range(len(self))[int(selector['index'])]], None
+            if 'time' in selector:
+                return [self.index_at(float(selector['time']))], None
+            if 'range' in selector:
+                start, end = selector['range']
+                reduce = selector.get('reduce', 'max')
+                if reduce not in REDUCTIONS:
+                    raise ValueError(f"Unsupported timestep reduction '{reduce}' (expected one of {REDUCTIONS})")
+                indices = self.indices_between(float(start), float(end))
+                if not indices:
+                    raise ValueError(f"No {self.attribute} timesteps within {start}-{end} s")
+                return indices, reduce
+        raise ValueError(f"Invalid timestep selector: {selector!r}")
+
+    def select(self, selector: Any = DEFAULT_TIMESTEP) -> Tuple[np.ndarray, Dict[str, Any]]:
+        """Return (data, meta) for a timestep selector, reading only the timesteps it needs."""
+        indices, reduce = self.resolve(selector)
+        if reduce is None:
+            return self.load(indices[0])
+        return self.reduce(indices, reduce)
+
+    def reduce(self, indices: Sequence[int], op: str = "max") -> Tuple[np.ndarray, Dict[str, Any]]:
+        """Per-cell max/min/mean over the given timesteps, streaming one timestep at a time.
+
+        Cells that are nodata in every selected timestep stay nodata. See
+        raster_envelope.EnvelopeCache for the cached variant used by the pipeline.
+        """
+        envelope = compute_envelope([self.paths[i] for i in indices], [self.times[i] for i in indices])
+        self.logger.debug(f"Reduced {len(indices)} timesteps of {self.attribute} with {op}")
+        return getattr(envelope, op), envelope.meta
+
+
+def describe_selector(selector: Any) -> str:
+    """Short text form of a selector for logs and processing params."""
+    if isinstance(selector, dict):
+        return ",".join(f"{k}={v}" for k, v in selector.items())
+    return str(selector if selector is not None else DEFAULT_TIMESTEP)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Raster Envelopes
+
+Streaming per-cell max / min / mean / argmax-time over the per-timestep rasters
+of a simulation attribute (e.g. maximum flood depth over the whole event).
+Timesteps are read one at a time into preallocated running buffers, so memory
+stays O(one raster) however many timesteps were exported.
+
+EnvelopeCache stores the envelope layers as GeoTIFFs under
+data/output/.cache/envelopes and reuses them until one of the input files
+changes. Because they are ordinary rasters, envelopes can be used anywhere a
+timestep raster can (in-memory analysis, tiled labeling, visualization).
+    Layout: <cache_dir>/<ATTR>_<key>/{max,min,mean,argmax_time}.tif + envelope.json
+"""
+
+import os
+import json
+import hashlib
+import logging
+import numpy as np
+import rasterio
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence
+
+
+NODATA = -9999
+ENVELOPE_LAYERS = ("max", "min", "mean", "argmax_time")
+
+
+@dataclass
+class Envelope:
+    """Per-cell envelope of a raster time series (float32, nodata where never valid)."""
+    max: np.ndarray
+    min: np.ndarray
+    mean: np.ndarray
+    argmax_time: np.ndarray   # time (s) of the first maximum; timestep index if times are not numeric
+    count: np.ndarray         # number of valid timesteps per cell
+    meta: Dict[str, Any]
+
+    def layers(self) -> Dict[str, np.ndarray]:
+        return {name: getattr(self, name) for name in ENVELOPE_LAYERS}
+
+
+def compute_envelope(paths: Sequence[str], times: Optional[Sequence[Optional[float]]] = None) -> Envelope:
+    """Compute the envelope of single-band rasters given in time order.
+
+    Args:
+        paths: Raster path per timestep (all on one grid)
+        times: Time (s) per timestep, used for argmax_time
+
+    Returns:
+        Envelope with float32 layers
+    """
+    if not paths:
+        raise ValueError("No timesteps to reduce")
+    running_max = running_min = total = count = argmax = None
+    meta = None
+
+    for i, path in enumerate(paths):
+        with rasterio.open(path) as src:
+            data = src.read(1)
+            if meta is None:
+                meta = {
+                    'transform': src.transform,
+                    'crs': src.crs,
+                    'width': src.width,
+                    'height': src.height,
+                    'bounds': src.bounds,
+                    'nodata': src.nodata
+                }
+                shape = data.shape
+                running_max = np.full(shape, -np.inf, dtype=np.float32)
+                running_min = np.full(shape, np.inf, dtype=np.float32)
+                total = np.zeros(shape, dtype=np.float64)
+                count = np.zeros(shape, dtype=np.int32)
+                argmax = np.full(shape, -1, dtype=np.int32)
+            elif data.shape != shape:
+                raise ValueError(f"Raster {path} has shape {data.shape}, expected {shape}")
+            nodata = src.nodata
+
+        valid = np.isfinite(data)
+        if nodata is not None:
+            valid &= data != nodata
+
+        # Strictly greater keeps the first timestep at which the maximum is reached
+        greater = valid & (data > running_max)
+        np.copyto(running_max, data, where=greater, casting='unsafe')
+        argmax[greater] = i
+        np.minimum(running_min, data, out=running_min, where=valid, casting='unsafe')
+        np.add(total, data, out=total, where=valid, casting='unsafe')
+        count += valid
+
+    never_valid = count == 0
+    mean = (total / np.maximum(count, 1)).astype(np.float32)
+    if times is not None and all(t is not None for t in times):
+        time_lut = np.asarray(times, dtype=np.float32)
+    else:
+        time_lut = np.arange(len(paths), dtype=np.float32)
+    argmax_time = time_lut[np.maximum(argmax, 0)]
+
+    for layer in (running_max, running_min, mean, argmax_time):
+        layer[never_valid] = NODATA
+    meta['nodata'] = NODATA
+
+    return Envelope(max=running_max, min=running_min, mean=mean, argmax_time=argmax_time,
+                    count=count, meta=meta)
+
+
+class EnvelopeCache:
+    """GeoTIFF cache of envelope layers keyed by the exact set of input timesteps."""
+
+    def __init__(self, cache_dir: str = "data/output/.cache/envelopes"):
+        self.cache_dir = cache_dir
+        self.logger = logging.getLogger(__name__)
+        self.hits = 0
+        self.computed = 0
+
+    @staticmethod
+    def _signature(paths: Sequence[str]) -> List[List[Any]]:
+        signature = []
+        for path in paths:
+            st = os.stat(path)
+            signature.append([os.path.abspath(path), st.st_mtime_ns, st.st_size])
+        return signature
+
+    def _entry_dir(self, attribute: str, paths: Sequence[str]) -> str:
+        digest = hashlib.sha1("|".join(os.path.abspath(p) for p in paths).encode('utf-8')).hexdigest()[:20]
+        return os.path.join(self.cache_dir, f"{attribute}_{digest}")
+
+    def get(self, attribute: str, paths: Sequence[str],
+            times: Optional[Sequence[Optional[float]]] = None) -> Dict[str, str]:
+        """Return {layer: GeoTIFF path} for the envelope of `paths`, computing it on a miss."""
+        entry_dir = self._entry_dir(attribute, paths)
+        manifest_path = os.path.join(entry_dir, "envelope.json")
+        layer_paths = {name: os.path.join(entry_dir, f"{name}.tif") for name in ENVELOPE_LAYERS}
+        signature = self._signature(paths)
+
+        if os.path.exists(manifest_path):
+            try:
+                with open(manifest_path, 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+                if manifest.get('inputs') == signature and all(os.path.exists(p) for p in layer_paths.values()):
+                    self.hits += 1
+                    return layer_paths
+            except (OSError, ValueError):
+                pass
+
+        envelope = compute_envelope(paths, times)
+        os.makedirs(entry_dir, exist_ok=True)
+        tmp_suffix = f".{os.getpid()}.tmp"
+        for name, data in envelope.layers().items():
+            self._write_layer(layer_paths[name] + tmp_suffix, data, envelope.meta)
+            os.replace(layer_paths[name] + tmp_suffix, layer_paths[name])
+
+        # The manifest is written last: it marks the entry complete
+        with open(manifest_path + tmp_suffix, 'w', encoding='utf-8') as f:
+            json.dump({'attribute': attribute, 'timesteps': len(paths), 'times': list(times or []),
+                       'inputs': signature}, f, indent=2)
+        os.replace(manifest_path + tmp_suffix, manifest_path)
+
+        self.computed += 1
+        self.logger.info(f"Computed {attribute} envelope over {len(paths)} timesteps -> {entry_dir}")
+        return layer_paths
+
+    @staticmethod
+    def _write_layer(path: str, data: np.ndarray, meta: Dict[str, Any]) -> None:
+        with rasterio.open(path, 'w', driver='GTiff', height=data.shape[0], width=data.shape[1], count=1,
+                           dtype=data.dtype, crs=meta.get('crs'), transform=meta.get('transform'),
+                           nodata=NODATA) as dst:
+            dst.write(data, 1)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'hits': self.hits, 'computed': self.computed}
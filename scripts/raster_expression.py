@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Raster Expressions
+
+Compiler for the "derive" block of rule JSONs, e.g.
+
+    "derive": {"delta": "DEPTH2D_2 - DEPTH2D_1", "hazard": "DEPTH2D * SPEED2D"}
+
+Expressions use Python syntax restricted to numbers, symbols, arithmetic
+(+ - * / ** %), comparisons (chains such as 0.9 <= hazard <= 1.1 included),
+and/or/not, and the functions min, max, abs, sqrt and where(cond, a, b).
+Comparisons evaluate to 1.0 / 0.0.
+
+Symbols are ATTR_<sim id> (DEPTH2D_2), a bare ATTR for the rule's baseline
+simulation, or the name of an earlier derive entry.
+
+An expression is compiled once into a short instruction list over a few
+reusable registers, then evaluated row chunk by row chunk with in-place
+ufuncs, so temporary memory is a few chunks rather than several full-size
+rasters. A cell is nodata (-9999) in the result when any input is nodata
+there or when the result is not finite (e.g. division by zero).
+"""
+
+import ast
+import re
+import numpy as np
+from typing import Any, Callable, Dict, List, Mapping, Optional, Set, Tuple
+
+
+NODATA = -9999
+DEFAULT_CHUNK_ROWS = 256
+
+_SYMBOL = re.compile(r"^(?P<attr>[A-Za-z][A-Za-z0-9]*?)(?:_(?P<sim>\d+))?$")
+
+_BINARY = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.true_divide,
+    ast.Pow: np.power,
+    ast.Mod: np.mod,
+}
+_COMPARE = {
+    ast.Lt: np.less,
+    ast.LtE: np.less_equal,
+    ast.Gt: np.greater,
+    ast.GtE: np.greater_equal,
+    ast.Eq: np.equal,
+    ast.NotEq: np.not_equal,
+}
+_BOOL = {ast.And: np.logical_and, ast.Or: np.logical_or}
+_UNARY = {ast.USub: np.negative, ast.Not: np.logical_not}
+_FUNCTIONS = {"min": np.minimum, "max": np.maximum, "abs": np.absolute, "sqrt": np.sqrt}
+_ARITY = {"abs": 1, "sqrt": 1, "where": 3}
+
+Operand = Tuple[str, Any]  # ("sym", name) | ("const", value) | ("reg", index)
+
+
+def parse_symbol(symbol: str) -> Tuple[str, Optional[int]]:
+    """Split 'DEPTH2D_2' into ('DEPTH2D', 2); a bare 'DEPTH2D' gives ('DEPTH2D', None)."""
+    match = _SYMBOL.match(symbol)
+    if not match:
+        raise ValueError(f"Invalid raster symbol '{symbol}'")
+    sim = match.group('sim')
+    return match.group('attr'), int(sim) if sim is not None else None
+
+
+class RasterExpression:
+    """One compiled derive expression."""
+
+    def __init__(self, source: str):
+        self.source = source.strip()
+        try:
+            tree = ast.parse(self.source, mode='eval')
+        except SyntaxError as e:
+            raise ValueError(f"Invalid expression '{self.source}': {e.msg}") from None
+        self.symbols: List[str] = []
+        self.instructions: List[Tuple[str, Any, int, List[Operand]]] = []
+        self.n_registers = 0
+        self._free: List[int] = []
+        self.result = self._compile(tree.body)
+
+    # -- compilation ---------------------------------------------------
+
+    def _error(self, node: ast.AST, what: str) -> ValueError:
+        return ValueError(f"Unsupported {what} in expression '{self.source}' "
+                          f"(column {getattr(node, 'col_offset', 0) + 1})")
+
+    def _new_register(self) -> int:
+        if self._free:
+            return self._free.pop()
+        self.n_registers += 1
+        return self.n_registers - 1
+
+    def _release(self, operands: List[Operand], keep: Tuple[int, ...]) -> None:
+        for kind, value in operands:
+            if kind == "reg" and value not in keep and value not in self._free:
+                self._free.append(value)
+
+    def _emit(self, func, operands: List[Operand], shared: Tuple[int, ...] = ()) -> Operand:
+        """Append one ufunc; the result overwrites an operand's register unless it is shared."""
+        if all(kind == "const" for kind, _ in operands):
+            return ("const", float(func(*[value for _, value in operands])))
+        reusable = [value for kind, value in operands if kind == "reg" and value not in shared]
+        out = reusable[0] if reusable else self._new_register()
+        self.instructions.append(("ufunc", func, out, operands))
+        self._release(operands, (out,) + tuple(shared))
+        return ("reg", out)
+
+    def _emit_where(self, operands: List[Operand]) -> Operand:
+        if all(kind == "const" for kind, _ in operands):
+            cond, a, b = (value for _, value in operands)
+            return ("const", float(a if cond else b))
+        # Fresh register: the result is built from b, then a is copied in where cond holds
+        out = self._new_register()
+        self.instructions.append(("where", None, out, operands))
+        self._release(operands, (out,))
+        return ("reg", out)
+
+    def _chain(self, func, operands: List[Operand]) -> Operand:
+        result = operands[0]
+        for operand in operands[1:]:
+            result = self._emit(func, [result, operand])
+        return result
+
+    def _compile(self, node: ast.AST) -> Operand:
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+            return ("const", float(node.value))
+        if isinstance(node, ast.Name):
+            if node.id not in self.symbols:
+                self.symbols.append(node.id)
+            return ("sym", node.id)
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINARY:
+            return self._emit(_BINARY[type(node.op)], [self._compile(node.left), self._compile(node.right)])
+        if isinstance(node, ast.UnaryOp):
+            if isinstance(node.op, ast.UAdd):
+                return self._compile(node.operand)
+            if type(node.op) in _UNARY:
+                return self._emit(_UNARY[type(node.op)], [self._compile(node.operand)])
+        if isinstance(node, ast.Compare) and all(type(op) in _COMPARE for op in node.ops):
+            # a < b <= c  ->  (a < b) and (b <= c)
+            terms = [self._compile(node.left)] + [self._compile(c) for c in node.comparators]
+            # Middle terms feed two comparisons, so their registers stay live until the end
+            shared = tuple(value for kind, value in terms[1:-1] if kind == "reg")
+            results = [self._emit(_COMPARE[type(op)], [terms[i], terms[i + 1]], shared)
+                       for i, op in enumerate(node.ops)]
+            self._release(terms[1:-1], ())
+            return self._chain(np.logical_and, results)
+        if isinstance(node, ast.BoolOp) and type(node.op) in _BOOL:
+            return self._chain(_BOOL[type(node.op)], [self._compile(v) for v in node.values])
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+            name = node.func.id
+            if name not in _FUNCTIONS and name != "where":
+                raise self._error(node, f"function '{name}'")
+            args = [self._compile(a) for a in node.args]
+            if name in _ARITY and len(args) != _ARITY[name]:
+                raise ValueError(f"{name}() takes {_ARITY[name]} argument(s) in expression '{self.source}'")
+            if name in ("min", "max") and len(args) < 2:
+                raise ValueError(f"{name}() needs at least 2 arguments in expression '{self.source}'")
+            if name == "where":
+                return self._emit_where(args)
+            if name in ("min", "max"):
+                return self._chain(_FUNCTIONS[name], args)
+            return self._emit(_FUNCTIONS[name], args)
+        raise self._error(node, type(node).__name__)
+
+    # -- evaluation ----------------------------------------------------
+
+    def evaluate(self, inputs: Mapping[str, Any], out: Optional[np.ndarray] = None,
+                 chunk_rows: int = DEFAULT_CHUNK_ROWS, nodata: float = NODATA) -> np.ndarray:
+        """Evaluate over 2-D rasters, one chunk of rows at a time.
+
+        Args:
+            inputs: Array (or scalar) per symbol
+            out: Optional output array (e.g. a memmap); allocated if omitted
+            chunk_rows: Rows per chunk
+            nodata: Nodata value of the inputs and of the result
+
+        Returns:
+            Result raster (float32 unless an input is float64)
+        """
+        missing = [s for s in self.symbols if s not in inputs]
+        if missing:
+            raise ValueError(f"Expression '{self.source}' needs {missing}")
+        arrays = {s: inputs[s] for s in self.symbols if isinstance(inputs[s], np.ndarray)}
+        if not arrays and out is None:
+            raise ValueError(f"Expression '{self.source}' has no raster inputs")
+        shape = out.shape if out is not None else next(iter(arrays.values())).shape
+        for symbol, array in arrays.items():
+            if array.shape != shape:
+                raise ValueError(f"{symbol} has shape {array.shape}, expected {shape}")
+        dtype = np.result_type(np.float32, *(a.dtype for a in arrays.values()))
+        if out is None:
+            out = np.empty(shape, dtype=dtype)
+
+        chunk_rows = max(1, min(int(chunk_rows), shape[0]))
+        registers = [np.empty((chunk_rows,) + shape[1:], dtype=dtype) for _ in range(self.n_registers)]
+        valid = np.empty((chunk_rows,) + shape[1:], dtype=bool)
+        scratch = np.empty_like(valid)
+
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            for row0 in range(0, shape[0], chunk_rows):
+                rows = slice(row0, min(row0 + chunk_rows, shape[0]))
+                n = rows.stop - rows.start
+                chunk = {s: np.asarray(a[rows]) for s, a in arrays.items()}
+
+                def value(operand: Operand):
+                    kind, v = operand
+                    if kind == "const":
+                        return v
+                    if kind == "reg":
+                        return registers[v][:n]
+                    return chunk[v] if v in chunk else inputs[v]
+
+                for op, func, reg, operands in self.instructions:
+                    target = registers[reg][:n]
+                    if op == "ufunc":
+                        func(*[value(o) for o in operands], out=target)
+                    else:
+                        cond, a, b = (value(o) for o in operands)
+                        np.copyto(target, b)
+                        np.not_equal(cond, 0, out=scratch[:n])
+                        np.copyto(target, a, where=scratch[:n])
+
+                result = out[rows]
+                result[...] = value(self.result)
+                mask = valid[:n]
+                np.isfinite(result, out=mask)
+                for data in chunk.values():
+                    np.not_equal(data, nodata, out=scratch[:n])
+                    mask &= scratch[:n]
+                result[~mask] = nodata
+        return out
+
+    def __repr__(self) -> str:
+        return f"RasterExpression({self.source!r})"
+
+
+class DeriveSet:
+    """The compiled "derive" block of a rule: ordered named expressions."""
+
+    def __init__(self, derive: Optional[Mapping[str, str]] = None):
+        self.expressions: Dict[str, RasterExpression] = {}
+        for name, source in (derive or {}).items():
+            if not re.match(r"^[A-Za-z_][A-Za-z0-9_]*$", name):
+                raise ValueError(f"Invalid derive name '{name}'")
+            self.expressions[name] = RasterExpression(source)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.expressions
+
+    def __bool__(self) -> bool:
+        return bool(self.expressions)
+
+    def names(self) -> List[str]:
+        return list(self.expressions)
+
+    def _dependencies(self, name: str, seen: Optional[Set[str]] = None) -> List[str]:
+        """Derive names that `name` depends on (itself last), in evaluation order."""
+        seen = set() if seen is None else seen
+        if name in seen:
+            raise ValueError(f"Derive entry '{name}' depends on itself")
+        seen.add(name)
+        order = []
+        for symbol in self.expressions[name].symbols:
+            if symbol in self.expressions:
+                order.extend(d for d in self._dependencies(symbol, set(seen)) if d not in order)
+        order.append(name)
+        return order
+
+    def required_inputs(self, name: Optional[str] = None,
+                        default_sim: Optional[int] = None) -> Set[Tuple[str, Optional[int]]]:
+        """(attribute, sim id) pairs read by one entry (or all entries)."""
+        names = self._dependencies(name) if name else self.names()
+        required = set()
+        for entry in names:
+            for symbol in self.expressions[entry].symbols:
+                if symbol not in self.expressions:
+                    attr, sim = parse_symbol(symbol)
+                    required.add((attr, sim if sim is not None else default_sim))
+        return required
+
+    def evaluate(self, name: str, resolve: Callable[[str, Optional[int]], np.ndarray],
+                 chunk_rows: int = DEFAULT_CHUNK_ROWS, nodata: float = NODATA) -> np.ndarray:
+        """Evaluate one entry (and the entries it references).
+
+        Args:
+            name: Derive entry to evaluate
+            resolve: Returns the raster for (attribute, sim id or None)
+        """
+        if name not in self.expressions:
+            raise KeyError(f"No derive entry '{name}' (have {self.names()})")
+        values: Dict[str, np.ndarray] = {}
+        for entry in self._dependencies(name):
+            expression = self.expressions[entry]
+            inputs = {}
+            for symbol in expression.symbols:
+                if symbol in values:
+                    inputs[symbol] = values[symbol]
+                else:
+                    inputs[symbol] = resolve(*parse_symbol(symbol))
+            values[entry] = expression.evaluate(inputs, chunk_rows=chunk_rows, nodata=nodata)
+        return values[name]
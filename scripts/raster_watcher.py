@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Raster Watcher
+
+Event-driven change detection for monitor mode (pipeline_runner.py
+--monitor-mode). Watches the raster layouts under data/output (raster/...,
+rasters/... and the old structured <db>/<group>/<run>/rasters/...) and
+reports which (simulation, attribute) pairs changed, so that only the rules
+reading them are run again.
+
+Backends:
+- inotify (Linux, through libc with ctypes; no extra dependency): recursive
+  watches that follow new directories. Files are reported once written
+  (IN_CLOSE_WRITE / IN_MOVED_TO) or removed. A kernel queue overflow
+  falls back to one rescan. Structured <db>/<group>/<run>/rasters trees are
+  watched if they exist when monitoring starts.
+- polling (elsewhere, or with backend="poll"): a stat snapshot of the
+  simulation directories every `poll_interval` seconds.
+
+An export writes hundreds of timestep files in a burst. Changes are collected
+per simulation and only reported once that simulation has been quiet for
+`debounce` seconds, together with the directories to re-index in the catalog.
+RuleTriggerQueue then coalesces them per rule: a rule is queued at most once,
+however many of its input files changed, and the queue is bounded.
+"""
+
+import os
+import sys
+import glob
+import time
+import select
+import struct
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from raster_catalog import classify_raster_path, parse_raster_filename
+
+
+DEFAULT_DEBOUNCE = 2.0
+DEFAULT_POLL_INTERVAL = 5.0
+DEFAULT_QUEUE_SIZE = 64
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+@dataclass
+class RasterChange:
+    """Settled changes of one simulation."""
+    sim_id: int
+    attributes: Set[str] = field(default_factory=set)
+    directories: Set[str] = field(default_factory=set)
+    files: int = 0
+
+
+def watch_roots(data_dir: str) -> List[str]:
+    """Existing top-level directories of the recognised raster layouts."""
+    roots = [os.path.join(data_dir, "raster"), os.path.join(data_dir, "rasters")]
+    roots.extend(glob.glob(os.path.join(data_dir, "*", "*", "*", "rasters")))
+    return [os.path.abspath(r) for r in roots if os.path.isdir(r)]
+
+
+def scan_rasters(roots: Iterable[str]) -> Dict[str, Tuple[int, int]]:
+    """(mtime_ns, size) of every .tif below the roots."""
+    snapshot = {}
+    for root in roots:
+        for dirpath, _, files in os.walk(root):
+            for name in files:
+                if name.lower().endswith('.tif'):
+                    path = os.path.join(dirpath, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    snapshot[path] = (st.st_mtime_ns, st.st_size)
+    return snapshot
+
+
+class PollingBackend:
+    """Stat snapshot of the raster layouts, diffed every poll interval."""
+
+    name = "poll"
+
+    def __init__(self, data_dir: str, poll_interval: float = DEFAULT_POLL_INTERVAL):
+        self.data_dir = data_dir
+        self.poll_interval = poll_interval
+        self._snapshot = scan_rasters(watch_roots(data_dir))
+        self._next_scan = time.monotonic() + poll_interval
+
+    def read(self, timeout: float) -> List[str]:
+        """Paths added, changed or removed since the last scan (waits up to `timeout`)."""
+        wait = self._next_scan - time.monotonic()
+        if wait > timeout:
+            time.sleep(max(timeout, 0))
+            return []
+        time.sleep(max(wait, 0))
+        self._next_scan = time.monotonic() + self.poll_interval
+        snapshot = scan_rasters(watch_roots(self.data_dir))
+        changed = [p for p, sig in snapshot.items() if self._snapshot.get(p) != sig]
+        changed.extend(p for p in self._snapshot if p not in snapshot)
+        self._snapshot = snapshot
+        return changed
+
+    def close(self) -> None:
+        pass
+
+
+class InotifyBackend:
+    """Recursive inotify watches on the raster layouts (Linux)."""
+
+    name = "inotify"
+
+    def __init__(self, data_dir: str):
+        import ctypes
+        import ctypes.util
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.data_dir = os.path.abspath(data_dir)
+        self._paths: Dict[int, str] = {}
+        self._watched: Set[str] = set()
+        # data_dir itself (not recursive) to notice layout roots created later
+        self._add(self.data_dir)
+        for root in watch_roots(self.data_dir):
+            self._add_tree(root)
+
+    def _add(self, directory: str) -> None:
+        if directory in self._watched:
+            return
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            logging.getLogger(__name__).debug(f"Cannot watch {directory}")
+            return
+        self._paths[wd] = directory
+        self._watched.add(directory)
+
+    def _add_tree(self, root: str) -> List[str]:
+        """Watch a directory tree; returns the rasters already in it (written before the watch)."""
+        existing = []
+        for dirpath, _, files in os.walk(root):
+            self._add(dirpath)
+            existing.extend(os.path.join(dirpath, f) for f in files if f.lower().endswith('.tif'))
+        return existing
+
+    def _is_layout_root(self, path: str) -> bool:
+        return os.path.basename(path) in ('raster', 'rasters')
+
+    def read(self, timeout: float) -> List[str]:
+        """Raster paths written or removed (waits up to `timeout` for the first event)."""
+        ready, _, _ = select.select([self._fd], [], [], max(timeout, 0))
+        if not ready:
+            return []
+        changed = []
+        while True:
+            try:
+                buffer = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _, length = _EVENT_HEADER.unpack_from(buffer, offset)
+                offset += _EVENT_HEADER.size
+                name = os.fsdecode(buffer[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                changed.extend(self._event(wd, mask, name))
+        return changed
+
+    def _event(self, wd: int, mask: int, name: str) -> List[str]:
+        if mask & IN_Q_OVERFLOW:
+            logging.getLogger(__name__).warning("inotify queue overflow; rescanning raster layouts")
+            return list(scan_rasters(watch_roots(self.data_dir)))
+        directory = self._paths.get(wd)
+        if directory is None:
+            return []
+        if mask & IN_IGNORED:
+            del self._paths[wd]
+            self._watched.discard(directory)
+            return []
+        path = os.path.join(directory, name)
+        if mask & IN_ISDIR:
+            # New sim/run directories (or a layout root appearing under data_dir)
+            if mask & (IN_CREATE | IN_MOVED_TO) and (directory != self.data_dir or self._is_layout_root(path)):
+                return self._add_tree(path)
+            return []
+        if directory == self.data_dir or not name.lower().endswith('.tif'):
+            return []
+        if mask & (IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE):
+            return [path]
+        return []
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def create_backend(data_dir: str, backend: str = "auto", poll_interval: float = DEFAULT_POLL_INTERVAL):
+    """inotify where available (backend "auto" or "inotify"), polling otherwise."""
+    if backend in ("auto", "inotify") and sys.platform.startswith("linux"):
+        try:
+            return InotifyBackend(data_dir)
+        except (OSError, AttributeError) as e:
+            if backend == "inotify":
+                raise
+            logging.getLogger(__name__).warning(f"inotify unavailable ({e}); polling every {poll_interval:g}s")
+    elif backend == "inotify":
+        raise OSError("inotify is only available on Linux")
+    return PollingBackend(data_dir, poll_interval)
+
+
+class RasterWatcher:
+    """Debounces raster file events into settled per-simulation changes."""
+
+    def __init__(self, data_dir: str, debounce: float = DEFAULT_DEBOUNCE, backend: str = "auto",
+                 poll_interval: float = DEFAULT_POLL_INTERVAL):
+        self.data_dir = data_dir
+        self.debounce = debounce
+        self.backend = create_backend(data_dir, backend, poll_interval)
+        self.logger = logging.getLogger(__name__)
+        self._pending: Dict[int, RasterChange] = {}
+        self._last_event: Dict[int, float] = {}
+
+    def add(self, paths: Iterable[str], now: Optional[float] = None) -> int:
+        """Record changed paths; returns how many were raster files of a recognised layout."""
+        now = time.monotonic() if now is None else now
+        accepted = 0
+        for path in paths:
+            parsed = parse_raster_filename(os.path.basename(path))
+            info = classify_raster_path(self.data_dir, path)
+            if parsed is None or info is None:
+                continue
+            change = self._pending.setdefault(info['sim_id'], RasterChange(info['sim_id']))
+            change.attributes.add(parsed['attribute'])
+            change.directories.add(os.path.dirname(os.path.abspath(path)))
+            change.files += 1
+            self._last_event[info['sim_id']] = now
+            accepted += 1
+        return accepted
+
+    def settled(self, now: Optional[float] = None) -> List[RasterChange]:
+        """Changes of simulations without events for `debounce` seconds (removed from pending)."""
+        now = time.monotonic() if now is None else now
+        ready = [sim for sim, last in self._last_event.items() if now - last >= self.debounce]
+        changes = []
+        for sim_id in sorted(ready):
+            del self._last_event[sim_id]
+            changes.append(self._pending.pop(sim_id))
+        return changes
+
+    def wait(self, timeout: float = 1.0) -> List[RasterChange]:
+        """Read events for up to `timeout` seconds and return the settled changes."""
+        if self._last_event:
+            # Wake up when the oldest pending simulation settles
+            oldest = min(self._last_event.values())
+            timeout = min(timeout, max(oldest + self.debounce - time.monotonic(), 0))
+        self.add(self.backend.read(timeout))
+        return self.settled()
+
+    def run(self, on_changes: Callable[[List[RasterChange]], None], stop: threading.Event) -> None:
+        """Report settled changes until `stop` is set (e.g. in a background thread)."""
+        try:
+            while not stop.is_set():
+                changes = self.wait(1.0)
+                if changes:
+                    on_changes(changes)
+        finally:
+            self.backend.close()
+
+
+class RuleTriggerQueue:
+    """Bounded queue of rules to run, coalescing repeated triggers of a queued rule."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = max(1, maxsize)
+        self._items: "OrderedDict[str, Set[int]]" = OrderedDict()
+        self._cond = threading.Condition()
+        self.coalesced = 0
+
+    def put(self, rule_name: str, sim_ids: Iterable[int], timeout: Optional[float] = None) -> bool:
+        """Queue a rule for the simulations that changed; False if it was already queued (coalesced).
+
+        Blocks while the queue is full (up to `timeout`), applying back-pressure
+        to the watcher instead of growing without bound.
+        """
+        with self._cond:
+            if rule_name in self._items:
+                self._items[rule_name].update(sim_ids)
+                self.coalesced += 1
+                return False
+            if not self._cond.wait_for(lambda: len(self._items) < self.maxsize, timeout):
+                raise TimeoutError(f"Rule queue full ({self.maxsize}); dropping trigger of {rule_name}")
+            self._items[rule_name] = set(sim_ids)
+            self._cond.notify_all()
+            return True
+
+    def get_batch(self, timeout: Optional[float] = None) -> "OrderedDict[str, Set[int]]":
+        """Take every queued rule (in queue order) with its changed simulations; empty on timeout."""
+        with self._cond:
+            self._cond.wait_for(lambda: bool(self._items), timeout)
+            batch, self._items = self._items, OrderedDict()
+            self._cond.notify_all()
+            return batch
+
+    def __len__(self) -> int:
+        with self._cond:
+            return len(self._items)
+
+
+def affected_rules(changes: List[RasterChange], rules: Iterable, required_inputs: Callable) -> Dict[str, Set[int]]:
+    """Rules reading any changed (simulation, attribute), with the simulations that triggered them.
+
+    Args:
+        changes: Settled raster changes
+        rules: RuleConfig objects
+        required_inputs: ClusterProcessor.required_inputs (attributes per simulation of a rule)
+    """
+    changed = {(c.sim_id, attr) for c in changes for attr in c.attributes}
+    affected: Dict[str, Set[int]] = {}
+    for rule in rules:
+        try:
+            required = required_inputs(rule)
+        except Exception:
+            continue
+        sims = {sim_id for sim_id, attrs in required.items() for attr in attrs if (sim_id, attr) in changed}
+        if sims:
+            affected[rule.name] = sims
+    return affected
@@ -10,8 +10,9 @@ import re
 import json
 import os
 from typing import Dict, List, Tuple, Any, Optional
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum
+from raster_expression import DeriveSet
 
 
 class AnalysisType(Enum):
@@ -36,6 +37,10 @@ class RuleConfig:
     baseline_id: Optional[int] = None
     candidate_id: Optional[int] = None
     query_text: str = ""
+    timestep: Any = "final"  # "final", "first", "max", "min", index, {"time": s} or {"range": [s0, s1]}
+    features: List[str] = field(default_factory=list)  # attributes used as clustering features
+    derive: Dict[str, str] = field(default_factory=dict)  # name -> expression (see raster_expression.py)
+    analysis_attribute: Optional[str] = None  # attribute analysed instead of attributes[0] (explicit opt-in)
 
 
 class RuleParser:
@@ -129,9 +134,16 @@ class RuleParser:
             visualization=config_data.get('visualization', {}),
             outputs=config_data.get('outputs', {}),
             baseline_id=config_data.get('compare', {}).get('baseline_id'),
-            candidate_id=config_data.get('compare', {}).get('candidate_id')
+            candidate_id=config_data.get('compare', {}).get('candidate_id'),
+            timestep=config_data.get('timestep', 'final'),
+            features=config_data.get('features', []),
+            derive=config_data.get('derive', {}),
+            analysis_attribute=config_data.get('analysis_attribute')
         )
         
+        # Compile derive expressions now so syntax errors surface when the rule is parsed
+        DeriveSet(config.derive)
+        
         return config
     
     def _determine_analysis_type(self, query_text: str) -> AnalysisType:
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Pixel-level cluster quality metrics at bounded cost
+
+Silhouette, Calinski-Harabasz and Davies-Bouldin scores of a label raster,
+with the pixel values as the feature (as in ClusterQualityMetrics), without
+the O(pixels^2) distance matrix of the textbook silhouette:
+
+- Calinski-Harabasz and Davies-Bouldin are closed forms over per-label
+  sums (count, mean, standard deviation; see label_stats.py), so they are
+  exact over all cluster pixels. Davies-Bouldin measures the scatter of a
+  cluster as its RMS distance to the centroid (Davies & Bouldin's q = 2).
+  sklearn's davies_bouldin_score uses the mean distance (q = 1), which the
+  per-label sums cannot give, so the score is reported under its own name,
+  davies_bouldin_rms_score.
+- The silhouette is always the exact silhouette of a stratified sample with
+  the same number of pixels from every cluster (all pixels of smaller
+  clusters, one pixel from each of at most `size` clusters when there are
+  more), so small clusters weigh as much as large ones and every experiment
+  is scored by the same estimator.
+
+Labels <= 0 (background and nodata) are not clusters.
+"""
+
+import numpy as np
+from typing import Dict, Optional, Tuple
+from sklearn.metrics import silhouette_score
+from label_stats import positive_labels
+
+
+DEFAULT_SAMPLE_SIZE = 2000
+# Rows of the Davies-Bouldin cluster ratio matrix evaluated at once
+DB_CHUNK = 1024
+
+
+def stratified_sample(label_data: np.ndarray, values: np.ndarray, size: int = DEFAULT_SAMPLE_SIZE,
+                      seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """(values, labels) of up to `size` cluster pixels, balanced across clusters."""
+    flat_labels = positive_labels(label_data).ravel()
+    positions = np.flatnonzero(flat_labels)
+    if positions.size == 0:
+        return np.zeros(0, dtype=np.float64), np.zeros(0, dtype=np.int64)
+    rng = np.random.default_rng(seed)
+    # Random order within each label: shuffle, then stable-sort by label
+    positions = positions[rng.permutation(positions.size)]
+    positions = positions[np.argsort(flat_labels[positions], kind='stable')]
+    labels = flat_labels[positions]
+    starts = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]])
+    counts = np.diff(np.r_[starts, labels.size])
+    if len(starts) > size:
+        # More clusters than pixels to draw: one pixel from each of `size` random clusters
+        keep = np.sort(rng.choice(len(starts), size, replace=False))
+        starts, counts = starts[keep], counts[keep]
+    per_label = max(1, size // len(starts))
+    taken = np.minimum(counts, per_label)
+    # Position of each taken pixel: the first `taken` of its label's run
+    offsets = np.arange(taken.sum()) - np.repeat(np.cumsum(taken) - taken, taken)
+    chosen = positions[np.repeat(starts, taken) + offsets]
+    return values.ravel()[chosen].astype(np.float64), flat_labels[chosen].astype(np.int64)
+
+
+def calinski_harabasz(counts: np.ndarray, means: np.ndarray, stds: np.ndarray) -> float:
+    """Calinski-Harabasz score from per-cluster pixel counts, means and (population) standard deviations."""
+    k, n = len(counts), counts.sum()
+    if k < 2 or n <= k:
+        return 0.0
+    overall = (counts * means).sum() / n
+    between = (counts * (means - overall) ** 2).sum()
+    within = (counts * stds ** 2).sum()
+    return float(between * (n - k) / (within * (k - 1))) if within > 0 else 1.0
+
+
+def davies_bouldin(means: np.ndarray, stds: np.ndarray) -> float:
+    """Davies-Bouldin score with RMS scatter (q = 2) from per-cluster means and standard deviations; lower is better."""
+    k = len(means)
+    if k < 2:
+        return float('inf')
+    if np.allclose(stds, 0) or np.allclose(means, means[0]):
+        return 0.0
+    worst = np.empty(k)
+    for start in range(0, k, DB_CHUNK):
+        rows = slice(start, min(start + DB_CHUNK, k))
+        distance = np.abs(means[rows, None] - means[None, :])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = (stds[rows, None] + stds[None, :]) / np.where(distance > 0, distance, np.inf)
+        ratio[np.arange(ratio.shape[0]), np.arange(start, rows.stop)] = 0.0
+        worst[rows] = ratio.max(axis=1)
+    return float(worst.mean())
+
+
+def sample_silhouette(values: np.ndarray, labels: np.ndarray) -> Optional[float]:
+    """Exact silhouette of a (stratified) sample; None with fewer than two clusters."""
+    present = np.unique(labels)
+    if present.size < 2 or present.size >= values.size:
+        return None
+    return float(silhouette_score(values.reshape(-1, 1), labels))
+
+
+def pixel_metrics(counts: np.ndarray, means: np.ndarray, stds: np.ndarray,
+                  sample: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> Dict[str, Optional[float]]:
+    """The three scores of a clustering (silhouette None without a sample)."""
+    return {
+        'silhouette_score': sample_silhouette(*sample) if sample is not None else None,
+        'calinski_harabasz_score': calinski_harabasz(counts, means, stds),
+        'davies_bouldin_rms_score': davies_bouldin(means, stds)
+    }
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+Adaptive search strategies for the parameter optimizer
+
+The optimizer's default grid (OptimizationParams) runs every combination of
+a few hard-coded values. The strategies here search a SearchSpace of ranges
+instead (k, threshold and min_size, plus the clustering algorithm) and spend
+a budget of experiments where the scores are:
+
+- random:  `budget` random candidates at full resolution.
+- halving: successive halving. `budget` random candidates are scored on a
+           small pixel sample (see pixel_sample.py); the best 1/eta are
+           promoted to a sample eta times larger, until the survivors run at
+           full resolution.
+- bayes:   sequential model-based search. After a random initial design, a
+           Gaussian process fitted to the scores so far proposes the
+           candidates of highest expected improvement, `budget` in total.
+
+Every strategy is warm-started: the rule's current parameters and those of
+a previous run (<rule>_best_params.json) are evaluated first, and halving
+carries them to full resolution, so a search never ends below them.
+
+Strategies are driven in rounds: `ask()` returns the trials to run next
+(empty when done), `tell()` hands back the same trials with their scores.
+"""
+
+import json
+import math
+import os
+import warnings
+import numpy as np
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+from scipy.stats import norm
+from sklearn.gaussian_process import GaussianProcessRegressor
+from sklearn.gaussian_process.kernels import ConstantKernel, Matern, WhiteKernel
+
+from rule_parser import RuleConfig
+from pixel_sample import PixelSample
+
+STRATEGIES = ('grid', 'random', 'halving', 'bayes')
+DEFAULT_BUDGET = 30
+DEFAULT_ETA = 3
+DEFAULT_MIN_FRACTION = 1.0 / 9
+# Random points scored by the surrogate per proposal of the model-based search
+CANDIDATE_POOL = 512
+
+
+@dataclass
+class SearchSpace:
+    """Ranges of the clustering parameters the adaptive strategies draw from.
+
+    Thresholds and min_size are searched on a log scale. Which parameters a
+    candidate has depends on its algorithm: k for k-means, threshold and
+    min_size for connected components, threshold for DBSCAN.
+    """
+    k_range: Tuple[int, int] = (2, 15)
+    threshold_range: Tuple[float, float] = (0.001, 1.0)
+    min_size_range: Tuple[int, int] = (10, 500)
+    algorithms: List[str] = field(default_factory=lambda: ['kmeans', 'connected_components', 'dbscan'])
+
+    def algorithms_for(self, rule_config: RuleConfig) -> List[str]:
+        """Algorithms searched for a rule (as in the grid: only comparisons vary the algorithm)."""
+        analysis_type = rule_config.analysis_type.value
+        if analysis_type == "comparison":
+            return list(self.algorithms)
+        if analysis_type == "threshold":
+            return ['connected_components']
+        return ['kmeans']
+
+    def dimensions(self, algorithm: str) -> List[str]:
+        """Parameters a candidate of `algorithm` has."""
+        if algorithm == 'kmeans':
+            return ['k']
+        if algorithm == 'connected_components':
+            return ['threshold', 'min_size']
+        return ['threshold']
+
+    def sample(self, rng: np.random.Generator, rule_config: RuleConfig) -> Dict[str, Any]:
+        """A random candidate for the rule."""
+        algorithms = self.algorithms_for(rule_config)
+        point: Dict[str, Any] = {'algorithm': algorithms[int(rng.integers(len(algorithms)))]}
+        for name in self.dimensions(point['algorithm']):
+            if name == 'k':
+                point['k'] = int(rng.integers(self.k_range[0], self.k_range[1] + 1))
+            elif name == 'threshold':
+                low, high = np.log(self.threshold_range)
+                point['threshold'] = float(f"{np.exp(rng.uniform(low, high)):.4g}")
+            else:
+                low, high = np.log(self.min_size_range)
+                point['min_size'] = int(round(np.exp(rng.uniform(low, high))))
+        return point
+
+    def to_parameters(self, rule_config: RuleConfig, point: Dict[str, Any]) -> Dict[str, Any]:
+        """Experiment parameters of a candidate, in the layout of the grid's combinations."""
+        params: Dict[str, Any] = {
+            'attributes': rule_config.attributes,
+            'baseline_id': rule_config.baseline_id,
+            'candidate_id': rule_config.candidate_id
+        }
+        algorithm = point['algorithm']
+        if algorithm == 'kmeans':
+            params['clustering'] = {'method': 'kmeans', 'k': point['k'], 'max_iter': 300, 'random_seed': 42}
+        elif algorithm == 'connected_components':
+            params['clustering'] = {'method': 'connected_components', 'min_size': point['min_size']}
+        else:
+            params['clustering'] = {'method': 'dbscan', 'eps': 1.5, 'min_samples': 5}
+
+        analysis_type = rule_config.analysis_type.value
+        if analysis_type == "comparison":
+            threshold = point.get('threshold', rule_config.thresholds.get('change_threshold', 0.01))
+            params['thresholds'] = {'change_threshold': threshold, 'min_cluster_area': 100.0}
+        elif analysis_type == "threshold":
+            params['thresholds'] = {'depth_threshold': point['threshold']}
+        else:
+            params['thresholds'] = rule_config.thresholds
+        return params
+
+    def from_parameters(self, rule_config: RuleConfig, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Candidate of a rule's (or a previous run's) parameters; None if they are not in this space."""
+        clustering = params.get('clustering') or {}
+        thresholds = params.get('thresholds') or {}
+        algorithm = clustering.get('method')
+        if algorithm is None and rule_config.analysis_type.value == "threshold":
+            algorithm = 'connected_components'
+        if algorithm not in self.algorithms_for(rule_config):
+            return None
+        values = {
+            'k': clustering.get('k'),
+            'threshold': thresholds.get('change_threshold', thresholds.get('depth_threshold')),
+            'min_size': clustering.get('min_size', 50)
+        }
+        point = {'algorithm': algorithm}
+        for name in self.dimensions(algorithm):
+            if values[name] is None:
+                return None
+            point[name] = values[name]
+        return point
+
+    def encode(self, rule_config: RuleConfig, point: Dict[str, Any]) -> np.ndarray:
+        """Candidate as a vector in the unit cube (one-hot algorithm, scaled parameters) for the surrogate."""
+        algorithms = self.algorithms_for(rule_config)
+        vector = [1.0 if point['algorithm'] == a else 0.0 for a in algorithms]
+        scales = {
+            'k': (point.get('k'), self.k_range, False),
+            'threshold': (point.get('threshold'), self.threshold_range, True),
+            'min_size': (point.get('min_size'), self.min_size_range, True)
+        }
+        for value, (low, high), log in scales.values():
+            if value is None:
+                vector.append(0.5)
+                continue
+            if log:
+                value, low, high = np.log(max(value, 1e-12)), np.log(low), np.log(high)
+            vector.append(float(np.clip((value - low) / (high - low), 0.0, 1.0)) if high > low else 0.5)
+        return np.array(vector)
+
+
+def point_key(point: Dict[str, Any]) -> str:
+    return json.dumps(point, sort_keys=True)
+
+
+def load_warm_start(experiments_dir: str, rule_name: str) -> Optional[Dict[str, Any]]:
+    """Best parameters of a previous optimization of the rule (<rule>_best_params.json), if any."""
+    path = os.path.join(experiments_dir, f"{rule_name}_best_params.json")
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('best_parameters') or None
+    except (OSError, ValueError):
+        return None
+
+
+@dataclass
+class Trial:
+    """A candidate to run at a fraction of the pixels (1.0: full resolution), and its score once told."""
+    point: Dict[str, Any]
+    fraction: float = 1.0
+    seed: int = 0
+    score: Optional[float] = None
+
+    def sample(self) -> Optional[PixelSample]:
+        return PixelSample(self.fraction, self.seed) if self.fraction < 1.0 else None
+
+
+class SearchStrategy(ABC):
+    """Base class: proposes trials in rounds and learns from their scores."""
+
+    name = ""
+
+    def __init__(self, space: SearchSpace, rule_config: RuleConfig, budget: int = DEFAULT_BUDGET,
+                 warm_start: Optional[List[Dict[str, Any]]] = None, seed: int = 42, batch_size: int = 1):
+        self.space = space
+        self.rule_config = rule_config
+        self.budget = max(1, budget)
+        self.batch_size = max(1, batch_size)
+        self.rng = np.random.default_rng(seed)
+        self.seed = seed
+        self.warm_start = self._unique([p for p in (warm_start or []) if p is not None])
+        self.trials: List[Trial] = []
+        self._seen = {point_key(p) for p in self.warm_start}
+
+    @abstractmethod
+    def ask(self) -> List[Trial]:
+        """The next round of trials to run (empty when the search is done)."""
+
+    def tell(self, trials: List[Trial]) -> None:
+        self.trials.extend(trials)
+
+    def summary(self) -> Dict[str, Any]:
+        """Strategy, budget and cost of the search, for the experiment results file."""
+        return {
+            'strategy': self.name,
+            'budget': self.budget,
+            'warm_start': len(self.warm_start),
+            'experiments': len(self.trials),
+            'full_resolution_equivalents': sum(t.fraction for t in self.trials)
+        }
+
+    def _unique(self, points: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        seen, unique = set(), []
+        for point in points:
+            if point_key(point) not in seen:
+                seen.add(point_key(point))
+                unique.append(point)
+        return unique
+
+    def _random_points(self, count: int) -> List[Dict[str, Any]]:
+        """Up to `count` random candidates not proposed before (fewer if the space runs out)."""
+        points = []
+        attempts = 0
+        while len(points) < count and attempts < 50 * count:
+            attempts += 1
+            point = self.space.sample(self.rng, self.rule_config)
+            if point_key(point) not in self._seen:
+                self._seen.add(point_key(point))
+                points.append(point)
+        return points
+
+
+class RandomSearch(SearchStrategy):
+    """`budget` candidates drawn at random (after the warm start), all at full resolution."""
+
+    name = "random"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._asked = False
+
+    def ask(self) -> List[Trial]:
+        if self._asked:
+            return []
+        self._asked = True
+        points = self.warm_start + self._random_points(self.budget - len(self.warm_start))
+        return [Trial(point) for point in points]
+
+
+class SuccessiveHalving(SearchStrategy):
+    """Scores `budget` candidates on a small pixel sample and promotes the best to larger ones.
+
+    Rung r runs at min_fraction * eta**r of the pixels, the last rung at full
+    resolution; each rung keeps the best 1/eta candidates (and the warm start).
+    All candidates of a rung share one sample, drawn from the rung's seed.
+    """
+
+    name = "halving"
+
+    def __init__(self, *args, eta: int = DEFAULT_ETA, min_fraction: float = DEFAULT_MIN_FRACTION, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.eta = max(2, eta)
+        self.fractions = []
+        fraction = min(max(min_fraction, 1e-6), 1.0)
+        while fraction < 1.0 - 1e-9:
+            self.fractions.append(fraction)
+            fraction *= self.eta
+        self.fractions.append(1.0)
+        self.rungs: List[Dict[str, Any]] = []
+        self._candidates: Optional[List[Dict[str, Any]]] = None
+
+    def ask(self) -> List[Trial]:
+        rung = len(self.rungs)
+        if rung >= len(self.fractions):
+            return []
+        if self._candidates is None:
+            self._candidates = self.warm_start + self._random_points(max(self.budget - len(self.warm_start), 0))
+        fraction = self.fractions[rung]
+        return [Trial(point, fraction, self.seed + rung) for point in self._candidates]
+
+    def tell(self, trials: List[Trial]) -> None:
+        super().tell(trials)
+        last = len(self.rungs) == len(self.fractions) - 1
+        keep = len(trials) if last else max(1, math.ceil(len(trials) / self.eta))
+        warm = {point_key(p) for p in self.warm_start}
+        ranked = sorted(trials, key=lambda t: t.score or 0.0, reverse=True)
+        promoted = {point_key(t.point) for t in ranked[:keep]} | warm
+        # Warm start first, so the final rung starts with the rule's current parameters
+        self._candidates = [t.point for t in trials if point_key(t.point) in promoted]
+        self.rungs.append({'fraction': trials[0].fraction if trials else self.fractions[len(self.rungs)],
+                           'candidates': len(trials),
+                           'best_score': ranked[0].score if ranked else None})
+
+    def summary(self) -> Dict[str, Any]:
+        return {**super().summary(), 'eta': self.eta, 'rungs': self.rungs}
+
+
+class ModelBasedSearch(SearchStrategy):
+    """Sequential model-based (Bayesian) search with a budget of `budget` experiments.
+
+    An initial design of the warm start and random candidates is followed by
+    rounds of `batch_size` proposals: the random pool candidates of highest
+    expected improvement under a Gaussian process fitted to all scores so far.
+    """
+
+    name = "bayes"
+
+    def __init__(self, *args, initial: Optional[int] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.initial = min(self.budget, initial if initial is not None else max(5, self.budget // 4, self.batch_size))
+        self.rounds = 0
+
+    def ask(self) -> List[Trial]:
+        remaining = self.budget - len(self.trials)
+        if remaining <= 0:
+            return []
+        if not self.trials:
+            points = self.warm_start[:self.budget]
+            points += self._random_points(max(self.initial - len(points), 0))
+        else:
+            points = self._propose(min(self.batch_size, remaining))
+        self.rounds += 1
+        return [Trial(point) for point in points]
+
+    def _propose(self, count: int) -> List[Dict[str, Any]]:
+        """The `count` pool candidates of highest expected improvement."""
+        pool = self._random_points(CANDIDATE_POOL)
+        if len(pool) <= count:
+            return pool
+        X = np.array([self.space.encode(self.rule_config, t.point) for t in self.trials])
+        y = np.array([t.score or 0.0 for t in self.trials])
+        kernel = ConstantKernel(1.0) * Matern(length_scale=np.full(X.shape[1], 0.3), nu=2.5) + WhiteKernel(1e-3)
+        model = GaussianProcessRegressor(kernel=kernel, normalize_y=True, random_state=self.seed)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            model.fit(X, y)
+            mean, std = model.predict(np.array([self.space.encode(self.rule_config, p) for p in pool]),
+                                      return_std=True)
+        improvement = mean - y.max()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z = np.where(std > 0, improvement / std, 0.0)
+        expected = np.where(std > 0, improvement * norm.cdf(z) + std * norm.pdf(z), 0.0)
+        chosen = [pool[i] for i in np.argsort(-expected)[:count]]
+        # Unchosen pool points may be proposed in a later round
+        self._seen -= {point_key(p) for p in pool} - {point_key(p) for p in chosen}
+        return chosen
+
+    def summary(self) -> Dict[str, Any]:
+        return {**super().summary(), 'initial': self.initial, 'rounds': self.rounds}
+
+
+def create_strategy(name: str, space: SearchSpace, rule_config: RuleConfig, budget: Optional[int] = None,
+                    warm_start: Optional[List[Dict[str, Any]]] = None, seed: int = 42,
+                    batch_size: int = 1) -> SearchStrategy:
+    """Strategy by name ("random", "halving" or "bayes"; "grid" is the optimizer's own combinations)."""
+    strategies = {'random': RandomSearch, 'halving': SuccessiveHalving, 'bayes': ModelBasedSearch}
+    if name not in strategies:
+        raise ValueError(f"Unknown search strategy: {name} (expected one of {', '.join(STRATEGIES)})")
+    return strategies[name](space, rule_config, budget or DEFAULT_BUDGET, warm_start, seed, batch_size)
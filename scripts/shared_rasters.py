@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Shared-Memory Raster Registry
+
+When rules run in worker processes (PipelineRunner with --workers), each
+worker would otherwise read and decode the same baseline/candidate rasters
+again. Instead the parent loads every unique raster band once into a named
+multiprocessing.shared_memory block, and hands the workers a small picklable
+descriptor per band (block name, shape, dtype, source path/mtime and raster
+metadata). Workers attach read-only NumPy views and pin them into their
+process raster cache (raster_cache.RasterMemoryCache.pin), so the usual
+RasterProcessor.load_raster calls are served from shared memory and
+per-worker memory stays flat as workers are added.
+
+Blocks are reference-counted: every publish() of a band takes a reference
+and release() drops it, so a caller can free a rule's inputs as soon as the
+rule is done while another rule still reading the same band keeps it (the
+last release unlinks the block; workers close their own attachments with
+detach_all() after each task).
+
+Cleanup: the registry unlinks its remaining blocks on close() (also used as
+a context manager and registered with atexit). If the parent dies without cleaning up,
+Python's resource tracker unlinks the blocks on POSIX, and Windows frees them
+once the last process holding a view exits. Workers only attach; their views
+disappear with them.
+"""
+
+import os
+import atexit
+import logging
+import threading
+import numpy as np
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from raster_cache import RasterMemoryCache, process_raster_cache
+
+
+logger = logging.getLogger(__name__)
+
+# Attached blocks of this (worker) process; views are only valid while the block object is alive
+_attached: Dict[str, shared_memory.SharedMemory] = {}
+
+
+@dataclass
+class SharedRasterDescriptor:
+    """Everything a worker needs to attach one published raster band."""
+    name: str
+    path: str
+    band: int
+    mtime_ns: int
+    shape: Tuple[int, ...]
+    dtype: str
+    meta: Dict[str, Any]
+
+    @property
+    def nbytes(self) -> int:
+        return int(np.prod(self.shape)) * np.dtype(self.dtype).itemsize
+
+
+class SharedRasterRegistry:
+    """Parent side: loads raster bands once into shared memory blocks."""
+
+    def __init__(self):
+        self._blocks: Dict[Tuple[str, int, int], Tuple[shared_memory.SharedMemory, SharedRasterDescriptor]] = {}
+        self._refs: Dict[Tuple[str, int, int], int] = {}
+        # release() may be called from a future's done callback, in the executor's thread
+        self._lock = threading.Lock()
+        self.published = 0
+        self.published_bytes = 0
+        self.peak_bytes = 0
+        self.logger = logging.getLogger(__name__)
+        atexit.register(self.close)
+
+    def publish(self, filepath: str, loader: Callable[[str, int], Tuple[np.ndarray, Dict[str, Any]]],
+                band: int = 1) -> SharedRasterDescriptor:
+        """Copy a raster band into shared memory (once per file version and band while it is held).
+
+        Every call takes a reference on the block, dropped by release().
+
+        Args:
+            filepath: Raster file
+            loader: Reads (data, meta) for a path and band, e.g. RasterProcessor.read_raster
+            band: Band number
+        """
+        path = os.path.abspath(filepath)
+        key = (path, os.stat(path).st_mtime_ns, band)
+        with self._lock:
+            if key in self._blocks:
+                self._refs[key] += 1
+                return self._blocks[key][1]
+
+        data, meta = loader(filepath, band)
+        block = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+        try:
+            np.ndarray(data.shape, dtype=data.dtype, buffer=block.buf)[...] = data
+        except BaseException:
+            block.close()
+            block.unlink()
+            raise
+        descriptor = SharedRasterDescriptor(block.name, path, band, key[1], tuple(data.shape), data.dtype.str, meta)
+        with self._lock:
+            self._blocks[key] = (block, descriptor)
+            self._refs[key] = 1
+            self.published += 1
+            self.published_bytes += descriptor.nbytes
+            self.peak_bytes = max(self.peak_bytes, self._held_bytes())
+        return descriptor
+
+    def release(self, descriptors: List[SharedRasterDescriptor]) -> None:
+        """Drop one reference per descriptor; blocks left without references are unlinked."""
+        freed = []
+        with self._lock:
+            for descriptor in descriptors:
+                key = (descriptor.path, descriptor.mtime_ns, descriptor.band)
+                if key not in self._refs:
+                    continue
+                self._refs[key] -= 1
+                if self._refs[key] == 0:
+                    del self._refs[key]
+                    freed.append(self._blocks.pop(key))
+        for block, descriptor in freed:
+            self._free(block, descriptor)
+
+    def descriptors(self) -> List[SharedRasterDescriptor]:
+        with self._lock:
+            return [descriptor for _, descriptor in self._blocks.values()]
+
+    def _held_bytes(self) -> int:
+        return sum(descriptor.nbytes for _, descriptor in self._blocks.values())
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes currently held in shared memory."""
+        with self._lock:
+            return self._held_bytes()
+
+    def _free(self, block: shared_memory.SharedMemory, descriptor: SharedRasterDescriptor) -> None:
+        try:
+            try:
+                block.close()
+            except BufferError:
+                # A view is still alive in this process; unlinking still frees the name
+                pass
+            block.unlink()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            self.logger.warning(f"Could not release shared raster {descriptor.path}: {e}")
+
+    def close(self) -> None:
+        """Release and unlink every block, whatever its references (idempotent)."""
+        with self._lock:
+            blocks = list(self._blocks.values())
+            self._blocks.clear()
+            self._refs.clear()
+        for block, descriptor in blocks:
+            self._free(block, descriptor)
+
+    def __enter__(self) -> "SharedRasterRegistry":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def attach(descriptor: SharedRasterDescriptor) -> np.ndarray:
+    """Read-only view of a published band; the block stays attached until detach_all()."""
+    block = _attached.get(descriptor.name)
+    if block is None:
+        # Workers are started by the registry's process, so they share its resource
+        # tracker: attaching adds no registration that could unlink the block early
+        block = shared_memory.SharedMemory(name=descriptor.name)
+        _attached[descriptor.name] = block
+    view = np.ndarray(descriptor.shape, dtype=np.dtype(descriptor.dtype), buffer=block.buf)
+    view.setflags(write=False)
+    return view
+
+
+def attach_shared_rasters(descriptors: List[SharedRasterDescriptor],
+                          cache: Optional[RasterMemoryCache] = None) -> int:
+    """Pin every published band into the (process) raster cache; returns the number attached.
+
+    Called by PipelineRunner workers at the start of each task (and detached
+    with detach_all() after it), and by the optimizer's pool initializer. A
+    band that can no longer be attached is skipped and simply loaded from
+    disk on demand.
+    """
+    cache = cache or process_raster_cache()
+    attached = 0
+    for descriptor in descriptors:
+        try:
+            cache.pin(descriptor.path, descriptor.band, descriptor.mtime_ns, attach(descriptor), descriptor.meta)
+            attached += 1
+        except FileNotFoundError:
+            logger.warning(f"Shared raster {descriptor.name} is gone; {descriptor.path} will be read from disk")
+    return attached
+
+
+def detach_all(cache: Optional[RasterMemoryCache] = None) -> None:
+    """Drop the pinned views and close this process's attachments."""
+    (cache or process_raster_cache()).unpin_all()
+    while _attached:
+        _, block = _attached.popitem()
+        try:
+            block.close()
+        except BufferError:
+            # A caller still holds a view; the mapping goes away with the process
+            pass
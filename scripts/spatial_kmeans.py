@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Spatial K-Means
+
+Multi-feature k-means over raster pixels, using (x, y, feature...) vectors
+such as DEPTH2D + SPEED2D + CUMINF2D plus map coordinates. The model is
+fitted on a bounded pixel sample (stratified over a spatial grid, or uniform
+random) with MiniBatchKMeans, and labels are then predicted in row chunks,
+so cost is bounded by the sample size and chunk size rather than the raster.
+"""
+
+import logging
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.preprocessing import StandardScaler
+from typing import Any, Dict, List, Optional
+from label_stats import label_dtype, NODATA
+
+
+DEFAULT_SAMPLE_SIZE = 200_000
+DEFAULT_CHUNK_ROWS = 512
+STRATUM_SIZE = 64  # edge length in pixels of the sampling strata
+
+
+class SpatialKMeans:
+    """Sample-fit / chunked-predict k-means over pixel feature vectors."""
+
+    def __init__(self, k: int, sample_size: int = DEFAULT_SAMPLE_SIZE, sampling: str = "stratified",
+                 use_coordinates: bool = True, coordinate_weight: float = 1.0,
+                 chunk_rows: int = DEFAULT_CHUNK_ROWS, max_iter: int = 100, random_seed: int = 42):
+        if sampling not in ("stratified", "random"):
+            raise ValueError(f"Unknown sampling '{sampling}' (expected 'stratified' or 'random')")
+        self.k = int(k)
+        self.sample_size = int(sample_size)
+        self.sampling = sampling
+        self.use_coordinates = use_coordinates
+        self.coordinate_weight = float(coordinate_weight)
+        self.chunk_rows = int(chunk_rows)
+        self.max_iter = int(max_iter)
+        self.random_seed = random_seed
+        self.logger = logging.getLogger(__name__)
+        self.scaler: Optional[StandardScaler] = None
+        self.model: Optional[MiniBatchKMeans] = None
+
+    @classmethod
+    def from_params(cls, params: Dict[str, Any]) -> "SpatialKMeans":
+        """Build from a rule's clustering block."""
+        return cls(
+            k=params.get('k', 5),
+            sample_size=params.get('sample_size', DEFAULT_SAMPLE_SIZE),
+            sampling=params.get('sampling', 'stratified'),
+            use_coordinates=params.get('use_coordinates', True),
+            coordinate_weight=params.get('coordinate_weight', 1.0),
+            chunk_rows=params.get('chunk_rows', DEFAULT_CHUNK_ROWS),
+            max_iter=params.get('max_iter', 100),
+            random_seed=params.get('random_seed', 42)
+        )
+
+    def _vectors(self, features: List[np.ndarray], rows: np.ndarray, cols: np.ndarray,
+                 transform) -> np.ndarray:
+        """Feature vectors (x, y, f1, f2, ...) for the given pixels."""
+        columns = []
+        if self.use_coordinates:
+            xs, ys = transform * (cols + 0.5, rows + 0.5)
+            columns.extend([np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64)])
+        columns.extend(np.asarray(f[rows, cols], dtype=np.float64) for f in features)
+        return np.column_stack(columns)
+
+    def _scale(self, vectors: np.ndarray) -> np.ndarray:
+        scaled = self.scaler.transform(vectors)
+        if self.use_coordinates and self.coordinate_weight != 1.0:
+            scaled[:, :2] *= self.coordinate_weight
+        return scaled
+
+    def _sample(self, mask: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        """Flat indices of sampled pixels from `mask`."""
+        idx = np.flatnonzero(mask)
+        if len(idx) <= self.sample_size:
+            return idx
+        if self.sampling == "random":
+            return np.sort(rng.choice(idx, self.sample_size, replace=False))
+
+        # Stratified: sample each spatial block in proportion to its pixel count (at least one)
+        width = mask.shape[1]
+        rows, cols = np.divmod(idx, width)
+        blocks_x = (width + STRATUM_SIZE - 1) // STRATUM_SIZE
+        strata = (rows // STRATUM_SIZE) * blocks_x + cols // STRATUM_SIZE
+        order = np.lexsort((rng.random(len(idx)), strata))
+        sorted_strata = strata[order]
+        starts = np.flatnonzero(np.r_[True, sorted_strata[1:] != sorted_strata[:-1]])
+        counts = np.diff(np.r_[starts, len(idx)])
+        quota = np.ceil(counts * (self.sample_size / len(idx))).astype(np.int64)
+        rank = np.arange(len(idx)) - np.repeat(starts, counts)
+        return np.sort(idx[order[rank < np.repeat(quota, counts)]])
+
+    def fit_predict(self, features: List[np.ndarray], mask: np.ndarray, transform,
+                    valid: Optional[np.ndarray] = None) -> np.ndarray:
+        """Cluster the pixels of `mask` by their feature vectors.
+
+        Args:
+            features: Feature rasters, all shaped like `mask`
+            mask: Pixels to cluster
+            transform: Affine transform of the rasters (for x, y coordinates)
+            valid: Valid-data mask; pixels outside it are set to nodata (-9999)
+
+        Returns:
+            Label raster: clusters 1..k, 0 for unclustered pixels, -9999 for nodata
+        """
+        mask = mask if valid is None else mask & valid
+        n = int(np.count_nonzero(mask))
+        k = min(self.k, n)
+        labels = np.zeros(mask.shape, dtype=label_dtype(max(k, 1)))
+        if valid is not None:
+            labels[~valid] = NODATA
+        if k == 0:
+            return labels
+
+        rng = np.random.default_rng(self.random_seed)
+        sample = self._sample(mask, rng)
+        sample_rows, sample_cols = np.divmod(sample, mask.shape[1])
+        vectors = self._vectors(features, sample_rows, sample_cols, transform)
+        self.scaler = StandardScaler().fit(vectors)
+        self.model = MiniBatchKMeans(n_clusters=k, batch_size=min(4096, len(sample)), max_iter=self.max_iter,
+                                     n_init=3, random_state=self.random_seed)
+        self.model.fit(self._scale(vectors))
+        self.logger.info(f"Spatial k-means: fitted k={k} on {len(sample)} of {n} pixels "
+                         f"({vectors.shape[1]} dimensions, {self.sampling} sampling)")
+
+        # Predict labels chunk by chunk to bound the size of the feature matrix
+        for row0 in range(0, mask.shape[0], self.chunk_rows):
+            chunk = mask[row0:row0 + self.chunk_rows]
+            rows, cols = np.nonzero(chunk)
+            if len(rows) == 0:
+                continue
+            rows = rows + row0
+            predicted = self.model.predict(self._scale(self._vectors(features, rows, cols, transform)))
+            labels[rows, cols] = predicted + 1
+        return labels
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Stage Cache
+
+Content-addressed disk cache of the intermediate outputs of a rule's stages:
+the derived value raster (delta, hazard index), the threshold mask, the label
+raster and the extracted clusters (polygons and metrics).
+
+An entry's key is a SHA-256 of the stage name, the fingerprints of its inputs
+(raster files: absolute path, mtime and size, as for the raster file cache;
+or the key of an upstream stage) and the exact stage parameters (threshold,
+clustering block, ...) as canonical JSON. Changing an input or a parameter
+addresses a different entry, so nothing is ever invalidated: a re-run after a
+small rule edit reuses every stage the edit does not reach, and optimizer
+experiments that only differ in clustering share their delta and mask.
+STAGE_CACHE_VERSION is part of every key; bump it when a stage's algorithm
+changes its output.
+
+StageMemo is an in-process layer in front of it: within an optimizer run
+every node of the rule's stage tree (value raster -> threshold mask ->
+connected components -> min-size filtered labels -> clusters) is computed
+or loaded once and then served from memory to every parameter combination
+that shares it, also when the disk cache is disabled.
+
+Arrays are stored as compressed .npz files (masks and label rasters are
+mostly constant and shrink to a small fraction of their size), everything
+else as JSON in the entry's sidecar, which is written last and marks the
+entry as complete. The directory is kept under max_bytes by evicting the
+least recently used entries (sidecar mtime is the access marker).
+Layout: <cache_dir>/<key>.json [+ <key>.npz]
+"""
+
+import os
+import json
+import hashlib
+import logging
+import numpy as np
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+STAGE_CACHE_VERSION = 2
+DEFAULT_STAGE_CACHE_BYTES = 5 * 1024 ** 3  # 5 GB
+DEFAULT_STAGE_MEMO_BYTES = 1024 ** 3  # 1 GB
+STAGE_COUNTERS = ('hits', 'misses', 'writes', 'evictions', 'bytes_read', 'bytes_written')
+
+
+def file_fingerprint(filepath: str) -> str:
+    """Fingerprint of an input file: absolute path, mtime and size."""
+    st = os.stat(filepath)
+    return f"{os.path.abspath(filepath)}|{st.st_mtime_ns}|{st.st_size}"
+
+
+def stage_key(stage: str, inputs: List[str], params: Dict[str, Any]) -> str:
+    """Entry key of a stage for input fingerprints and parameters."""
+    document = json.dumps({'version': STAGE_CACHE_VERSION, 'stage': stage, 'inputs': list(inputs),
+                           'params': params}, sort_keys=True, default=str)
+    return hashlib.sha256(document.encode('utf-8')).hexdigest()
+
+
+class StageCache:
+    """Size-bounded, content-addressed disk cache of stage outputs."""
+
+    def __init__(self, cache_dir: str = "data/output/.cache/stages",
+                 max_bytes: int = DEFAULT_STAGE_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.logger = logging.getLogger(__name__)
+        os.makedirs(cache_dir, exist_ok=True)
+        self.reset_counters()
+
+    def reset_counters(self) -> None:
+        self.counters = {name: 0 for name in STAGE_COUNTERS}
+        self.stages: Dict[str, Dict[str, int]] = {}
+
+    def key(self, stage: str, inputs: List[str], params: Dict[str, Any]) -> str:
+        """Entry key of a stage for input fingerprints and parameters (see stage_key)."""
+        return stage_key(stage, inputs, params)
+
+    def _paths(self, key: str) -> Tuple[str, str]:
+        base = os.path.join(self.cache_dir, key)
+        return base + ".json", base + ".npz"
+
+    def _count(self, stage: str, outcome: str) -> None:
+        self.counters[outcome] += 1
+        per_stage = self.stages.setdefault(stage, {'hits': 0, 'misses': 0})
+        per_stage[outcome] += 1
+
+    def load(self, key: str, stage: str) -> Optional[Tuple[Dict[str, np.ndarray], Any]]:
+        """(arrays, payload) of an entry, or None on a miss."""
+        sidecar_path, arrays_path = self._paths(key)
+        try:
+            with open(sidecar_path, 'r', encoding='utf-8') as f:
+                sidecar = json.load(f)
+            arrays = {}
+            if sidecar.get('arrays'):
+                with np.load(arrays_path, allow_pickle=False) as npz:
+                    arrays = {name: npz[name] for name in sidecar['arrays']}
+                self.counters['bytes_read'] += os.path.getsize(arrays_path)
+            # Touch the sidecar: its mtime is the LRU access marker
+            os.utime(sidecar_path, None)
+        except FileNotFoundError:
+            self._count(stage, 'misses')
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            self.logger.warning(f"Discarding unreadable stage cache entry {sidecar_path}: {e}")
+            self._remove(key)
+            self._count(stage, 'misses')
+            return None
+        self._count(stage, 'hits')
+        return arrays, sidecar.get('payload')
+
+    def store(self, key: str, stage: str, arrays: Dict[str, np.ndarray], payload: Any = None) -> None:
+        """Write an entry (arrays first, sidecar last, both atomically) and evict down to max_bytes."""
+        sidecar_path, arrays_path = self._paths(key)
+        tmp_suffix = f".{os.getpid()}.tmp"
+        try:
+            if arrays:
+                with open(arrays_path + tmp_suffix, 'wb') as f:
+                    np.savez_compressed(f, **arrays)
+                os.replace(arrays_path + tmp_suffix, arrays_path)
+                self.counters['bytes_written'] += os.path.getsize(arrays_path)
+            with open(sidecar_path + tmp_suffix, 'w', encoding='utf-8') as f:
+                json.dump({'stage': stage, 'arrays': sorted(arrays), 'payload': payload}, f)
+            os.replace(sidecar_path + tmp_suffix, sidecar_path)
+        except (OSError, TypeError, ValueError) as e:
+            # A cache that cannot be written must not fail the stage
+            self.logger.warning(f"Could not write stage cache entry {key} ({stage}): {e}")
+            for path in (arrays_path + tmp_suffix, sidecar_path + tmp_suffix):
+                if os.path.exists(path):
+                    os.remove(path)
+            return
+        self.counters['writes'] += 1
+        try:
+            self.evict(keep=key)
+        except OSError as e:
+            # Nor may a cache that cannot be trimmed; the next store tries again
+            self.logger.warning(f"Could not evict stage cache entries: {e}")
+
+    def get_or_compute(self, stage: str, inputs: List[str], params: Dict[str, Any],
+                       compute: Callable[[], Tuple[Dict[str, np.ndarray], Any]]
+                       ) -> Tuple[Dict[str, np.ndarray], Any]:
+        """(arrays, payload) of a stage from the cache, computing and storing it on a miss."""
+        key = self.key(stage, inputs, params)
+        entry = self.load(key, stage)
+        if entry is not None:
+            return entry
+        arrays, payload = compute()
+        self.store(key, stage, arrays, payload)
+        return arrays, payload
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        """(last access, size, key) of every complete entry.
+
+        Workers share the directory, so a file removed between the listing and
+        its stat is skipped.
+        """
+        sizes: Dict[str, int] = {}
+        accessed: Dict[str, float] = {}
+        for entry in os.scandir(self.cache_dir):
+            key, ext = os.path.splitext(entry.name)
+            if ext not in ('.json', '.npz'):
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            sizes[key] = sizes.get(key, 0) + st.st_size
+            if ext == '.json':
+                accessed[key] = st.st_mtime
+        return [(accessed[key], sizes[key], key) for key in accessed]
+
+    def size_bytes(self) -> int:
+        """Total size of cached entries."""
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, keep: Optional[str] = None) -> int:
+        """Remove least recently used entries until the cache fits in max_bytes.
+
+        Args:
+            keep: Key that must not be evicted (the entry just written)
+
+        Returns:
+            Number of entries removed
+        """
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            if self._remove(key):
+                total -= size
+                removed += 1
+
+        if removed:
+            self.counters['evictions'] += removed
+            self.logger.info(f"Evicted {removed} stage cache entries ({total / 1024 ** 2:.1f} MB in cache)")
+        return removed
+
+    def _remove(self, key: str) -> bool:
+        # Sidecar first: without it the entry is a miss even if the arrays remain
+        try:
+            for path in self._paths(key):
+                if os.path.exists(path):
+                    os.remove(path)
+            return True
+        except OSError as e:
+            # Entry may be open in another process (Windows); try again later
+            self.logger.debug(f"Could not evict stage cache entry {key}: {e}")
+            return False
+
+    def clear(self) -> None:
+        """Remove every entry."""
+        for _, _, key in self._entries():
+            self._remove(key)
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters since the last reset, overall and per stage, with hit rates."""
+        lookups = self.counters['hits'] + self.counters['misses']
+        stages = {}
+        for stage, counts in sorted(self.stages.items()):
+            stage_lookups = counts['hits'] + counts['misses']
+            stages[stage] = {**counts, 'hit_rate': counts['hits'] / stage_lookups if stage_lookups else 0.0}
+        return {
+            **self.counters,
+            'hit_rate': self.counters['hits'] / lookups if lookups else 0.0,
+            'stages': stages,
+            'max_bytes': self.max_bytes
+        }
+
+
+class StageMemo:
+    """In-process, size-bounded LRU of stage entries, keyed like StageCache.
+
+    Arrays are handed out read-only: every consumer of a node sees the same
+    array, so none may modify it in place.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_STAGE_MEMO_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[Dict[str, np.ndarray], Any, int]]" = OrderedDict()
+        self._bytes = 0
+        self.reset_counters()
+
+    def reset_counters(self) -> None:
+        self.nodes: Dict[str, Dict[str, int]] = {}
+
+    def get(self, key: str, stage: str) -> Optional[Tuple[Dict[str, np.ndarray], Any]]:
+        """(arrays, payload) of a node, or None if it has not been computed yet."""
+        counts = self.nodes.setdefault(stage, {'computed': 0, 'reused': 0})
+        entry = self._entries.get(key)
+        if entry is None:
+            counts['computed'] += 1
+            return None
+        self._entries.move_to_end(key)
+        counts['reused'] += 1
+        return entry[0], entry[1]
+
+    def put(self, key: str, arrays: Dict[str, np.ndarray], payload: Any = None) -> None:
+        """Keep a node, evicting least recently used ones above max_bytes."""
+        for array in arrays.values():
+            array.setflags(write=False)
+        size = sum(array.nbytes for array in arrays.values())
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)[2]
+        self._entries[key] = (arrays, payload, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, (_, _, evicted) = self._entries.popitem(last=False)
+            self._bytes -= evicted
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+        self.reset_counters()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Nodes computed (or loaded from disk) and reused from memory, per stage."""
+        return {stage: dict(counts) for stage, counts in sorted(self.nodes.items())}
+
+
+def combine_node_stats(stats: List[Dict[str, Dict[str, int]]]) -> Dict[str, Dict[str, int]]:
+    """Sum StageMemo.stats() reported by several processes."""
+    combined: Dict[str, Dict[str, int]] = {}
+    for entry in stats:
+        for stage, counts in entry.items():
+            merged = combined.setdefault(stage, {'computed': 0, 'reused': 0})
+            merged['computed'] += counts['computed']
+            merged['reused'] += counts['reused']
+    return dict(sorted(combined.items()))
+
+
+def combine_stage_stats(stats: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Sum stage cache counters reported by several processes; hit rates are recomputed."""
+    combined = {name: sum(entry.get(name, 0) for entry in stats) for name in STAGE_COUNTERS}
+    lookups = combined['hits'] + combined['misses']
+    combined['hit_rate'] = combined['hits'] / lookups if lookups else 0.0
+    stages: Dict[str, Dict[str, Any]] = {}
+    for entry in stats:
+        for stage, counts in entry.get('stages', {}).items():
+            merged = stages.setdefault(stage, {'hits': 0, 'misses': 0})
+            merged['hits'] += counts['hits']
+            merged['misses'] += counts['misses']
+    for counts in stages.values():
+        stage_lookups = counts['hits'] + counts['misses']
+        counts['hit_rate'] = counts['hits'] / stage_lookups if stage_lookups else 0.0
+    combined['stages'] = dict(sorted(stages.items()))
+    combined['max_bytes'] = stats[0].get('max_bytes') if stats else None
+    return combined
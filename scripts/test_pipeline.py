@@ -10,6 +10,19 @@ import json
 from rule_parser import RuleParser
 
 
+def write_test_raster(path, data):
+    """Write `data` as a single-band float32 GeoTIFF with 1 m cells and nodata -9999, creating its directory."""
+    import numpy as np
+    import rasterio
+    from rasterio.transform import from_origin
+    
+    data = np.asarray(data, dtype=np.float32)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with rasterio.open(path, 'w', driver='GTiff', height=data.shape[0], width=data.shape[1], count=1,
+                       dtype='float32', transform=from_origin(0, data.shape[0], 1, 1), nodata=-9999) as dst:
+        dst.write(data, 1)
+
+
 def test_rule_parsing():
     """Test rule parsing functionality."""
     print("=== Testing Rule Parsing ===")
@@ -124,6 +137,1172 @@ def test_directory_structure():
         return False
 
 
+def test_label_statistics():
+    """Test single-pass labeled statistics against per-label masks."""
+    print("=== Testing Labeled Statistics ===")
+    
+    import numpy as np
+    from label_stats import compute_label_statistics
+    
+    rng = np.random.default_rng(0)
+    labels = rng.integers(0, 6, size=(40, 50))
+    labels[:3] = -9999
+    values = rng.random((40, 50))
+    
+    stats = compute_label_statistics(labels, values)
+    assert list(stats.labels) == [1, 2, 3, 4, 5]
+    for i, label_id in enumerate(stats.labels):
+        mask = labels == label_id
+        rows, cols = np.where(mask)
+        assert stats.count[i] == mask.sum()
+        assert np.isclose(stats.mean[i], values[mask].mean())
+        assert np.isclose(stats.std[i], values[mask].std())
+        assert stats.min[i] == values[mask].min() and stats.max[i] == values[mask].max()
+        assert np.isclose(stats.centroid_row[i], rows.mean())
+        assert np.isclose(stats.centroid_col[i], cols.mean())
+        assert stats.slices[i] == (slice(rows.min(), rows.max() + 1), slice(cols.min(), cols.max() + 1))
+    
+    print(f"Labeled statistics match for {len(stats)} labels")
+    return True
+
+
+def test_small_component_filter():
+    """Test vectorized small-component removal and consecutive relabeling."""
+    print("=== Testing Small Component Filter ===")
+    
+    import numpy as np
+    from label_stats import filter_small_labels
+    
+    labels = np.array([[1, 1, 0, 2],
+                       [1, 0, 0, 3],
+                       [0, 4, 4, 3],
+                       [4, 4, 4, 3]], dtype=np.int32)
+    
+    relabeled, n_kept = filter_small_labels(labels, 4, 3)
+    expected = np.array([[1, 1, 0, 0],
+                         [1, 0, 0, 2],
+                         [0, 3, 3, 2],
+                         [3, 3, 3, 2]])
+    assert n_kept == 3
+    assert relabeled.dtype == np.int16
+    assert np.array_equal(relabeled, expected)
+    
+    print(f"Kept {n_kept} of 4 components")
+    return True
+
+
+def test_tiled_labeling():
+    """Test that tiled labeling merges components across tile seams."""
+    print("=== Testing Tiled Labeling ===")
+    
+    import tempfile
+    import numpy as np
+    from scipy.ndimage import label
+    from tiled_labeling import TiledLabeler
+    
+    rng = np.random.default_rng(0)
+    data = (rng.random((60, 70)) > 0.45).astype(np.float32)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "DEPTH2D_00000.tif")
+        write_test_raster(path, data)
+        
+        labeler = TiledLabeler(tile_size=16, work_dir=tmp)
+        result = labeler.label({'main': path}, lambda a: (a['main'] > 0, a['main'], a['main'] != -9999), min_size=3)
+        tiled = np.array(result.labels)
+        result.close()
+    
+    reference, n = label(data > 0)
+    sizes = np.bincount(reference.ravel())
+    kept = [i for i in range(1, n + 1) if sizes[i] >= 3]
+    assert len(result.stats) == len(kept)
+    assert np.array_equal(tiled > 0, np.isin(reference, kept))
+    # Every reference component maps to exactly one tiled label
+    pairs = set(zip(reference[tiled > 0].tolist(), tiled[tiled > 0].tolist()))
+    assert len(pairs) == len(kept)
+    
+    print(f"Tiled labeling produced {len(kept)} components across seams")
+    return True
+
+
+def test_raster_catalog():
+    """Test catalog indexing, layout preference and incremental updates."""
+    print("=== Testing Raster Catalog ===")
+    
+    import tempfile
+    import numpy as np
+    from raster_catalog import RasterCatalog
+    
+    def write(path):
+        write_test_raster(path, np.zeros((4, 5), dtype=np.float32))
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = os.path.join(tmp, "rasters", "sim_1")
+        structured = os.path.join(tmp, "db", "grp", "run", "sim_1")
+        write(os.path.join(legacy, "DEPTH2D_00000.tif"))
+        write(os.path.join(structured, "DEPTH2D_00001.tif"))
+        write(os.path.join(structured, "DEPTH2D_00000.tif"))
+        
+        catalog = RasterCatalog(tmp)
+        assert catalog.refresh() == 1  # only the legacy layout is recognised here
+        assert catalog.sim_directory(1) == os.path.abspath(legacy)
+        
+        newest = os.path.join(tmp, "raster", "db", "grp", "run", "sim_1")
+        write(os.path.join(newest, "DEPTH2D_00001.tif"))
+        write(os.path.join(newest, "DEPTH2D_00000.tif"))
+        assert catalog.index_directory(newest) == 2
+        assert catalog.index_directory(newest) == 0  # unchanged files are skipped
+        rows = catalog.find(1, "DEPTH2D", newest)
+        assert [r['timestep'] for r in rows] == ["00000", "00001"]
+        assert rows[0]['database'] == "db" and rows[0]['grp'] == "grp" and rows[0]['run'] == "run"
+        assert (rows[0]['height'], rows[0]['width']) == (4, 5)
+        assert catalog.sim_directory(1) == os.path.abspath(newest)
+        
+        os.remove(os.path.join(newest, "DEPTH2D_00001.tif"))
+        catalog.index_directory(newest)
+        assert len(catalog.find(1, "DEPTH2D", newest)) == 1
+        
+        # Rasters written to an indexed sim directory outside the export hook are found on lookup
+        from cluster_processor import RasterProcessor
+        write(os.path.join(newest, "VELOCITY2D_00000.tif"))
+        write(os.path.join(newest, "DEPTH2D_00010.tif"))
+        processor = RasterProcessor(tmp, use_cache=False)
+        cubes = processor.get_raster_cubes(1, ["DEPTH2D", "VELOCITY2D"])
+        assert set(cubes) == {"DEPTH2D", "VELOCITY2D"}
+        assert processor.get_raster_files(1, ["DEPTH2D"])["DEPTH2D"].endswith("DEPTH2D_00010.tif")
+        # ...and so is a timestep the catalog does not have yet
+        write(os.path.join(newest, "DEPTH2D_00020.tif"))
+        assert processor.get_raster_files(1, ["DEPTH2D"], 2)["DEPTH2D"].endswith("DEPTH2D_00020.tif")
+    
+    print("Raster catalog indexed and resolved layouts correctly")
+    return True
+
+
+def test_raster_caches():
+    """Test the .npy file cache and the in-memory LRU: invalidation, eviction, read-only arrays, counters."""
+    print("=== Testing Raster Caches ===")
+    
+    import tempfile
+    import numpy as np
+    from raster_cache import RasterFileCache, RasterMemoryCache
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "DEPTH2D_00000.tif")
+        write_test_raster(path, np.full((4, 5), 1.0))
+        cache = RasterFileCache(os.path.join(tmp, "cache"))
+        data, meta = cache.load(path)
+        assert data[0, 0] == 1.0 and meta['width'] == 5 and not data.flags.writeable
+        cache.load(path)
+        assert cache.stats() == {'hits': 1, 'conversions': 1}
+        
+        # A new mtime or size is a new version: converted again, the mapped old one left untouched
+        mtime = os.stat(path).st_mtime_ns
+        write_test_raster(path, np.full((4, 5), 2.0))
+        os.utime(path, ns=(mtime + 10 ** 9, mtime + 10 ** 9))
+        fresh, _ = cache.load(path)
+        assert fresh[0, 0] == 2.0 and data[0, 0] == 1.0 and cache.conversions == 2
+        write_test_raster(path, np.full((6, 5), 3.0))  # size change
+        os.utime(path, ns=(mtime + 10 ** 9, mtime + 10 ** 9))
+        assert cache.load(path)[0].shape == (6, 5) and cache.conversions == 3
+        del data, fresh
+        assert len([n for n in os.listdir(cache.cache_dir) if n.endswith('.npy')]) == 1
+        
+        # LRU eviction under max_bytes: the least recently used entry goes first
+        small = RasterFileCache(os.path.join(tmp, "small"), max_bytes=2 * (4 * 5 * 4 + 128))
+        paths = [os.path.join(tmp, f"SPEED2D_0000{i}.tif") for i in range(3)]
+        for i, other in enumerate(paths):
+            write_test_raster(other, np.full((4, 5), float(i)))
+            small.load(other)
+            os.utime(small._paths(small._key(other, 1), {'mtime_ns': os.stat(other).st_mtime_ns,
+                                                          'size': os.stat(other).st_size})[0], (i, i))
+        assert small.size_bytes() <= small.max_bytes
+        remaining = sorted(n.split('_')[1] for n in os.listdir(small.cache_dir) if n.endswith('.npy'))
+        assert remaining == ["00001", "00002"]
+        
+        # An entry removed by another worker between listing and stat is skipped
+        class Vanished:
+            name, path = "gone.npy", os.path.join(small.cache_dir, "gone.npy")
+            
+            def stat(self):
+                raise FileNotFoundError(self.path)
+        
+        scandir = os.scandir
+        os.scandir = lambda directory: list(scandir(directory)) + [Vanished()]
+        try:
+            assert small.evict() == 0 and small.size_bytes() <= small.max_bytes
+        finally:
+            os.scandir = scandir
+    
+        # In-memory LRU: shared read-only arrays, byte budget, counters, stale versions dropped
+        loads = []
+        
+        def loader(filepath, band):
+            loads.append(filepath)
+            return np.zeros((10, 10), dtype=np.float32), {'nodata': -9999}
+        
+        memory = RasterMemoryCache(max_bytes=2 * 400)
+        first, meta = memory.get_or_load(paths[0], 1, loader)
+        again, _ = memory.get_or_load(paths[0], 1, loader)
+        assert again is first and not first.flags.writeable and len(loads) == 1
+        meta['nodata'] = 0  # callers get their own metadata dict
+        assert memory.get_or_load(paths[0], 1, loader)[1] == {'nodata': -9999}
+        memory.get_or_load(paths[1], 1, loader)
+        memory.get_or_load(paths[2], 1, loader)
+        stats = memory.stats()
+        assert stats['hits'] == 2 and stats['misses'] == 3 and stats['evictions'] == 1
+        assert stats['bytes_loaded'] == 3 * 400 and stats['bytes_served'] == 5 * 400
+        assert stats['bytes_cached'] == 2 * 400 and stats['entries'] == 2
+        memory.get_or_load(paths[0], 1, loader)  # evicted: loaded again
+        assert len(loads) == 4
+        os.utime(paths[0], ns=(0, 10 ** 18))
+        memory.get_or_load(paths[0], 1, loader)
+        assert len(loads) == 5 and memory.stats()['entries'] == 2
+    
+    print("Raster caches invalidated, evicted and counted correctly")
+    return True
+
+
+def test_raster_cube():
+    """Test timestep parsing, ordering and selectors of the raster time cube."""
+    print("=== Testing Raster Time Cube ===")
+    
+    import tempfile
+    import numpy as np
+    from cluster_processor import RasterProcessor
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        sim_dir = os.path.join(tmp, "raster", "db", "grp", "run", "sim_1")
+        os.makedirs(sim_dir)
+        # Timesteps written out of order; lexical order would put 1200 before 300
+        for seconds, value in [(300, 2.0), (0, 1.0), (1200, 3.0)]:
+            data = np.full((4, 5), value, dtype=np.float32)
+            data[0, 0] = -9999
+            data[1, 1] = 10.0 if seconds == 300 else value
+            write_test_raster(os.path.join(sim_dir, f"DEPTH2D_{seconds}.000000.tif"), data)
+        
+        processor = RasterProcessor(tmp, use_cache=False)
+        cube = processor.get_raster_cubes(1, ["DEPTH2D"])["DEPTH2D"]
+        assert cube.times == [0.0, 300.0, 1200.0]
+        assert cube.shape == (3, 4, 5)
+        assert cube[1:, 2, 2].tolist() == [2.0, 3.0]
+        
+        assert processor.get_raster_files(1, ["DEPTH2D"])["DEPTH2D"].endswith("DEPTH2D_1200.000000.tif")
+        assert processor.get_raster_files(1, ["DEPTH2D"], {"time": 280})["DEPTH2D"].endswith("DEPTH2D_300.000000.tif")
+        assert processor.load_timestep(cube, "first")[0][2, 2] == 1.0
+        assert processor.load_timestep(cube, -2)[0][2, 2] == 2.0
+        
+        peak, _ = processor.load_timestep(cube, "max")
+        assert peak[1, 1] == 10.0 and peak[2, 2] == 3.0 and peak[0, 0] == -9999
+        early, _ = processor.load_timestep(cube, {"range": [0, 300], "reduce": "min"})
+        assert early[2, 2] == 1.0 and early[0, 0] == -9999
+    
+    print("Raster cube ordered 3 timesteps and resolved selectors correctly")
+    return True
+
+
+def test_raster_envelope():
+    """Test streaming envelopes over timesteps and their cache."""
+    print("=== Testing Raster Envelope ===")
+    
+    import tempfile
+    import numpy as np
+    import rasterio
+    from raster_envelope import EnvelopeCache
+    
+    stack = np.array([
+        [[1.0, -9999, 5.0]],
+        [[4.0, -9999, 2.0]],
+        [[3.0, -9999, -9999]],
+    ], dtype=np.float32)
+    times = [0.0, 300.0, 600.0]
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for t, data in zip(times, stack):
+            path = os.path.join(tmp, f"DEPTH2D_{t:.6f}.tif")
+            write_test_raster(path, data)
+            paths.append(path)
+        
+        cache = EnvelopeCache(os.path.join(tmp, "envelopes"))
+        layers = cache.get("DEPTH2D", paths, times)
+        read = {}
+        for name, path in layers.items():
+            with rasterio.open(path) as src:
+                read[name] = src.read(1)[0].tolist()
+        
+        assert read['max'] == [4.0, -9999, 5.0]
+        assert read['min'] == [1.0, -9999, 2.0]
+        assert np.allclose(read['mean'], [8 / 3, -9999, 3.5])
+        assert read['argmax_time'] == [300.0, -9999, 0.0]
+        
+        assert cache.get("DEPTH2D", paths, times) == layers and cache.stats() == {'hits': 1, 'computed': 1}
+        with rasterio.open(paths[2], 'r+') as dst:
+            dst.write(stack[2] + 10, 1)
+        cache.get("DEPTH2D", paths, times)
+        assert cache.stats()['computed'] == 2  # changed input invalidates the entry
+    
+    print("Envelope max/min/mean/argmax_time computed and cached correctly")
+    return True
+
+
+def test_kmeans_1d():
+    """Test that the 1-D k-means engine finds the optimal (or, when binned, near-optimal) partition."""
+    print("=== Testing 1-D K-Means ===")
+    
+    import itertools
+    import numpy as np
+    from kmeans_1d import KMeans1D
+    from cluster_processor import ClusterAnalyzer
+    
+    rng = np.random.default_rng(3)
+    values = np.round(rng.normal(size=14) * 2, 2)
+    models = KMeans1D().sweep(values, [1, 2, 3, 4])
+    ordered = np.sort(values)
+    for k, model in models.items():
+        best = min(sum(((seg - seg.mean()) ** 2).sum() for seg in np.split(ordered, cuts))
+                   for cuts in itertools.combinations(range(1, len(ordered)), k - 1))
+        assert abs(model.inertia - best) < 1e-9
+        assert np.all(np.diff(model.centers) > 0)
+    
+    # More distinct values than bins: a far outlier must not collapse the bulk into a few bins
+    skewed = np.round(np.concatenate([rng.normal(0, 1, 3000), rng.normal(6, 1, 3000), [500.0]]), 4)
+    for k in [2, 3, 4]:
+        binned = KMeans1D(max_bins=64).fit(skewed, k).model(k)
+        exact = KMeans1D(max_bins=10 ** 6).fit(skewed, k).model(k)
+        assert binned.inertia <= exact.inertia * 1.01
+        labels_binned = binned.predict(skewed)
+        assert abs(((skewed - binned.centers[labels_binned]) ** 2).sum() - binned.inertia) < 1e-6 * binned.inertia
+    
+    # Raster path: labels ordered by center, nodata preserved, one fit serves the k sweep
+    data = np.concatenate([rng.normal(0, 0.01, 500), rng.normal(1, 0.01, 500), rng.normal(5, 0.01, 500)])
+    data = data.reshape(30, 50).astype(np.float32)
+    data[0, :5] = -9999
+    analyzer = ClusterAnalyzer()
+    analyzer.kmeans_k_values = [2, 3, 4]
+    labels = analyzer.kmeans_clustering(data, 3)
+    solver = analyzer._kmeans_solver[1]
+    assert np.all(labels[0, :5] == -9999)
+    assert set(np.unique(labels[data > 4])) == {2} and set(np.unique(labels[(data > -1) & (data < 0.5)])) == {0}
+    analyzer.kmeans_clustering(data, 4)
+    assert analyzer._kmeans_solver[1] is solver
+    
+    print("1-D k-means matched brute force for k = 1..4")
+    return True
+
+
+def test_spatial_kmeans():
+    """Test sample-fit / chunked-predict spatial k-means."""
+    print("=== Testing Spatial K-Means ===")
+    
+    import numpy as np
+    from rasterio.transform import from_origin
+    from spatial_kmeans import SpatialKMeans
+    
+    # Two blobs with identical values, far apart: only the coordinates separate them
+    depth = np.zeros((40, 60), dtype=np.float32)
+    depth[5:15, 5:15] = 1.0
+    depth[25:35, 45:55] = 1.0
+    speed = np.where(depth > 0, 0.5, 0.0).astype(np.float32)
+    valid = np.ones(depth.shape, dtype=bool)
+    valid[0, :] = False
+    transform = from_origin(0, 40, 1, 1)
+    
+    clusterer = SpatialKMeans(k=2, sample_size=50, chunk_rows=7)
+    labels = clusterer.fit_predict([depth, speed], depth > 0, transform, valid)
+    assert len(clusterer._sample(depth > 0, np.random.default_rng(0))) <= 50 + 4  # at most one extra per stratum
+    assert np.all(labels[0] == -9999) and np.all(labels[(depth == 0) & valid] == 0)
+    first, second = np.unique(labels[5:15, 5:15]), np.unique(labels[25:35, 45:55])
+    assert len(first) == 1 and len(second) == 1 and first[0] != second[0]
+    
+    # Chunked prediction matches a single chunk
+    whole = SpatialKMeans(k=2, sample_size=50, chunk_rows=1000).fit_predict([depth, speed], depth > 0, transform, valid)
+    assert np.array_equal(labels, whole)
+    
+    print("Spatial k-means separated two blobs by location")
+    return True
+
+
+def test_grid_dbscan():
+    """Test grid DBSCAN against sklearn's DBSCAN on pixel coordinates."""
+    print("=== Testing Grid DBSCAN ===")
+    
+    import numpy as np
+    from sklearn.cluster import DBSCAN
+    from grid_dbscan import grid_dbscan
+    
+    rng = np.random.default_rng(7)
+    mask = rng.random((40, 40)) < 0.15
+    for eps in (1.0, 1.5, 3.0):
+        labels, n = grid_dbscan(mask, eps, min_samples=4)
+        points = np.argwhere(mask)
+        reference = DBSCAN(eps=eps + 1e-9, min_samples=4).fit(points)
+        core = np.zeros(len(points), dtype=bool)
+        core[reference.core_sample_indices_] = True
+        ours = labels[mask]
+        assert np.array_equal(reference.labels_ == -1, ours == 0)
+        pairs = set(zip(reference.labels_[core].tolist(), ours[core].tolist()))
+        assert len(pairs) == n == len(set(reference.labels_[core].tolist()))
+    
+    print("Grid DBSCAN matched sklearn core clusters and noise")
+    return True
+
+
+def test_polygonize():
+    """Test label polygonization keeps holes and disjoint parts."""
+    print("=== Testing Label Polygonization ===")
+    
+    import numpy as np
+    from affine import Affine
+    from scipy import ndimage
+    from shapely.geometry import shape
+    from polygonize import polygonize_labels
+    
+    labels = np.zeros((30, 30), dtype=np.int32)
+    labels[2:12, 2:12] = 1
+    labels[5:8, 5:8] = 0      # hole in label 1
+    labels[20:25, 3:8] = 1    # second part of label 1
+    labels[15:28, 15:28] = 2
+    labels[0, 29] = -9999     # nodata
+    slices = ndimage.find_objects(np.where(labels > 0, labels, 0))
+    transform = Affine(2.0, 0.0, 0.0, 0.0, -2.0, 60.0)
+    
+    results = {strategy: polygonize_labels(labels, [1, 2], slices, transform, strategy)
+               for strategy in ("whole", "crops")}
+    for geometries in results.values():
+        first, second = shape(geometries[1]), shape(geometries[2])
+        assert first.geom_type == "MultiPolygon" and len(first.geoms) == 2
+        assert sum(len(part.interiors) for part in first.geoms) == 1
+        assert second.geom_type == "Polygon"
+        assert first.area == 4.0 * np.count_nonzero(labels == 1)
+        assert second.area == 4.0 * np.count_nonzero(labels == 2)
+    assert shape(results["whole"][1]).equals(shape(results["crops"][1]))
+    
+    print("Polygons kept holes and parts; whole-raster and crop strategies agree")
+    return True
+
+
+def test_polygon_lod():
+    """Test polygon detail tiers and tiered GeoJSON export."""
+    print("=== Testing Polygon Level of Detail ===")
+    
+    import json
+    import tempfile
+    import numpy as np
+    from affine import Affine
+    from shapely.geometry import shape
+    from polygonize import polygonize_labels
+    from polygon_lod import build_lod, vertex_counts
+    from cluster_processor import AnalysisResult, ClusterMetrics
+    from exporter import GeoJSONExporter
+    
+    # A jagged disk with a hole: many staircase vertices at full resolution
+    yy, xx = np.mgrid[0:60, 0:60]
+    radius = np.hypot(yy - 30, xx - 30)
+    labels = ((radius < 25) & (radius > 8)).astype(np.int32)
+    transform = Affine(1.0, 0.0, 0.0, 0.0, -1.0, 60.0)
+    geometry = polygonize_labels(labels, [1], [(slice(0, 60), slice(0, 60))], transform)[1]
+    
+    lod = build_lod(geometry, tolerance=1.0)
+    counts = vertex_counts(lod)
+    assert counts['full'] > counts['simplified'] > counts['bbox'] == 5
+    simplified = shape(lod['simplified'])
+    assert simplified.is_valid and len(simplified.interiors) == 1
+    assert abs(simplified.area - shape(geometry).area) < 0.05 * shape(geometry).area
+    
+    cluster = ClusterMetrics(1, 1.0, (30.0, 30.0), 1.0, 1.0, 1.0, 0.0, 1, geometry,
+                             simplify_tolerance=1.0, vertex_counts={'full': counts['full']})
+    result = AnalysisResult("lod_rule", "threshold", [cluster], {}, {}, {})
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = GeoJSONExporter(tmp, ["full", "simplified", "hull"]).export_all_tiers(result)
+        assert os.path.basename(paths['full']) == "lod_rule_clusters.geojson"
+        assert os.path.basename(paths['simplified']) == "lod_rule_clusters_simplified.geojson"
+        with open(paths['hull'], encoding='utf-8') as f:
+            feature = json.load(f)['features'][0]
+        assert feature['properties']['vertex_count'] == counts['hull']
+    # Only the tiers that were written are built
+    assert cluster.vertex_counts == {t: counts[t] for t in ("full", "simplified", "hull")}
+    
+    print(f"Vertex counts per tier: {counts}")
+    return True
+
+
+def test_raster_expression():
+    """Test derive expressions: chunked evaluation, nodata propagation and derive references."""
+    print("=== Testing Raster Expressions ===")
+    
+    import numpy as np
+    from raster_expression import RasterExpression, DeriveSet
+    
+    rng = np.random.default_rng(3)
+    depth = rng.random((37, 23)).astype(np.float32)
+    speed = rng.random((37, 23)).astype(np.float32)
+    depth[5, 5] = -9999
+    valid = depth != -9999
+    
+    expression = RasterExpression("where(depth > 0.5, depth * speed, -abs(speed - max(depth, 0.2)))")
+    result = expression.evaluate({'depth': depth, 'speed': speed}, chunk_rows=4)
+    d, v = depth.astype(np.float64), speed.astype(np.float64)
+    expected = np.where(d > 0.5, d * v, -np.abs(v - np.maximum(d, 0.2)))
+    assert result.dtype == np.float32
+    assert np.allclose(result[valid], expected[valid], atol=1e-6) and result[5, 5] == -9999
+    
+    band = RasterExpression("0.2 <= depth * 2 <= speed + 0.5").evaluate({'depth': depth, 'speed': speed})
+    assert np.array_equal(band[valid], ((0.2 <= d * 2) & (d * 2 <= v + 0.5))[valid])
+    assert RasterExpression("depth / 0").evaluate({'depth': depth}).max() == -9999
+    
+    rasters = {('DEPTH2D', 1): depth, ('DEPTH2D', 2): speed}
+    derive = DeriveSet({"delta": "DEPTH2D_2 - DEPTH2D_1", "rise": "delta > 0.1"})
+    assert derive.required_inputs("rise") == {('DEPTH2D', 1), ('DEPTH2D', 2)}
+    rise = derive.evaluate("rise", lambda attr, sim: rasters[(attr, sim)])
+    assert np.array_equal(rise[valid], ((v - d) > 0.1)[valid]) and rise[5, 5] == -9999
+    
+    for bad in ("depth.real", "open(depth)", "min(depth)"):
+        try:
+            RasterExpression(bad)
+            assert False, f"{bad} should not compile"
+        except ValueError:
+            pass
+    
+    print("Expressions matched numpy, propagated nodata and resolved derive references")
+    return True
+
+
+def test_required_inputs():
+    """Test that rules load only the attributes their analysis reads."""
+    print("=== Testing Required Rule Inputs ===")
+    
+    import tempfile
+    import dataclasses
+    from rule_parser import RuleConfig, AnalysisType
+    from cluster_processor import ClusterProcessor
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        processor = ClusterProcessor(tmp)
+        attributes = ["ANGLE2D", "DEPTH2D", "SPEED2D", "CUMINF2D", "GASFLAG2D"]
+        base = RuleConfig(name="r", analysis_type=AnalysisType.COMPARISON, attributes=attributes, thresholds={},
+                          clustering={"method": "kmeans"}, visualization={}, outputs={},
+                          baseline_id=1, candidate_id=2, features=["DEPTH2D"])
+        
+        derived = dataclasses.replace(base, derive={"delta": "DEPTH2D_2 - DEPTH2D_1"})
+        assert processor.required_inputs(derived) == {1: ["DEPTH2D"], 2: ["DEPTH2D"]}
+        # features[0] != attributes[0]: features do not change the analysed attribute, analysis_attribute does
+        assert processor.primary_attribute(base) == "ANGLE2D"
+        assert processor.required_inputs(base) == {1: ["ANGLE2D"], 2: ["ANGLE2D"]}
+        chosen = dataclasses.replace(base, analysis_attribute="DEPTH2D")
+        assert processor.required_inputs(chosen) == {1: ["DEPTH2D"], 2: ["DEPTH2D"]}
+        
+        hazard = dataclasses.replace(base, analysis_type=AnalysisType.HAZARD, derive={"hazard": "DEPTH2D * SPEED2D"})
+        assert processor.required_inputs(hazard) == {1: ["DEPTH2D", "SPEED2D"]}
+        
+        threshold = dataclasses.replace(base, analysis_type=AnalysisType.THRESHOLD)
+        assert processor.required_inputs(threshold) == {1: ["ANGLE2D"]}
+        assert processor.required_inputs(dataclasses.replace(threshold, analysis_attribute="DEPTH2D")) == {1: ["DEPTH2D"]}
+        
+        features = dataclasses.replace(derived, clustering={"method": "spatial_kmeans", "features": ["SPEED2D", "rise"]},
+                                       derive={"delta": "DEPTH2D_2 - DEPTH2D_1", "rise": "CUMINF2D_2 - CUMINF2D_1"})
+        assert processor.required_inputs(features) == {1: ["CUMINF2D", "DEPTH2D", "SPEED2D"],
+                                                       2: ["CUMINF2D", "DEPTH2D", "SPEED2D"]}
+    
+    print("Required inputs follow the analysis type, derive formulas and features")
+    return True
+
+
+def test_parallel_rules():
+    """Test the memory-aware worker cap for parallel rule execution."""
+    print("=== Testing Parallel Rule Scheduling ===")
+    
+    import tempfile
+    import numpy as np
+    from raster_catalog import RasterCatalog
+    from parallel_rules import (DEFAULT_RULE_BYTES, WORKING_SET_FACTOR, combine_cache_stats,
+                                estimate_rule_bytes, worker_limit)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        sim_dir = os.path.join(tmp, "raster", "db", "grp", "run", "sim_1")
+        os.makedirs(sim_dir)
+        for attr in ("DEPTH2D", "SPEED2D"):
+            write_test_raster(os.path.join(sim_dir, f"{attr}_00000.tif"), np.zeros((40, 50), dtype=np.float32))
+        catalog = RasterCatalog(tmp)
+        catalog.refresh()
+        assert estimate_rule_bytes(catalog, {1: ["DEPTH2D", "SPEED2D"]}) == 2 * 40 * 50 * 4 * WORKING_SET_FACTOR
+        assert estimate_rule_bytes(catalog, {2: ["DEPTH2D"]}) == DEFAULT_RULE_BYTES
+    
+    gb = 1024 ** 3
+    assert worker_limit(32, [gb] * 10, available=64 * gb, memory_fraction=0.5, cpu_count=32) == 10
+    assert worker_limit(32, [gb] * 40, available=64 * gb, memory_fraction=0.5, cpu_count=32) == 32
+    assert worker_limit(32, [gb, 8 * gb] * 20, available=64 * gb, memory_fraction=0.5, cpu_count=32) == 4
+    assert worker_limit(8, [100 * gb] * 4, available=64 * gb, cpu_count=32) == 1
+    assert worker_limit(8, [gb] * 4, available=None, cpu_count=2) == 2
+    
+    # Capped to one worker: the rules run sequentially, without a process pool
+    import logging
+    import pipeline_runner
+    from types import SimpleNamespace
+    from rule_parser import RuleConfig, AnalysisType
+    runner = pipeline_runner.PipelineRunner.__new__(pipeline_runner.PipelineRunner)
+    runner.logger = logging.getLogger("test")
+    runner._cfg = {}
+    runner.run_manifest = {}
+    runner.cluster_processor = SimpleNamespace(raster_processor=SimpleNamespace(catalog=None),
+                                               required_inputs=lambda rule_config: {},
+                                               _use_tiled_labeling=lambda rule_config: False)
+    runner.process_rule = lambda rule_config, export_rasters: {'rule': rule_config.name}
+    rules = [RuleConfig(name=f"rule_{i}", analysis_type=AnalysisType.THRESHOLD, attributes=["DEPTH2D"],
+                        thresholds={}, clustering={}, visualization={}, outputs={}) for i in range(3)]
+    original_limit, original_pool = pipeline_runner.worker_limit, pipeline_runner.ProcessPoolExecutor
+    pipeline_runner.worker_limit = lambda *args, **kwargs: 1
+    pipeline_runner.ProcessPoolExecutor = None  # any attempt to start a pool fails
+    try:
+        results = list(runner._process_rules_parallel(rules, False, 4))
+    finally:
+        pipeline_runner.worker_limit, pipeline_runner.ProcessPoolExecutor = original_limit, original_pool
+    assert results == [{'rule': "rule_0"}, {'rule': "rule_1"}, {'rule': "rule_2"}]
+    assert runner.run_manifest['parallel']['workers'] == 1
+    
+    merged = combine_cache_stats([{'hits': 1, 'misses': 1, 'hit_rate': 0.5, 'max_bytes': 10},
+                                  {'hits': 2, 'misses': 0, 'hit_rate': 1.0, 'max_bytes': 10}])
+    assert merged == {'hits': 3, 'misses': 1, 'hit_rate': 0.75, 'max_bytes': 10}
+    
+    print("Worker cap follows rule count, CPU count and memory estimates")
+    return True
+
+
+def test_shared_rasters():
+    """Test publishing rasters to shared memory and serving them from the raster cache."""
+    print("=== Testing Shared Rasters ===")
+    
+    import tempfile
+    import numpy as np
+    from multiprocessing import shared_memory
+    from raster_cache import RasterMemoryCache
+    from shared_rasters import SharedRasterRegistry, attach_shared_rasters, detach_all
+    
+    loads = []
+    
+    def loader(path, band):
+        loads.append(path)
+        return np.arange(12, dtype=np.float32).reshape(3, 4), {'nodata': -9999}
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "DEPTH2D_00000.tif")
+        open(path, 'w').close()
+        with SharedRasterRegistry() as registry:
+            descriptor = registry.publish(path, loader)
+            assert registry.publish(path, loader) is descriptor and len(loads) == 1
+            assert registry.nbytes == 48
+            
+            cache = RasterMemoryCache()
+            assert attach_shared_rasters(registry.descriptors(), cache) == 1
+            data, meta = cache.get_or_load(path, 1, loader)
+            assert len(loads) == 1 and cache.hits == 1 and meta == {'nodata': -9999}
+            assert np.array_equal(data, np.arange(12, dtype=np.float32).reshape(3, 4))
+            assert not data.flags.writeable
+            
+            os.utime(path, ns=(0, 0))  # a re-exported file is read afresh
+            cache.get_or_load(path, 1, loader)
+            assert len(loads) == 2
+            del data
+            detach_all(cache)
+            
+            # One reference per publish: the block outlives the first release, not the last
+            registry.release([descriptor])
+            shared_memory.SharedMemory(name=descriptor.name).close()
+            assert registry.nbytes == 48
+            registry.release([descriptor])
+            assert registry.nbytes == 0 and registry.descriptors() == []
+            assert registry.published == 1 and registry.published_bytes == registry.peak_bytes == 48
+            try:
+                shared_memory.SharedMemory(name=descriptor.name).close()
+                assert False, "released block should be unlinked"
+            except FileNotFoundError:
+                pass
+            again = registry.publish(path, loader)
+            assert again.name != descriptor.name and registry.published == 2 and registry.peak_bytes == 48
+        
+        try:
+            shared_memory.SharedMemory(name=again.name).close()
+            assert False, "shared block should be unlinked"
+        except FileNotFoundError:
+            pass
+    
+    print("Shared rasters were attached read-only and released")
+    return True
+
+
+def test_export_orchestrator():
+    """Test background export jobs: streaming, de-duplication, failures."""
+    print("=== Testing Export Orchestrator ===")
+    
+    import logging
+    from export_orchestrator import ExportOrchestrator
+    
+    class Capture(logging.Handler):
+        def __init__(self):
+            super().__init__()
+            self.lines = []
+        
+        def emit(self, record):
+            self.lines.append(record.getMessage())
+    
+    logger = logging.getLogger("test_export_orchestrator")
+    logger.setLevel(logging.INFO)
+    capture = Capture()
+    logger.addHandler(capture)
+    indexed = []
+    
+    exports = ExportOrchestrator(max_concurrent=2, logger=logger)
+    try:
+        ok = exports.submit(("raster", 1), [sys.executable, "-c", "print('exported DEPTH2D')"], "export sim 1",
+                            lambda: indexed.append(1))
+        assert exports.submit(("raster", 1), ["never-run"], "duplicate") is ok
+        failed = exports.submit(("raster", 2), [sys.executable, "-c", "import sys; print('no licence'); sys.exit(3)"],
+                                "export sim 2", lambda: indexed.append(2))
+        missing = exports.submit(("csv", 1), ["/nonexistent/ICMExchange.exe"], "csv sim 1")
+        assert ok.result() is True and failed.result() is False and missing.result() is False
+        assert indexed == [1]
+        assert "[export sim 1] exported DEPTH2D" in capture.lines
+        assert any("no licence" in line for line in capture.lines if "Last output" in line)
+        
+        exports.forget()
+        assert exports.pending() == 0
+        assert exports.submit(("raster", 1), [sys.executable, "-c", "pass"], "again") is not ok
+    finally:
+        exports.shutdown()
+        logger.removeHandler(capture)
+    
+    print("Exports ran in the background with streamed output")
+    return True
+
+
+def test_export_planner():
+    """Test merging exports across rules and skipping up-to-date ones."""
+    print("=== Testing Export Planner ===")
+    
+    import tempfile
+    import numpy as np
+    from raster_catalog import RasterCatalog
+    from export_planner import ExportPlanner
+    
+    def write(path):
+        write_test_raster(path, np.zeros((4, 5), dtype=np.float32))
+    
+    def plan(catalog, source="model@1", force=False):
+        planner = ExportPlanner(catalog, source, force=force)
+        planner.add_rasters("depth", 1, sim_1, ["DEPTH2D"])
+        planner.add_rasters("hazard", 1, sim_1, ["DEPTH2D", "SPEED2D"])
+        planner.add_rasters("hazard", 2, sim_2, ["DEPTH2D"])
+        planner.add_csv("depth", 1, csv_1)
+        planner.add_csv("hazard", 1, csv_1)
+        return planner.plan()
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        sim_1 = os.path.join(tmp, "raster", "db", "grp", "sim_1")
+        sim_2 = os.path.join(tmp, "raster", "db", "grp", "sim_2")
+        csv_1 = os.path.join(tmp, "experiments", "csv", "sim_1")
+        catalog = RasterCatalog(tmp)
+        
+        first = plan(catalog)
+        assert [(e.sim_id, e.attributes) for e in first.rasters] == [(1, ["DEPTH2D", "SPEED2D"]), (2, ["DEPTH2D"])]
+        assert len(first.csv) == 1 and first.csv[0].rules == ["depth", "hazard"]
+        assert [attrs for _, attrs in first.rules["hazard"].rasters] == [["DEPTH2D", "SPEED2D"], ["DEPTH2D"]]
+        assert first.summary()['requested_exports'] == 5 and first.summary()['raster_exports'] == 2
+        
+        # sim 1 exported completely, sim 2 recorded but its raster is gone
+        for attr in ("DEPTH2D", "SPEED2D"):
+            write(os.path.join(sim_1, f"{attr}_00000.tif"))
+        catalog.index_directory(sim_1)
+        catalog.record_export(sim_1, 1, ["DEPTH2D", "SPEED2D"], "all", "model@1")
+        catalog.record_export(sim_2, 2, ["DEPTH2D"], "all", "model@1")
+        
+        second = plan(catalog)
+        assert second.rasters[0].skipped and second.rasters[0].current == ["DEPTH2D", "SPEED2D"]
+        assert second.rasters[1].attributes == ["DEPTH2D"]
+        assert second.summary()['raster_exports_skipped'] == 1
+        assert not plan(catalog, source="model@2").rasters[0].skipped
+        assert not plan(catalog, force=True).rasters[0].skipped
+        assert not plan(catalog, source=None).rasters[0].skipped
+        
+        # The source identity follows the results: newest file of a model directory, None without a model
+        from pipeline_runner import PipelineRunner
+        runner = PipelineRunner.__new__(PipelineRunner)
+        runner.project_root = tmp
+        runner._cfg = {'model_path': 'model'}
+        assert runner._export_source() is None
+        results = os.path.join(tmp, "model", "results", "sim_1.dat")
+        os.makedirs(os.path.dirname(results))
+        with open(results, 'wb') as f:
+            f.write(b"results")
+        before = runner._export_source()
+        os.utime(results, ns=(0, 10 ** 19))  # the simulation is re-run
+        assert before is not None and runner._export_source() != before
+    
+    print("Exports were merged across rules and up-to-date ones skipped")
+    return True
+
+
+def test_stage_cache():
+    """Test stage memoization: reuse across runs, partial reuse after edits, LRU eviction."""
+    print("=== Testing Stage Cache ===")
+    
+    import dataclasses
+    import tempfile
+    import numpy as np
+    from rule_parser import RuleConfig, AnalysisType
+    from cluster_processor import ClusterProcessor
+    from stage_cache import StageCache
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        raised = np.zeros((20, 20), dtype=np.float32)
+        raised[2:5, 2:5] = 1.0
+        raised[10:16, 10:16] = 0.5
+        write_test_raster(os.path.join(tmp, "raster", "db", "grp", "sim_1", "DEPTH2D_00000.tif"), np.zeros((20, 20), np.float32))
+        write_test_raster(os.path.join(tmp, "raster", "db", "grp", "sim_2", "DEPTH2D_00000.tif"), raised)
+        
+        processor = ClusterProcessor(tmp)
+        cache = processor.stage_cache
+        rule = RuleConfig(name="delta", analysis_type=AnalysisType.COMPARISON, attributes=["DEPTH2D"],
+                          thresholds={"change_threshold": 0.1}, clustering={"method": "connected_components",
+                                                                           "min_size": 1},
+                          visualization={}, outputs={}, baseline_id=1, candidate_id=2)
+        
+        first = processor.process_rule(rule)
+        assert len(first.clusters) == 2 and cache.stats()['hits'] == 0
+        cache.reset_counters()
+        again = processor.process_rule(rule)
+        # Cached clusters come back from JSON, so compare them as exported
+        assert json.dumps([dataclasses.asdict(c) for c in again.clusters]) == \
+            json.dumps([dataclasses.asdict(c) for c in first.clusters])
+        assert cache.stats()['stages'].keys() == {'value', 'clusters'} and cache.stats()['hit_rate'] == 1.0
+        
+        # A min_size edit reuses the delta and the unfiltered components (the mask is not even needed)
+        cache.reset_counters()
+        edited = processor.process_rule(dataclasses.replace(rule, clustering={"method": "connected_components",
+                                                                              "min_size": 20}))
+        assert len(edited.clusters) == 1
+        stages = cache.stats()['stages']
+        assert stages['value']['hits'] == 1 and stages['components']['hits'] == 1
+        assert stages['labels']['misses'] == 1 and 'mask' not in stages
+        
+        # A threshold edit reuses only the delta
+        cache.reset_counters()
+        processor.process_rule(dataclasses.replace(rule, thresholds={"change_threshold": 0.8}))
+        stages = cache.stats()['stages']
+        assert stages['value']['hits'] == 1 and stages['mask']['misses'] == 1
+        
+        small = StageCache(os.path.join(tmp, "small"), max_bytes=1)
+        for i in range(3):
+            small.store(small.key("mask", [str(i)], {}), "mask", {'data': np.full((50, 50), i, np.int16)})
+        assert small.stats()['evictions'] == 2 and len(os.listdir(small.cache_dir)) == 2
+        assert small.load(small.key("mask", ["2"], {}), "mask")[0]['data'][0, 0] == 2
+        assert small.load(small.key("mask", ["0"], {}), "mask") is None
+        
+        # An entry evicted by another worker between listing and stat is skipped, not fatal
+        class Vanished:
+            name, path = "gone.json", os.path.join(small.cache_dir, "gone.json")
+            
+            def stat(self):
+                raise FileNotFoundError(self.path)
+        
+        scandir = os.scandir
+        os.scandir = lambda path: list(scandir(path)) + [Vanished()]
+        try:
+            small.store(small.key("mask", ["3"], {}), "mask", {'data': np.full((50, 50), 3, np.int16)})
+            assert small.load(small.key("mask", ["3"], {}), "mask") is not None
+        finally:
+            os.scandir = scandir
+    
+    print("Stage outputs were reused and evicted as expected")
+    return True
+
+
+def test_raster_watcher():
+    """Test monitor triggering: debounced per-sim changes, affected rules, coalescing, backends."""
+    print("=== Testing Raster Watcher ===")
+    
+    import tempfile
+    from rule_parser import RuleConfig, AnalysisType
+    from cluster_processor import ClusterProcessor
+    from raster_watcher import RasterWatcher, RuleTriggerQueue, affected_rules
+    
+    def touch(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b"tif")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        sim_2 = os.path.join(tmp, "raster", "db", "grp", "sim_2")
+        watcher = RasterWatcher(tmp, debounce=2.0, backend="poll", poll_interval=0.0)
+        # A burst of timestep files settles into one change once the sim has been quiet
+        paths = [os.path.join(sim_2, f"DEPTH2D_{t:05d}.tif") for t in range(500)]
+        assert watcher.add(paths, now=0.0) == 500
+        assert watcher.add([os.path.join(tmp, "notes.txt")], now=1.0) == 0
+        assert watcher.settled(now=1.5) == []
+        [change] = watcher.settled(now=2.5)
+        assert change.sim_id == 2 and change.attributes == {"DEPTH2D"} and change.files == 500
+        assert change.directories == {sim_2} and watcher.settled(now=10.0) == []
+        
+        processor = ClusterProcessor(tmp)
+        rules = [RuleConfig(name=name, analysis_type=AnalysisType.COMPARISON, attributes=[attr], thresholds={},
+                            clustering={}, visualization={}, outputs={}, baseline_id=1, candidate_id=candidate)
+                 for name, attr, candidate in [("depth_1_2", "DEPTH2D", 2), ("depth_1_3", "DEPTH2D", 3),
+                                               ("speed_1_2", "SPEED2D", 2)]]
+        assert affected_rules([change], rules, processor.required_inputs) == {"depth_1_2": {2}}
+        
+        queue = RuleTriggerQueue(maxsize=1)
+        assert queue.put("depth_1_2", {2}) and not queue.put("depth_1_2", {1})
+        assert queue.coalesced == 1 and len(queue) == 1
+        try:
+            queue.put("speed_1_2", {2}, timeout=0.05)
+            assert False, "Full queue accepted a new rule"
+        except TimeoutError:
+            pass
+        assert queue.get_batch(timeout=0) == {"depth_1_2": {1, 2}} and queue.get_batch(timeout=0) == {}
+        
+        backends = ["poll"] + (["inotify"] if sys.platform.startswith("linux") else [])
+        for backend in backends:
+            watcher = RasterWatcher(tmp, debounce=0.0, backend=backend, poll_interval=0.1)
+            touch(os.path.join(tmp, "raster", "db", "grp", f"sim_{backend}", "x.tif"))
+            touch(os.path.join(tmp, "raster", "db", "run2", "sim_5", "VELOCITY_00001.tif"))
+            changes = []
+            for _ in range(20):
+                changes += watcher.wait(0.2)
+                if changes:
+                    break
+            watcher.backend.close()
+            assert [(c.sim_id, c.attributes) for c in changes] == [(5, {"VELOCITY"})], (backend, changes)
+            os.remove(os.path.join(tmp, "raster", "db", "run2", "sim_5", "VELOCITY_00001.tif"))
+    
+    print("Raster changes were debounced and mapped to the affected rules")
+    return True
+
+
+def test_parallel_experiments():
+    """Test optimizer experiments in a worker pool: same results as sequential, throughput reported."""
+    print("=== Testing Parallel Experiments ===")
+    
+    import tempfile
+    import numpy as np
+    from rule_parser import RuleConfig, AnalysisType
+    import optimizer
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        raised = np.zeros((20, 20), dtype=np.float32)
+        raised[2:5, 2:5] = 0.03
+        raised[10:16, 10:16] = 0.5
+        write_test_raster(os.path.join(tmp, "raster", "db", "grp", "sim_1", "DEPTH2D_00000.tif"), np.zeros((20, 20), np.float32))
+        write_test_raster(os.path.join(tmp, "raster", "db", "grp", "sim_2", "DEPTH2D_00000.tif"), raised)
+        rule = RuleConfig(name="delta", analysis_type=AnalysisType.COMPARISON, attributes=["DEPTH2D"],
+                          thresholds={}, clustering={}, visualization={}, outputs={}, baseline_id=1, candidate_id=2)
+        params = optimizer.OptimizationParams(k_values=[2, 3], threshold_values=[0.01, 0.1],
+                                              algorithms=['kmeans', 'connected_components'])
+        
+        runs = {}
+        original_limit = optimizer.worker_limit
+        # The pool is exercised even on a single-CPU machine
+        optimizer.worker_limit = lambda requested, *args, **kwargs: requested
+        try:
+            for workers in (1, 2):
+                param_optimizer = optimizer.ParameterOptimizer(tmp, os.path.join(tmp, "experiments"), workers=workers)
+                param_optimizer.cluster_processor.configure_stage_cache(False)
+                runs[workers] = (param_optimizer.optimize_rule(rule, params), param_optimizer.execution)
+        finally:
+            optimizer.worker_limit = original_limit
+        
+        (sequential, _), (parallel, execution) = runs[1], runs[2]
+        assert [r.experiment_id for r in parallel] == [r.experiment_id for r in sequential]
+        assert [(r.clusters_count, r.metrics['composite_score']) for r in parallel] == \
+            [(r.clusters_count, r.metrics['composite_score']) for r in sequential]
+        assert execution['workers'] == 2 and execution['shared_rasters'] == 2
+        assert execution['experiments'] == len(sequential) == 8 and execution['experiments_per_second'] > 0
+    
+    print("Parallel experiments matched the sequential run")
+    return True
+
+
+def test_stage_tree():
+    """Test that optimizer experiments compute each shared stage node once."""
+    print("=== Testing Optimizer Stage Tree ===")
+    
+    import tempfile
+    import numpy as np
+    from rule_parser import RuleConfig, AnalysisType
+    from stage_cache import StageMemo
+    import optimizer
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        depth = np.zeros((30, 30), dtype=np.float32)
+        depth[2:4, 2:4] = 0.2     # 4 cells
+        depth[10:15, 10:15] = 0.6  # 25 cells
+        depth[20:28, 3:10] = 1.0   # 56 cells
+        path = os.path.join(tmp, "raster", "db", "grp", "sim_1", "DEPTH2D_00000.tif")
+        write_test_raster(path, depth)
+        rule = RuleConfig(name="depth", analysis_type=AnalysisType.THRESHOLD, attributes=["DEPTH2D"],
+                          thresholds={}, clustering={}, visualization={}, outputs={}, baseline_id=1)
+        params = optimizer.OptimizationParams(threshold_values=[0.1, 0.5], min_size_values=[1, 10, 30])
+        
+        param_optimizer = optimizer.ParameterOptimizer(tmp, os.path.join(tmp, "experiments"), workers=1)
+        processor = param_optimizer.cluster_processor
+        processor.configure_stage_cache(False)
+        experiments = [(str(i), p) for i, p in
+                       enumerate(param_optimizer.generate_parameter_combinations(rule, params))]
+        assert [len(branch) for branch in param_optimizer.stage_branches(rule, experiments)] == [3, 3]
+        
+        results = param_optimizer.optimize_rule(rule, params)
+        assert [r.clusters_count for r in results] == [3, 2, 1, 2, 2, 1]
+        nodes = param_optimizer.execution['stage_tree']
+        assert nodes['mask'] == {'computed': 2, 'reused': 0}
+        assert nodes['components'] == {'computed': 2, 'reused': 4}
+        assert nodes['labels']['computed'] == 6 and processor.stage_memo is None
+        
+        # Filtering the shared components gives the direct labeling
+        analyzer = processor.cluster_analyzer
+        mask = analyzer.apply_threshold(depth, 0.1)
+        for min_size in (1, 10, 30):
+            assert np.array_equal(analyzer.filter_components(analyzer.label_components(mask), min_size),
+                                  analyzer.connected_components_clustering(mask, min_size))
+        
+        memo = StageMemo(max_bytes=150)
+        memo.put("a", {'data': np.zeros(10, np.int64)})
+        memo.put("b", {'data': np.zeros(10, np.int64)})
+        assert memo.get("a", "mask") is None and not memo.get("b", "mask")[0]['data'].flags.writeable
+    
+    print("Shared stage nodes were computed once per branch")
+    return True
+
+
+def test_search_strategies():
+    """Test the adaptive search strategies of the parameter optimizer."""
+    print("=== Testing Search Strategies ===")
+    
+    import json
+    import tempfile
+    import numpy as np
+    from rasterio.transform import from_origin
+    from rule_parser import RuleConfig, AnalysisType
+    from pixel_sample import PixelSample
+    from search_strategies import SearchSpace
+    import optimizer
+    
+    sample = PixelSample(1 / 9, seed=3)
+    data, meta = sample.apply(np.arange(900, dtype=np.float32).reshape(30, 30),
+                              {'transform': from_origin(0, 30, 1, 1), 'width': 30, 'height': 30})
+    row, col = sample.offsets()
+    assert sample.stride == 3 and data.shape == (10, 10) and data[0, 0] == row * 30 + col
+    assert meta['transform'].a == 3 and meta['width'] == 10 and sample.cells(50) == 6
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        depth = np.zeros((30, 30), dtype=np.float32)
+        depth[2:4, 2:4] = 0.2
+        depth[10:15, 10:15] = 0.6
+        depth[20:28, 3:10] = 1.0
+        path = os.path.join(tmp, "raster", "db", "grp", "sim_1", "DEPTH2D_00000.tif")
+        write_test_raster(path, depth)
+        rule = RuleConfig(name="depth", analysis_type=AnalysisType.THRESHOLD, attributes=["DEPTH2D"],
+                          thresholds={'depth_threshold': 0.5}, clustering={'method': 'connected_components',
+                                                                           'min_size': 10},
+                          visualization={}, outputs={}, baseline_id=1)
+        experiments_dir = os.path.join(tmp, "experiments")
+        space = SearchSpace(threshold_range=(0.05, 0.9), min_size_range=(1, 60))
+        
+        # Successive halving, warm-started from the rule and a previous run
+        param_optimizer = optimizer.ParameterOptimizer(tmp, experiments_dir, strategy="halving", budget=9,
+                                                       search_space=space)
+        param_optimizer.cluster_processor.configure_stage_cache(False)
+        with open(os.path.join(experiments_dir, "depth_best_params.json"), 'w', encoding='utf-8') as f:
+            json.dump({'best_parameters': {'clustering': {'method': 'connected_components', 'min_size': 5},
+                                           'thresholds': {'depth_threshold': 0.1}}}, f)
+        results = param_optimizer.optimize_rule(rule, optimizer.OptimizationParams())
+        search = param_optimizer.execution['search']
+        assert search['warm_start'] == 2 and [r['candidates'] for r in search['rungs']][0] == 9
+        assert [r['fraction'] for r in search['rungs']] == [1 / 9, 1 / 3, 1.0]
+        full = [r for r in results if 'pixel_sample' not in r.parameters]
+        assert len(full) == search['rungs'][-1]['candidates'] < 9
+        # The warm start reaches full resolution, so the search never ends below the rule's parameters
+        assert full[0].parameters['thresholds'] == {'depth_threshold': 0.5}
+        best = param_optimizer.find_best_parameters(results)
+        assert 'pixel_sample' not in best['best_parameters']
+        assert best['best_metrics']['composite_score'] >= full[0].metrics['composite_score']
+        
+        for strategy, budget in (("random", 5), ("bayes", 8)):
+            param_optimizer = optimizer.ParameterOptimizer(tmp, experiments_dir, strategy=strategy, budget=budget,
+                                                           search_space=space)
+            param_optimizer.cluster_processor.configure_stage_cache(False)
+            results = param_optimizer.optimize_rule(rule, optimizer.OptimizationParams())
+            keys = {json.dumps(r.parameters, sort_keys=True) for r in results}
+            assert len(results) == len(keys) == budget
+            assert all('pixel_sample' not in r.parameters for r in results)
+    
+    print("Adaptive strategies searched within their budgets")
+    return True
+
+
+def test_sample_metrics():
+    """Test the sampled and closed-form cluster quality metrics."""
+    print("=== Testing Sample Metrics ===")
+    
+    import tempfile
+    import numpy as np
+    from sklearn.metrics import calinski_harabasz_score, silhouette_score
+    from rule_parser import RuleConfig, AnalysisType
+    from sample_metrics import stratified_sample, calinski_harabasz, davies_bouldin, sample_silhouette
+    import optimizer
+    
+    rng = np.random.default_rng(0)
+    labels = rng.integers(1, 5, (60, 80))
+    labels[:2, :2] = 9                      # a 4-pixel cluster
+    labels[-1, :] = -9999
+    values = rng.normal(labels * 2.0, 1.0)
+    
+    sample_values, sample_labels = stratified_sample(labels, values, size=500, seed=1)
+    counts = {int(l): int(c) for l, c in zip(*np.unique(sample_labels, return_counts=True))}
+    assert counts == {1: 100, 2: 100, 3: 100, 4: 100, 9: 4}
+    assert np.array_equal(np.sort(values[labels == 9]), np.sort(sample_values[sample_labels == 9]))
+    # More clusters than the sample size: one pixel from each of `size` clusters
+    _, many_labels = stratified_sample(np.arange(1, 101).reshape(10, 10), values[:10, :10], size=30)
+    assert many_labels.size == 30 and np.unique(many_labels).size == 30
+    
+    # Closed forms over per-label sums
+    valid = labels > 0
+    ids = np.unique(labels[valid])
+    n = np.array([(labels == i).sum() for i in ids], dtype=np.float64)
+    means = np.array([values[labels == i].mean() for i in ids])
+    stds = np.array([values[labels == i].std() for i in ids])
+    assert np.isclose(calinski_harabasz(n, means, stds),
+                      calinski_harabasz_score(values[valid].reshape(-1, 1), labels[valid]))
+    k = len(ids)
+    assert np.isclose(davies_bouldin(means, stds),
+                      np.mean([max((stds[i] + stds[j]) / abs(means[i] - means[j]) for j in range(k) if j != i)
+                               for i in range(k)]))
+    
+    # The exact silhouette, whatever the sample size
+    for size in (500, 4000):
+        sample_values, sample_labels = stratified_sample(labels, values, size=size, seed=1)
+        assert np.isclose(sample_silhouette(sample_values, sample_labels),
+                          silhouette_score(sample_values.reshape(-1, 1), sample_labels))
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        depth = np.zeros((30, 30), dtype=np.float32)
+        depth[2:6, 2:6] = 0.2
+        depth[10:15, 10:15] = 0.6
+        depth[20:28, 3:10] = 1.0
+        path = os.path.join(tmp, "raster", "db", "grp", "sim_1", "DEPTH2D_00000.tif")
+        write_test_raster(path, depth)
+        rule = RuleConfig(name="depth", analysis_type=AnalysisType.THRESHOLD, attributes=["DEPTH2D"],
+                          thresholds={'depth_threshold': 0.1}, clustering={'method': 'connected_components',
+                                                                           'min_size': 1},
+                          visualization={}, outputs={}, baseline_id=1)
+        for sample_size, silhouette in ((50, 1.0), (0, -1.0)):
+            param_optimizer = optimizer.ParameterOptimizer(tmp, os.path.join(tmp, "experiments"),
+                                                           metrics_sample_size=sample_size)
+            result = param_optimizer.run_experiment(rule, {}, "depth_000")
+            # Constant-valued clusters: perfectly separated in value
+            assert result.clusters_count == 3 and result.metrics['silhouette_score'] == silhouette
+            assert result.metrics['calinski_harabasz_score'] == 1.0 and result.metrics['davies_bouldin_rms_score'] == 0.0
+    
+    print("Quality metrics computed from per-label sums and a stratified sample")
+    return True
+
+
 def main():
     """Run all tests."""
     print("Cluster Analysis Pipeline - Basic Tests")
@@ -133,7 +1312,31 @@ def main():
         ("File Structure", test_file_structure),
         ("Directory Structure", test_directory_structure), 
         ("Rule Configurations", test_rule_configs),
-        ("Rule Parsing", test_rule_parsing)
+        ("Rule Parsing", test_rule_parsing),
+        ("Labeled Statistics", test_label_statistics),
+        ("Small Component Filter", test_small_component_filter),
+        ("Tiled Labeling", test_tiled_labeling),
+        ("Raster Catalog", test_raster_catalog),
+        ("Raster Caches", test_raster_caches),
+        ("Raster Time Cube", test_raster_cube),
+        ("Raster Envelope", test_raster_envelope),
+        ("1-D K-Means", test_kmeans_1d),
+        ("Spatial K-Means", test_spatial_kmeans),
+        ("Grid DBSCAN", test_grid_dbscan),
+        ("Label Polygonization", test_polygonize),
+        ("Polygon Level of Detail", test_polygon_lod),
+        ("Raster Expressions", test_raster_expression),
+        ("Required Rule Inputs", test_required_inputs),
+        ("Parallel Rule Scheduling", test_parallel_rules),
+        ("Shared Rasters", test_shared_rasters),
+        ("Export Orchestrator", test_export_orchestrator),
+        ("Export Planner", test_export_planner),
+        ("Stage Cache", test_stage_cache),
+        ("Raster Watcher", test_raster_watcher),
+        ("Parallel Experiments", test_parallel_experiments),
+        ("Optimizer Stage Tree", test_stage_tree),
+        ("Search Strategies", test_search_strategies),
+        ("Sample Metrics", test_sample_metrics)
     ]
     
     results = []
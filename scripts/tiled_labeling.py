@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Tiled Connected-Component Labeling
+
+Out-of-core labeling for rasters that do not fit in memory. Source rasters are
+read tile by tile through rasterio windows, each tile is labeled with
+scipy.ndimage.label, and labels touching across tile seams are merged with a
+union-find table. Per-label statistics are accumulated per tile, and the label
+raster itself lives in a disk-backed memmap, so memory stays bounded by the
+tile size.
+"""
+
+import os
+import shutil
+import tempfile
+import logging
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+from scipy.ndimage import label
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from label_stats import LabelStatistics, compute_label_statistics, label_dtype, NODATA
+
+
+# window_fn(arrays) -> (foreground mask, values for statistics, valid-data mask)
+WindowFunction = Callable[[Dict[str, np.ndarray]], Tuple[np.ndarray, np.ndarray, np.ndarray]]
+
+
+def iter_tiles(height: int, width: int, tile_size: int) -> Iterator[Tuple[int, int, int, int]]:
+    """Yield (row0, row1, col0, col1) tile bounds in row-major order."""
+    for row0 in range(0, height, tile_size):
+        for col0 in range(0, width, tile_size):
+            yield row0, min(row0 + tile_size, height), col0, min(col0 + tile_size, width)
+
+
+class UnionFind:
+    """Sparse union-find over label ids; ids never unioned are their own roots."""
+
+    def __init__(self):
+        self.parent: Dict[int, int] = {}
+
+    def find(self, x: int) -> int:
+        root = x
+        while self.parent.get(root, root) != root:
+            root = self.parent[root]
+        # Path compression
+        while x != root:
+            nxt = self.parent.get(x, x)
+            self.parent[x] = root
+            x = nxt
+        return root
+
+    def union(self, a: int, b: int) -> None:
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            # Smaller id becomes the root, so roots point "backwards" in scan order
+            if ra < rb:
+                self.parent[rb] = ra
+            else:
+                self.parent[ra] = rb
+
+    def resolve(self, n_labels: int) -> np.ndarray:
+        """Return an array mapping every label id 0..n_labels to its root."""
+        roots = np.arange(n_labels + 1, dtype=np.int64)
+        for x in list(self.parent.keys()):
+            roots[x] = self.find(x)
+        return roots
+
+
+class TiledLabelResult:
+    """Label raster (disk-backed) plus per-label statistics from a tiled run."""
+
+    def __init__(self, labels: np.ndarray, stats: LabelStatistics, meta: Dict, work_dir: str):
+        self.labels = labels
+        self.stats = stats
+        self.meta = meta
+        self.work_dir = work_dir
+
+    def close(self) -> None:
+        """Release the memmap and remove its backing files."""
+        self.labels = None
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+class TiledLabeler:
+    """Connected-component labeling over rasterio windows with cross-tile merging."""
+
+    def __init__(self, tile_size: int = 1024, work_dir: Optional[str] = None):
+        self.tile_size = int(tile_size)
+        self.work_dir = work_dir
+        self.logger = logging.getLogger(__name__)
+
+    def label(self, sources: Dict[str, str], window_fn: WindowFunction,
+              min_size: int = 1) -> TiledLabelResult:
+        """Label the foreground computed by `window_fn` over the source rasters.
+
+        Args:
+            sources: Mapping of name -> GeoTIFF path; all must share one grid
+            window_fn: Computes (foreground, values, valid) from the tile arrays
+            min_size: Components smaller than this many pixels are dropped
+
+        Returns:
+            TiledLabelResult with labels numbered 1..n (0 background, -9999 nodata)
+        """
+        if self.work_dir:
+            os.makedirs(self.work_dir, exist_ok=True)
+        work_dir = tempfile.mkdtemp(prefix="tiled_labels_", dir=self.work_dir)
+
+        datasets = {name: rasterio.open(path) for name, path in sources.items()}
+        try:
+            first = next(iter(datasets.values()))
+            height, width = first.height, first.width
+            for name, ds in datasets.items():
+                if (ds.height, ds.width) != (height, width):
+                    raise ValueError(f"Raster {name} has shape {(ds.height, ds.width)}, expected {(height, width)}")
+            meta = {
+                'transform': first.transform,
+                'crs': first.crs,
+                'width': width,
+                'height': height,
+                'bounds': first.bounds,
+                'nodata': first.nodata
+            }
+
+            provisional = np.lib.format.open_memmap(
+                os.path.join(work_dir, "provisional.npy"), mode='w+', dtype=np.int32, shape=(height, width)
+            )
+            uf = UnionFind()
+            tile_stats: List[Tuple[int, int, int, LabelStatistics]] = []
+            next_label = 0
+
+            # Pass 1: label each tile, record statistics, union labels across seams
+            for row0, row1, col0, col1 in iter_tiles(height, width, self.tile_size):
+                window = Window(col0, row0, col1 - col0, row1 - row0)
+                arrays = {name: ds.read(1, window=window) for name, ds in datasets.items()}
+                foreground, values, valid = window_fn(arrays)
+
+                local, n_local = label(foreground)
+                if next_label + n_local > np.iinfo(np.int32).max:
+                    raise ValueError("Too many provisional labels for tiled labeling; increase tile_size")
+
+                tile_labels = np.where(local > 0, local + next_label, 0).astype(np.int32)
+                tile_labels[~valid] = NODATA
+                provisional[row0:row1, col0:col1] = tile_labels
+
+                if n_local:
+                    tile_stats.append((next_label, row0, col0, compute_label_statistics(local, values)))
+
+                # Seams with the tile above and the tile to the left (4-connectivity)
+                if row0 > 0:
+                    self._union_seam(uf, provisional[row0 - 1, col0:col1], tile_labels[0, :])
+                if col0 > 0:
+                    self._union_seam(uf, provisional[row0:row1, col0 - 1], tile_labels[:, 0])
+
+                next_label += n_local
+
+            # Merge per-tile statistics by root label and apply the size filter
+            roots = uf.resolve(next_label)
+            stats, final_lut = self._merge_statistics(tile_stats, roots, next_label, min_size)
+
+            # Pass 2: rewrite provisional labels into compact final labels
+            labels = np.lib.format.open_memmap(
+                os.path.join(work_dir, "labels.npy"), mode='w+', dtype=final_lut.dtype, shape=(height, width)
+            )
+            for row0, row1, col0, col1 in iter_tiles(height, width, self.tile_size):
+                prov = np.asarray(provisional[row0:row1, col0:col1])
+                out = final_lut[np.maximum(prov, 0)]
+                out[prov == NODATA] = NODATA
+                labels[row0:row1, col0:col1] = out
+            labels.flush()
+            del provisional
+            os.remove(os.path.join(work_dir, "provisional.npy"))
+
+            self.logger.info(f"Tiled labeling: {next_label} provisional labels -> {len(stats)} clusters")
+            return TiledLabelResult(labels, stats, meta, work_dir)
+
+        except Exception:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            raise
+        finally:
+            for ds in datasets.values():
+                ds.close()
+
+    @staticmethod
+    def _union_seam(uf: UnionFind, previous: np.ndarray, current: np.ndarray) -> None:
+        """Union labels facing each other across a tile seam."""
+        previous = np.asarray(previous)
+        touching = (previous > 0) & (current > 0)
+        if not touching.any():
+            return
+        pairs = np.unique(np.stack([previous[touching], current[touching]], axis=1), axis=0)
+        for a, b in pairs:
+            uf.union(int(a), int(b))
+
+    @staticmethod
+    def _merge_statistics(tile_stats: List[Tuple[int, int, int, LabelStatistics]], roots: np.ndarray,
+                          n_labels: int, min_size: int) -> Tuple[LabelStatistics, np.ndarray]:
+        """Aggregate provisional-label statistics onto their roots.
+
+        Returns:
+            Tuple of (statistics for surviving labels 1..n, provisional -> final label lookup table)
+        """
+        size = n_labels + 1
+        count = np.zeros(size, dtype=np.int64)
+        sums = np.zeros(size)
+        sum_sq = np.zeros(size)
+        mins = np.full(size, np.inf)
+        maxs = np.full(size, -np.inf)
+        row_sum = np.zeros(size)
+        col_sum = np.zeros(size)
+        row_min = np.full(size, np.iinfo(np.int64).max)
+        row_max = np.full(size, -1)
+        col_min = np.full(size, np.iinfo(np.int64).max)
+        col_max = np.full(size, -1)
+
+        for offset, row0, col0, ts in tile_stats:
+            ids = roots[ts.labels + offset]
+            np.add.at(count, ids, ts.count)
+            np.add.at(sums, ids, ts.sum)
+            np.add.at(sum_sq, ids, ts.sum_sq)
+            np.minimum.at(mins, ids, ts.min)
+            np.maximum.at(maxs, ids, ts.max)
+            np.add.at(row_sum, ids, (ts.centroid_row + row0) * ts.count)
+            np.add.at(col_sum, ids, (ts.centroid_col + col0) * ts.count)
+            r_start = np.array([s[0].start for s in ts.slices]) + row0
+            r_stop = np.array([s[0].stop for s in ts.slices]) + row0
+            c_start = np.array([s[1].start for s in ts.slices]) + col0
+            c_stop = np.array([s[1].stop for s in ts.slices]) + col0
+            np.minimum.at(row_min, ids, r_start)
+            np.maximum.at(row_max, ids, r_stop)
+            np.minimum.at(col_min, ids, c_start)
+            np.maximum.at(col_max, ids, c_stop)
+
+        keep = count >= max(min_size, 1)
+        keep[0] = False
+        kept = np.flatnonzero(keep)
+        n_kept = len(kept)
+
+        dtype = label_dtype(n_kept)
+        root_to_final = np.zeros(size, dtype=dtype)
+        root_to_final[kept] = np.arange(1, n_kept + 1, dtype=dtype)
+        final_lut = root_to_final[roots]
+
+        stats = LabelStatistics(
+            labels=np.arange(1, n_kept + 1, dtype=np.int64),
+            count=count[kept],
+            sum=sums[kept],
+            sum_sq=sum_sq[kept],
+            min=mins[kept],
+            max=maxs[kept],
+            centroid_row=row_sum[kept] / count[kept],
+            centroid_col=col_sum[kept] / count[kept],
+            slices=[(slice(int(r0), int(r1)), slice(int(c0), int(c1)))
+                    for r0, r1, c0, c1 in zip(row_min[kept], row_max[kept], col_min[kept], col_max[kept])]
+        )
+        return stats, final_lut
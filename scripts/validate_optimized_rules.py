@@ -19,6 +19,7 @@ from rule_parser import RuleParser
 from compare_runs import RunComparator
 from verify_pipeline_results import PipelineVerifier
 from crash_recovery import CrashRecovery, SafeErrorLogger, safe_execute
+from stage_cache import combine_stage_stats
 import sys
 
 
@@ -159,8 +160,9 @@ class OptimizedRuleValidator:
                 disable_git=True  # Don't commit during validation
             )
             
-            # Run single rule
+            # Run single rule; unchanged stages are served from the stage cache
             rule_result = runner.run_single_rule(rule_name, export_rasters=export_rasters)
+            validation_result['stage_cache'] = runner.stage_cache_stats()
             
             if rule_result:
                 validation_result['pipeline_run_successful'] = True
@@ -306,11 +308,14 @@ class OptimizedRuleValidator:
             'errors': sum(1 for r in validation_results.values() if r.get('status') == 'error')
         }
         
+        stage_stats = [r['stage_cache'] for r in validation_results.values() if r.get('stage_cache')]
+        
         return {
             'timestamp': datetime.now().isoformat(),
             'total_rules': len(validation_results),
             'validated_rules': validation_results,
-            'summary': summary
+            'summary': summary,
+            'stage_cache': combine_stage_stats(stage_stats) if stage_stats else None
         }
     
     def generate_validation_report(self, validation_results: Dict[str, Any]) -> str:
@@ -332,7 +337,12 @@ class OptimizedRuleValidator:
             f.write(f"- **⚠️ Improved:** {summary.get('improved', 0)}\n")
             f.write(f"- **❌ Failed:** {summary.get('failed', 0)}\n")
             f.write(f"- **📉 Regression:** {summary.get('regression', 0)}\n")
-            f.write(f"- **⚠️ Errors:** {summary.get('errors', 0)}\n\n")
+            f.write(f"- **⚠️ Errors:** {summary.get('errors', 0)}\n")
+            stage_cache = validation_results.get('stage_cache')
+            if stage_cache:
+                f.write(f"- **Stage cache:** {stage_cache['hits']} hits / {stage_cache['misses']} misses "
+                        f"({stage_cache['hit_rate']:.0%})\n")
+            f.write("\n")
             
             # Comparison table
             f.write(f"## Validation Results by Rule\n\n")
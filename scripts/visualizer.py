@@ -18,7 +18,8 @@ from typing import Dict, List, Tuple, Any, Optional
 import json
 import logging
 from dataclasses import dataclass
-from cluster_processor import AnalysisResult, ClusterMetrics
+from cluster_processor import AnalysisResult, ClusterMetrics, RasterProcessor
+from polygon_lod import tier_geometry
 
 
 @dataclass
@@ -32,13 +33,17 @@ class VisualizationConfig:
     dpi: int = 100
     animation_fps: int = 2
     overlay_alpha: float = 0.7
+    polygon_tier: str = "simplified"  # polygon detail tier drawn with draw_mesh (see polygon_lod.py)
 
 
 class RasterVisualizer:
     """Handles visualization of raster data and cluster overlays."""
     
-    def __init__(self, output_dir: str = "data/output/viz"):
+    def __init__(self, output_dir: str = "data/output/viz",
+                 raster_processor: Optional[RasterProcessor] = None):
         self.output_dir = output_dir
+        # Base rasters load through RasterProcessor so they share the process-wide raster cache
+        self.raster_processor = raster_processor or RasterProcessor()
         self.logger = logging.getLogger(__name__)
         os.makedirs(output_dir, exist_ok=True)
     
@@ -247,48 +252,21 @@ class RasterVisualizer:
             raise
     
     def _find_base_raster(self, rule_name: str) -> Optional[str]:
-        """Find a base raster file for overlay visualization."""
-        # Search structured first: data/output/<db>/<group>/<run>/rasters/sim_*/
-        search_roots = []
-        base = os.path.join("data", "output")
-        if os.path.exists(base):
-            for db in os.listdir(base):
-                dbp = os.path.join(base, db)
-                if not os.path.isdir(dbp):
-                    continue
-                for grp in os.listdir(dbp):
-                    grpp = os.path.join(dbp, grp)
-                    if not os.path.isdir(grpp):
-                        continue
-                    for run in os.listdir(grpp):
-                        runp = os.path.join(grpp, run, "rasters")
-                        if os.path.isdir(runp):
-                            search_roots.append(runp)
-        # Legacy location
-        legacy = os.path.join("data", "output", "rasters")
-        if os.path.isdir(legacy):
-            search_roots.append(legacy)
-
-        for root_dir in search_roots:
-            for root, _, files in os.walk(root_dir):
-                for file in files:
-                    if file.endswith('.tif'):
-                        return os.path.join(root, file)
-        return None
+        """Find a base raster file for overlay visualization (via the raster catalog)."""
+        return self.raster_processor.catalog.first_raster()
     
     def _plot_base_raster(self, ax, raster_path: str, raster_info: Dict[str, Any]) -> None:
         """Plot the base raster as background."""
         try:
-            with rasterio.open(raster_path) as src:
-                data = src.read(1)
-                transform = src.transform
-                
-                # Plot raster as background
-                im = ax.imshow(data, extent=[
-                    transform.c, transform.c + transform.a * src.width,
-                    transform.f + transform.e * src.height, transform.f
-                ], cmap='gray', alpha=0.3)
-                
+            data, meta = self.raster_processor.load_raster(raster_path)
+            transform = meta['transform']
+            
+            # Plot raster as background
+            im = ax.imshow(data, extent=[
+                transform.c, transform.c + transform.a * meta['width'],
+                transform.f + transform.e * meta['height'], transform.f
+            ], cmap='gray', alpha=0.3)
+            
         except Exception as e:
             self.logger.warning(f"Could not plot base raster: {e}")
     
@@ -322,12 +300,16 @@ class RasterVisualizer:
         # Plot cluster polygons if available
         if config.draw_mesh:
             for cluster in clusters:
-                if cluster.polygon:
+                geometry = tier_geometry(cluster, config.polygon_tier)
+                if geometry:
                     try:
                         from shapely.geometry import shape
-                        geom = shape(cluster.polygon)
-                        x, y = geom.exterior.xy
-                        ax.plot(x, y, 'k-', alpha=0.5, linewidth=1)
+                        geom = shape(geometry)
+                        parts = geom.geoms if geom.geom_type == 'MultiPolygon' else [geom]
+                        for part in parts:
+                            for ring in [part.exterior, *part.interiors]:
+                                x, y = ring.xy
+                                ax.plot(x, y, 'k-', alpha=0.5, linewidth=1)
                     except Exception as e:
                         self.logger.warning(f"Could not plot cluster polygon: {e}")
 